@@ -21,6 +21,7 @@
 use App\Services\PresignedUrlService;
 use App\Services\TokenLedgerService;
 use App\Services\WorkerAuditService;
+use App\Services\WorkflowPayloadService;
 use Carbon\Carbon;
 use Carbon\CarbonInterface;
 use Illuminate\Http\JsonResponse;
@@ -34,7 +35,14 @@
 class ComfyUiWorkerController extends BaseController
 {
     private const DEFAULT_LEASE_TTL_SECONDS = 900;
+    private const DEFAULT_POLL_MAX_WAIT_SECONDS = 20;
+    private const DEFAULT_POLL_WAIT_INTERVAL_MS = 500;
+    private const DEFAULT_POLL_PROBE_INTERVAL_SECONDS = 5;
+    private const DEFAULT_POLL_MAX_BATCH = 10;
     private const DEFAULT_MAX_ATTEMPTS = 3;
+    private const OUTPUT_MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024;
+    private const OUTPUT_MULTIPART_TARGET_PART_SIZE = 16 * 1024 * 1024;
+    private const OUTPUT_MULTIPART_MAX_PARTS = 10000;
 
     /**
      * Fleet self-registration: ASG workers register themselves to receive a token.
@@ -278,6 +286,10 @@ public function poll(Request $request): JsonResponse
             'capabilities' => 'array|nullable',
             'current_load' => 'integer|nullable|min:0',
             'max_concurrency' => 'integer|nullable|min:0',
+            'wait_seconds' => 'integer|nullable|min:0',
+            'max_jobs' => 'integer|nullable|min:1',
+            'workflow_hashes' => 'array|nullable|max:256',
+            'workflow_hashes.*' => 'string|max:64',
         ]);
 
         if ($validator->fails()) {
@@ -288,48 +300,90 @@ public function poll(Request $request): JsonResponse
         $worker = $this->updateWorkerFromRequest($authenticatedWorker, $request);
 
         if ($worker->is_draining) {
-            return $this->sendResponse(['job' => null], 'Worker draining');
+            return $this->sendEmptyPoll('Worker draining');
         }
 
         if ($worker->current_load >= $worker->max_concurrency) {
-            return $this->sendResponse(['job' => null], 'Worker at capacity');
+            return $this->sendEmptyPoll('Worker at capacity');
         }
 
+        // Long-poll: hold the request open until a dispatch can be leased or the wait runs out
+        $maxWaitSeconds = (int) config('services.comfyui.poll_max_wait_seconds', self::DEFAULT_POLL_MAX_WAIT_SECONDS);
+        $waitSeconds = min((int) $request->input('wait_seconds', 0), max(0, $maxWaitSeconds));
+        $waitIntervalMs = max(50, (int) config('services.comfyui.poll_wait_interval_ms', self::DEFAULT_POLL_WAIT_INTERVAL_MS));
+        $probeIntervalSeconds = max(1, (int) config('services.comfyui.poll_probe_interval_seconds', self::DEFAULT_POLL_PROBE_INTERVAL_SECONDS));
+        $deadline = microtime(true) + $waitSeconds;
+        $signal = $waitSeconds > 0 ? AiJobDispatch::queuedSignal() : null;
+
         $leaseTtlSeconds = (int) config('services.comfyui.lease_ttl_seconds', self::DEFAULT_LEASE_TTL_SECONDS);
         $maxAttempts = (int) config('services.comfyui.max_attempts', self::DEFAULT_MAX_ATTEMPTS);
         // Get worker's assigned workflow IDs for dispatch filtering
         $workflowIds = $worker->workflows()->pluck('workflows.id')->toArray();
 
-        $dispatch = $this->leaseDispatch(
-            $worker->worker_id,
-            $leaseTtlSeconds,
-            $maxAttempts,
-            $workflowIds,
-            $worker->stage ?: 'production'
+        // Batch lease: fill up to max_jobs free slots in one round trip (one job when omitted)
+        $maxBatch = max(1, (int) config('services.comfyui.poll_max_batch', self::DEFAULT_POLL_MAX_BATCH));
+        $limit = min(
+            (int) $request->input('max_jobs', 1),
+            $worker->max_concurrency - $worker->current_load,
+            $maxBatch
         );
-        if (!$dispatch) {
-            return $this->sendResponse(['job' => null], 'No jobs available');
+
+        $stage = $worker->stage ?: 'production';
+        $dispatches = $this->leaseDispatches($worker->worker_id, $leaseTtlSeconds, $maxAttempts, $workflowIds, $stage, $limit);
+        $nextProbeAt = microtime(true) + $probeIntervalSeconds;
+        while (!$dispatches && microtime(true) < $deadline) {
+            usleep((int) min($waitIntervalMs * 1000, max(0, $deadline - microtime(true)) * 1000000));
+            // Each interval only reads the queued-dispatch cache key. The table is probed when that key
+            // changes, and every probe interval for leases that expired (which raise no signal).
+            $current = AiJobDispatch::queuedSignal();
+            $probeDue = microtime(true) >= $nextProbeAt;
+            if ($current === $signal && !$probeDue) {
+                continue;
+            }
+            $signal = $current;
+            if ($probeDue) {
+                $nextProbeAt = microtime(true) + $probeIntervalSeconds;
+            }
+            // Cheap unlocked probe first; only take the row lock when something looks leasable
+            if ($this->hasLeasableDispatch($maxAttempts, $workflowIds, $stage)) {
+                $dispatches = $this->leaseDispatches($worker->worker_id, $leaseTtlSeconds, $maxAttempts, $workflowIds, $stage, $limit);
+            }
         }
+        if (!$dispatches) {
+            return $this->sendEmptyPoll('No jobs available', $waitSeconds);
+        }
+
+        $cachedWorkflowHashes = array_values((array) $request->input('workflow_hashes', []));
+        $payloads = [];
+        foreach ($dispatches as $dispatch) {
+            $payload = $this->buildJobPayload($dispatch, $cachedWorkflowHashes);
+            if (!$payload) {
+                continue;
+            }
+            $payloads[] = $payload;
 
-        $payload = $this->buildJobPayload($dispatch);
-        if (!$payload) {
-            return $this->sendResponse(['job' => null], 'No job payload available');
+            // Audit log on job leased
+            try {
+                app(WorkerAuditService::class)->log(
+                    'poll',
+                    $worker->id,
+                    $worker->worker_id,
+                    $dispatch->id,
+                    $request->ip()
+                );
+            } catch (\Throwable $e) {
+                // non-blocking
+            }
         }
 
-        // Audit log on job leased
-        try {
-            app(WorkerAuditService::class)->log(
-                'poll',
-                $worker->id,
-                $worker->worker_id,
-                $dispatch->id,
-                $request->ip()
-            );
-        } catch (\Throwable $e) {
-            // non-blocking
+        if (!$payloads) {
+            return $this->sendEmptyPoll('No job payload available');
         }
 
-        return $this->sendResponse(['job' => $payload], 'Job leased');
+        return $this->sendResponse([
+            'job' => $payloads[0],
+            'jobs' => $payloads,
+        ], count($payloads) > 1 ? 'Jobs leased' : 'Job leased');
     }
 
     public function heartbeat(Request $request): JsonResponse
@@ -350,10 +404,8 @@ public function heartbeat(Request $request): JsonResponse
         }
 
         $leaseTtlSeconds = (int) config('services.comfyui.lease_ttl_seconds', self::DEFAULT_LEASE_TTL_SECONDS);
-        $base = $dispatch->lease_expires_at && $dispatch->lease_expires_at->gt(now())
-            ? $dispatch->lease_expires_at
-            : now();
-        $dispatch->lease_expires_at = $base->copy()->addSeconds($leaseTtlSeconds);
+        // Extend from now, not from the current expiry, so frequent heartbeats never stack up lease time.
+        $dispatch->lease_expires_at = now()->addSeconds($leaseTtlSeconds);
         $dispatch->save();
 
         if ($request->filled('worker_id')) {
@@ -391,6 +443,10 @@ public function complete(Request $request, TokenLedgerService $ledger, OutputVal
             'output.metadata.partner_usage_events.*.cost_usd_reported' => 'numeric|nullable|min:0',
             'output.metadata.partner_usage_events.*.usage_json' => 'array|nullable',
             'output.metadata.partner_usage_events.*.ui_json' => 'array|nullable',
+            'output.metadata.timings' => 'array|nullable',
+            'output.metadata.timings.total_ms' => 'numeric|nullable|min:0',
+            'output.metadata.timings.stages' => 'array|nullable',
+            'output.metadata.timings.stages.*' => 'numeric|min:0',
         ]);
 
         if ($validator->fails()) {
@@ -402,6 +458,8 @@ public function complete(Request $request, TokenLedgerService $ledger, OutputVal
             return $this->sendError('Lease not found.', [], 404);
         }
 
+        $this->applyStageTimings($dispatch, $request);
+
         $result = $this->withTenant($dispatch->tenant_id, function () use ($dispatch, $request, $ledger) {
             $job = AiJob::query()->find($dispatch->tenant_job_id);
             if (!$job) {
@@ -515,6 +573,12 @@ public function fail(Request $request, TokenLedgerService $ledger, WorkerAuditSe
             'lease_token' => 'string|required|max:64',
             'worker_id' => 'string|nullable|max:255',
             'error_message' => 'string|nullable',
+            'output' => 'array|nullable',
+            'output.metadata' => 'array|nullable',
+            'output.metadata.timings' => 'array|nullable',
+            'output.metadata.timings.total_ms' => 'numeric|nullable|min:0',
+            'output.metadata.timings.stages' => 'array|nullable',
+            'output.metadata.timings.stages.*' => 'numeric|min:0',
         ]);
 
         if ($validator->fails()) {
@@ -526,6 +590,8 @@ public function fail(Request $request, TokenLedgerService $ledger, WorkerAuditSe
             return $this->sendError('Lease not found.', [], 404);
         }
 
+        $this->applyStageTimings($dispatch, $request);
+
         $errorMessage = $this->sanitizeWorkerError((string) $request->input('error_message', 'Processing failed. Try another video'));
 
         $this->withTenant($dispatch->tenant_id, function () use ($dispatch, $ledger, $errorMessage, $request) {
@@ -580,6 +646,190 @@ public function fail(Request $request, TokenLedgerService $ledger, WorkerAuditSe
         return $this->sendResponse(['dispatch_id' => $dispatch->id], 'Job failed');
     }
 
+    /**
+     * Raw workflow JSON for a worker to compile and cache by its content hash.
+     */
+    public function workflowTemplate(Request $request, WorkflowPayloadService $workflowPayloads): JsonResponse
+    {
+        $validator = Validator::make($request->all(), [
+            'workflow_id' => 'integer|required',
+        ]);
+
+        if ($validator->fails()) {
+            return $this->sendError('Validation error.', $validator->errors(), 422);
+        }
+
+        $worker = $request->attributes->get('authenticated_worker');
+        $workflow = Workflow::query()->find($request->input('workflow_id'));
+        if (!$workflow || ($worker && !$worker->workflows()->whereKey($workflow->id)->exists())) {
+            return $this->sendError('Workflow not found.', [], 404);
+        }
+
+        try {
+            $template = $workflowPayloads->loadWorkflowTemplate($workflow);
+        } catch (\RuntimeException $e) {
+            return $this->sendError($e->getMessage(), [], 404);
+        }
+
+        return $this->sendResponse([
+            'workflow_id' => $workflow->id,
+            'workflow_hash' => $template['hash'],
+            'workflow' => $template['workflow'],
+            'output_node_id' => $workflow->output_node_id,
+        ], 'Workflow template');
+    }
+
+    /**
+     * Start a multipart upload for a leased job's output file and presign its part URLs.
+     */
+    public function createOutputMultipart(Request $request, PresignedUrlService $presigned): JsonResponse
+    {
+        $validator = Validator::make($request->all(), [
+            'dispatch_id' => 'integer|required',
+            'lease_token' => 'string|required|max:64',
+            'size_bytes' => 'integer|required|min:1',
+            'mime_type' => 'string|nullable|max:255',
+        ]);
+
+        if ($validator->fails()) {
+            return $this->sendError('Validation error.', $validator->errors(), 422);
+        }
+
+        $dispatch = AiJobDispatch::query()->find($request->input('dispatch_id'));
+        if (!$dispatch || $dispatch->lease_token !== $request->input('lease_token')) {
+            return $this->sendError('Lease not found.', [], 404);
+        }
+
+        $outputFile = $this->resolveDispatchOutputFile($dispatch);
+        if (!$outputFile || !$outputFile->disk || !$outputFile->path) {
+            return $this->sendError('Output file not found.', [], 404);
+        }
+
+        $sizeBytes = (int) $request->input('size_bytes');
+        $partSize = max(self::OUTPUT_MULTIPART_MIN_PART_SIZE, self::OUTPUT_MULTIPART_TARGET_PART_SIZE);
+        $partCount = (int) ceil($sizeBytes / $partSize);
+        if ($partCount > self::OUTPUT_MULTIPART_MAX_PARTS) {
+            $partSize = (int) ceil($sizeBytes / self::OUTPUT_MULTIPART_MAX_PARTS);
+            $partSize = max($partSize, self::OUTPUT_MULTIPART_MIN_PART_SIZE);
+            $partCount = (int) ceil($sizeBytes / $partSize);
+        }
+
+        $ttlSeconds = (int) config('services.comfyui.multipart_presigned_ttl_seconds', 0);
+        if ($ttlSeconds <= 0) {
+            $ttlSeconds = (int) config('services.comfyui.presigned_ttl_seconds', self::DEFAULT_LEASE_TTL_SECONDS);
+        }
+
+        try {
+            $uploadId = $presigned->createMultipartUpload(
+                $outputFile->disk,
+                $outputFile->path,
+                $request->input('mime_type') ?: $outputFile->mime_type
+            );
+            $partUrls = $presigned->createMultipartUploadPartUrls(
+                $outputFile->disk,
+                $outputFile->path,
+                $uploadId,
+                $partCount,
+                $ttlSeconds
+            );
+        } catch (\Throwable $e) {
+            return $this->sendError('Upload URL generation failed.', [], 500);
+        }
+
+        return $this->sendResponse([
+            'upload_id' => $uploadId,
+            'part_size' => $partSize,
+            'part_urls' => $partUrls,
+            'expires_in' => $ttlSeconds,
+        ], 'Multipart upload initialized');
+    }
+
+    public function completeOutputMultipart(Request $request, PresignedUrlService $presigned): JsonResponse
+    {
+        $validator = Validator::make($request->all(), [
+            'dispatch_id' => 'integer|required',
+            'lease_token' => 'string|required|max:64',
+            'upload_id' => 'string|required|max:255',
+            'parts' => 'array|required|min:1',
+            'parts.*.part_number' => 'integer|required|min:1',
+            'parts.*.etag' => 'string|required',
+        ]);
+
+        if ($validator->fails()) {
+            return $this->sendError('Validation error.', $validator->errors(), 422);
+        }
+
+        $dispatch = AiJobDispatch::query()->find($request->input('dispatch_id'));
+        if (!$dispatch || $dispatch->lease_token !== $request->input('lease_token')) {
+            return $this->sendError('Lease not found.', [], 404);
+        }
+
+        $outputFile = $this->resolveDispatchOutputFile($dispatch);
+        if (!$outputFile || !$outputFile->disk || !$outputFile->path) {
+            return $this->sendError('Output file not found.', [], 404);
+        }
+
+        try {
+            $presigned->completeMultipartUpload(
+                $outputFile->disk,
+                $outputFile->path,
+                (string) $request->input('upload_id'),
+                (array) $request->input('parts')
+            );
+        } catch (\Throwable $e) {
+            return $this->sendError('Multipart upload completion failed.', [], 500);
+        }
+
+        return $this->sendResponse(['path' => $outputFile->path], 'Multipart upload completed');
+    }
+
+    public function abortOutputMultipart(Request $request, PresignedUrlService $presigned): JsonResponse
+    {
+        $validator = Validator::make($request->all(), [
+            'dispatch_id' => 'integer|required',
+            'lease_token' => 'string|required|max:64',
+            'upload_id' => 'string|required|max:255',
+        ]);
+
+        if ($validator->fails()) {
+            return $this->sendError('Validation error.', $validator->errors(), 422);
+        }
+
+        $dispatch = AiJobDispatch::query()->find($request->input('dispatch_id'));
+        if (!$dispatch || $dispatch->lease_token !== $request->input('lease_token')) {
+            return $this->sendError('Lease not found.', [], 404);
+        }
+
+        $outputFile = $this->resolveDispatchOutputFile($dispatch);
+        if (!$outputFile || !$outputFile->disk || !$outputFile->path) {
+            return $this->sendError('Output file not found.', [], 404);
+        }
+
+        try {
+            $presigned->abortMultipartUpload(
+                $outputFile->disk,
+                $outputFile->path,
+                (string) $request->input('upload_id')
+            );
+        } catch (\Throwable $e) {
+            return $this->sendError('Multipart upload abort failed.', [], 500);
+        }
+
+        return $this->sendNoContent();
+    }
+
+    private function resolveDispatchOutputFile(AiJobDispatch $dispatch): ?File
+    {
+        return $this->withTenant($dispatch->tenant_id, function () use ($dispatch) {
+            $job = AiJob::query()->find($dispatch->tenant_job_id);
+            if (!$job || !$job->output_file_id) {
+                return null;
+            }
+
+            return File::query()->find($job->output_file_id);
+        });
+    }
+
     private function sanitizeWorkerError(string $raw): string
     {
         $trimmed = trim($raw);
@@ -620,15 +870,61 @@ private function updateWorkerFromRequest(ComfyUiWorker $worker, Request $request
         return $worker;
     }
 
-    private function leaseDispatch(
+    /**
+     * Empty poll response. `long_poll` tells workers this backend honours `wait_seconds`.
+     */
+    private function sendEmptyPoll(string $message, int $waitedSeconds = 0): JsonResponse
+    {
+        return $this->sendResponse([
+            'job' => null,
+            'long_poll' => true,
+            'wait_seconds' => $waitedSeconds,
+        ], $message);
+    }
+
+    private function hasLeasableDispatch(int $maxAttempts, array $workflowIds, string $stage): bool
+    {
+        if (empty($workflowIds)) {
+            return false;
+        }
+
+        $now = now();
+
+        return AiJobDispatch::query()
+            ->where('stage', $stage)
+            ->where('attempts', '<', $maxAttempts)
+            ->whereIn('workflow_id', $workflowIds)
+            ->where(function ($q) use ($now) {
+                $q
+                    ->where('status', 'queued')
+                    ->orWhere(function ($sub) use ($now) {
+                        $sub->where('status', 'leased')
+                            ->whereNotNull('lease_expires_at')
+                            ->where('lease_expires_at', '<=', $now);
+                    });
+            })
+            ->exists();
+    }
+
+    /**
+     * Lease up to $limit dispatches in one locking transaction.
+     *
+     * @return AiJobDispatch[]
+     */
+    private function leaseDispatches(
         string $workerId,
         int $leaseTtlSeconds,
         int $maxAttempts,
         array $workflowIds = [],
-        ?string $stage = null
-    ): ?AiJobDispatch
+        ?string $stage = null,
+        int $limit = 1
+    ): array
     {
-        return DB::connection('central')->transaction(function () use ($workerId, $leaseTtlSeconds, $maxAttempts, $workflowIds, $stage) {
+        if ($limit < 1) {
+            return [];
+        }
+
+        return DB::connection('central')->transaction(function () use ($workerId, $leaseTtlSeconds, $maxAttempts, $workflowIds, $stage, $limit) {
             $now = now();
             $effectiveStage = $stage ?: 'production';
 
@@ -648,43 +944,42 @@ private function leaseDispatch(
             // Strict workflow filtering: workers only get jobs for their assigned workflows
             if (empty($workflowIds)) {
                 // Worker has no workflow assignments — gets ZERO jobs
-                return null;
+                return [];
             }
             $query->whereIn('workflow_id', $workflowIds);
 
-            $dispatch = $query
+            $dispatches = $query
                 ->orderByDesc('priority')
                 ->orderBy('created_at')
+                ->limit($limit)
                 ->lockForUpdate()
-                ->first();
-
-            if (!$dispatch) {
-                return null;
-            }
-
-            $dispatch->status = 'leased';
-            $dispatch->worker_id = $workerId;
-            $dispatch->lease_token = Str::uuid()->toString();
-            $dispatch->lease_expires_at = $now->copy()->addSeconds($leaseTtlSeconds);
-            $dispatch->attempts = (int) $dispatch->attempts + 1;
-            $isFirstLease = $dispatch->leased_at === null;
-            $dispatch->leased_at = $dispatch->leased_at ?? $now;
-            $dispatch->last_leased_at = $now;
-            if ($isFirstLease) {
-                $createdAt = $this->dispatchTimestamp($dispatch, 'created_at');
-                if ($createdAt) {
-                    $dispatch->queue_wait_seconds = $this->elapsedSeconds($createdAt, $now);
+                ->get();
+
+            foreach ($dispatches as $dispatch) {
+                $dispatch->status = 'leased';
+                $dispatch->worker_id = $workerId;
+                $dispatch->lease_token = Str::uuid()->toString();
+                $dispatch->lease_expires_at = $now->copy()->addSeconds($leaseTtlSeconds);
+                $dispatch->attempts = (int) $dispatch->attempts + 1;
+                $isFirstLease = $dispatch->leased_at === null;
+                $dispatch->leased_at = $dispatch->leased_at ?? $now;
+                $dispatch->last_leased_at = $now;
+                if ($isFirstLease) {
+                    $createdAt = $this->dispatchTimestamp($dispatch, 'created_at');
+                    if ($createdAt) {
+                        $dispatch->queue_wait_seconds = $this->elapsedSeconds($createdAt, $now);
+                    }
                 }
+                $dispatch->save();
             }
-            $dispatch->save();
 
-            return $dispatch;
+            return $dispatches->all();
         });
     }
 
-    private function buildJobPayload(AiJobDispatch $dispatch): ?array
+    private function buildJobPayload(AiJobDispatch $dispatch, array $cachedWorkflowHashes = []): ?array
     {
-        return $this->withTenant($dispatch->tenant_id, function () use ($dispatch) {
+        return $this->withTenant($dispatch->tenant_id, function () use ($dispatch, $cachedWorkflowHashes) {
             $job = AiJob::query()->find($dispatch->tenant_job_id);
             if (!$job) {
                 $this->markDispatchFailed($dispatch, 'Job not found in tenant DB.');
@@ -753,6 +1048,15 @@ private function buildJobPayload(AiJobDispatch $dispatch): ?array
                 $inputPayload['assets'] = array_values($inputPayload['assets']);
             }
 
+            // The worker already holds this workflow compiled: send only the hash and text values
+            if (
+                !empty($inputPayload['workflow_hash'])
+                && array_key_exists('workflow_values', $inputPayload)
+                && in_array($inputPayload['workflow_hash'], $cachedWorkflowHashes, true)
+            ) {
+                unset($inputPayload['workflow']);
+            }
+
             return [
                 'dispatch_id' => $dispatch->id,
                 'lease_token' => $dispatch->lease_token,
@@ -760,6 +1064,7 @@ private function buildJobPayload(AiJobDispatch $dispatch): ?array
                 'tenant_id' => $dispatch->tenant_id,
                 'job_id' => $job->id,
                 'effect_id' => $job->effect_id,
+                'workflow_id' => $dispatch->workflow_id,
                 'input_payload' => $inputPayload,
                 'input_file' => $inputFile ? [
                     'id' => $inputFile->id,
@@ -854,6 +1159,22 @@ private function updateOutputFile(int $fileId, array $output): void
         }
     }
 
+    /**
+     * Keep the worker's per-stage timings on the dispatch; saved with its final status.
+     * A late or repeated report does not replace the timings of the attempt that finished it.
+     */
+    private function applyStageTimings(AiJobDispatch $dispatch, Request $request): void
+    {
+        if (in_array($dispatch->status, ['completed', 'failed'], true)) {
+            return;
+        }
+
+        $timings = $request->input('output.metadata.timings');
+        if (is_array($timings)) {
+            $dispatch->stage_timings = $timings;
+        }
+    }
+
     private function markDispatchCompleted(AiJobDispatch $dispatch, ?string $workerId): void
     {
         $now = now();
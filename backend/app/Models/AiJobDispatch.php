@@ -2,8 +2,17 @@
 
 namespace App\Models;
 
+use Illuminate\Contracts\Cache\Repository;
+use Illuminate\Support\Facades\Cache;
+use Illuminate\Support\Str;
+
 class AiJobDispatch extends CentralModel
 {
+    /**
+     * Cache key bumped whenever a dispatch becomes queued; long-polling workers watch it instead of the table.
+     */
+    public const QUEUED_SIGNAL_KEY = 'comfyui:dispatch-queued';
+
     public bool $enableLoggingModelsEvents = false;
 
     protected $fillable = [
@@ -26,6 +35,7 @@ class AiJobDispatch extends CentralModel
         'finished_at',
         'processing_seconds',
         'queue_wait_seconds',
+        'stage_timings',
         'work_units',
         'work_unit_kind',
     ];
@@ -42,6 +52,41 @@ class AiJobDispatch extends CentralModel
         'finished_at' => 'datetime',
         'processing_seconds' => 'integer',
         'queue_wait_seconds' => 'integer',
+        'stage_timings' => 'array',
         'work_units' => 'float',
     ];
+
+    protected static function booted(): void
+    {
+        static::saved(function (self $dispatch): void {
+            if ($dispatch->status === 'queued' && ($dispatch->wasRecentlyCreated || $dispatch->wasChanged('status'))) {
+                self::signalQueued();
+            }
+        });
+    }
+
+    public static function signalQueued(): void
+    {
+        try {
+            self::signalStore()->forever(self::QUEUED_SIGNAL_KEY, Str::random(16));
+        } catch (\Throwable $e) {
+            // non-blocking: pollers still fall back to their periodic probe
+        }
+    }
+
+    public static function queuedSignal(): ?string
+    {
+        try {
+            $value = self::signalStore()->get(self::QUEUED_SIGNAL_KEY);
+        } catch (\Throwable $e) {
+            return null;
+        }
+
+        return is_string($value) ? $value : null;
+    }
+
+    private static function signalStore(): Repository
+    {
+        return Cache::store(config('services.comfyui.poll_signal_store') ?: null);
+    }
 }
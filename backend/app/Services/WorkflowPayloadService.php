@@ -94,7 +94,9 @@ public function buildJobPayload(Effect $effect, array $resolvedProps, ?File $inp
             throw new \RuntimeException('Effect is not linked to a workflow.');
         }
 
-        $workflowJson = $this->loadWorkflowJson($workflow);
+        $template = $this->loadWorkflowTemplate($workflow);
+        $workflowJson = $template['workflow'];
+        $workflowValues = [];
         $properties = $workflow->properties ?? [];
         $assets = [];
 
@@ -127,6 +129,7 @@ public function buildJobPayload(Effect $effect, array $resolvedProps, ?File $inp
 
             if ($type === 'text') {
                 // Text properties: replace placeholder in workflow JSON
+                $workflowValues[$placeholder] = (string) ($value ?? '');
                 $workflowJson = $this->replacePlaceholderInValue(
                     $workflowJson,
                     $placeholder,
@@ -158,6 +161,9 @@ public function buildJobPayload(Effect $effect, array $resolvedProps, ?File $inp
 
         $inputPayload = [
             'workflow' => $workflowJson,
+            // Workers that already hold this template compiled get only the hash and text values
+            'workflow_hash' => $template['hash'],
+            'workflow_values' => (object) $workflowValues,
             'assets' => $assets,
             'output_node_id' => $workflow->output_node_id,
             'output_extension' => $workflow->output_extension ?: 'mp4',
@@ -177,7 +183,12 @@ public function buildJobPayload(Effect $effect, array $resolvedProps, ?File $inp
         return $inputPayload;
     }
 
-    private function loadWorkflowJson(Workflow $workflow): array
+    /**
+     * Load the raw (unsubstituted) workflow JSON with the sha256 of the stored file.
+     *
+     * @return array{hash: string, workflow: array}
+     */
+    public function loadWorkflowTemplate(Workflow $workflow): array
     {
         $path = (string) ($workflow->comfyui_workflow_path ?? '');
         if ($path === '') {
@@ -202,7 +213,10 @@ private function loadWorkflowJson(Workflow $workflow): array
             throw new \RuntimeException('Workflow JSON is invalid or empty.');
         }
 
-        return $json;
+        return [
+            'hash' => hash('sha256', (string) $raw),
+            'workflow' => $json,
+        ];
     }
 
     private function replacePlaceholderInValue(mixed $value, string $placeholder, string $replacement): mixed
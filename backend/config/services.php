@@ -59,6 +59,11 @@
     'comfyui' => [
         'lease_ttl_seconds' => env('COMFYUI_LEASE_TTL_SECONDS', 900),
         'max_attempts' => env('COMFYUI_MAX_ATTEMPTS', 3),
+        'poll_max_wait_seconds' => env('COMFYUI_POLL_MAX_WAIT_SECONDS', 20),
+        'poll_wait_interval_ms' => env('COMFYUI_POLL_WAIT_INTERVAL_MS', 500),
+        'poll_probe_interval_seconds' => env('COMFYUI_POLL_PROBE_INTERVAL_SECONDS', 5),
+        'poll_signal_store' => env('COMFYUI_POLL_SIGNAL_STORE'),
+        'poll_max_batch' => env('COMFYUI_POLL_MAX_BATCH', 10),
         'presigned_ttl_seconds' => env('COMFYUI_PRESIGNED_TTL_SECONDS', 900),
         'multipart_presigned_ttl_seconds' => env('COMFYUI_MULTIPART_PRESIGNED_TTL_SECONDS', 3600),
         'upload_max_bytes' => env('COMFYUI_UPLOAD_MAX_BYTES', 1073741824),
@@ -0,0 +1,30 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    protected $connection = 'central';
+
+    public function up(): void
+    {
+        Schema::connection($this->connection)->table('ai_job_dispatches', function (Blueprint $table) {
+            if (!Schema::connection($this->connection)->hasColumn('ai_job_dispatches', 'stage_timings')) {
+                $table->json('stage_timings')
+                    ->nullable()
+                    ->after('queue_wait_seconds');
+            }
+        });
+    }
+
+    public function down(): void
+    {
+        Schema::connection($this->connection)->table('ai_job_dispatches', function (Blueprint $table) {
+            if (Schema::connection($this->connection)->hasColumn('ai_job_dispatches', 'stage_timings')) {
+                $table->dropColumn('stage_timings');
+            }
+        });
+    }
+};
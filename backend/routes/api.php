@@ -123,6 +123,10 @@
     Route::post('fail', [ComfyUiWorkerController::class, 'fail']);
     Route::post('requeue', [ComfyUiWorkerController::class, 'requeue']);
     Route::post('deregister', [ComfyUiWorkerController::class, 'deregister']);
+    Route::post('output-multipart', [ComfyUiWorkerController::class, 'createOutputMultipart']);
+    Route::post('output-multipart/complete', [ComfyUiWorkerController::class, 'completeOutputMultipart']);
+    Route::post('output-multipart/abort', [ComfyUiWorkerController::class, 'abortOutputMultipart']);
+    Route::post('workflow-template', [ComfyUiWorkerController::class, 'workflowTemplate']);
 });
 
 // Asset ops endpoints (central, secret-protected)
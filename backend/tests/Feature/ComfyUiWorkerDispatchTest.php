@@ -81,6 +81,34 @@ public function uploadUrl(string $disk, string $path, int $ttlSeconds, ?string $
             {
                 return ['url' => 'https://example.com/output', 'headers' => []];
             }
+
+            public function createMultipartUpload(string $disk, string $key, ?string $contentType = null): string
+            {
+                return 'upload-1';
+            }
+
+            public function createMultipartUploadPartUrls(
+                string $disk,
+                string $key,
+                string $uploadId,
+                int $partCount,
+                int $ttlSeconds
+            ): array {
+                $urls = [];
+                for ($partNumber = 1; $partNumber <= $partCount; $partNumber++) {
+                    $urls[] = ['part_number' => $partNumber, 'url' => 'https://example.com/part/' . $partNumber];
+                }
+
+                return $urls;
+            }
+
+            public function completeMultipartUpload(string $disk, string $key, string $uploadId, array $parts): void
+            {
+            }
+
+            public function abortMultipartUpload(string $disk, string $key, string $uploadId): void
+            {
+            }
         });
     }
 
@@ -396,6 +424,8 @@ public function test_heartbeat_updates_worker_last_seen(): void
 
         $before = AiJobDispatch::query()->find($dispatchId);
 
+        $this->travel(30)->seconds();
+
         $this->postJson('/api/worker/heartbeat', [
             'dispatch_id' => $dispatchId,
             'lease_token' => $leaseToken,
@@ -411,6 +441,44 @@ public function test_heartbeat_updates_worker_last_seen(): void
         $this->assertTrue($after->lease_expires_at->greaterThan($before->lease_expires_at));
     }
 
+    public function test_repeated_heartbeats_do_not_accumulate_lease_time(): void
+    {
+        [$user, $tenant] = $this->createUserTenant();
+        $effect = $this->createEffect();
+        $fileId = $this->createTenantFile($tenant->id, $user->id);
+        $job = $this->createTenantJob($tenant, $user, $effect, $fileId);
+
+        $this->createDispatch($tenant->id, $job->id);
+
+        $token = $this->createApprovedWorkerWithToken('worker-heartbeat-ttl');
+
+        $poll = $this->postJson('/api/worker/poll', [
+            'worker_id' => 'worker-heartbeat-ttl',
+            'current_load' => 0,
+            'max_concurrency' => 1,
+        ], [
+            'Authorization' => 'Bearer ' . $token,
+        ]);
+
+        $dispatchId = $poll->json('data.job.dispatch_id');
+        $leaseTtlSeconds = (int) config('services.comfyui.lease_ttl_seconds');
+
+        for ($beat = 0; $beat < 5; $beat++) {
+            $this->travel(30)->seconds();
+
+            $this->postJson('/api/worker/heartbeat', [
+                'dispatch_id' => $dispatchId,
+                'lease_token' => $poll->json('data.job.lease_token'),
+                'worker_id' => 'worker-heartbeat-ttl',
+            ], [
+                'Authorization' => 'Bearer ' . $token,
+            ])->assertStatus(200);
+        }
+
+        $dispatch = AiJobDispatch::query()->find($dispatchId);
+        $this->assertEqualsWithDelta($leaseTtlSeconds, now()->diffInSeconds($dispatch->lease_expires_at), 1);
+    }
+
     public function test_invalid_lease_token_rejected(): void
     {
         [$user, $tenant] = $this->createUserTenant();
@@ -494,6 +562,69 @@ public function test_fail_refunds_once_and_sets_error(): void
         $this->assertSame('boom', $job->error_message);
     }
 
+    public function test_complete_and_fail_store_stage_timings(): void
+    {
+        [$user, $tenant] = $this->createUserTenant();
+        $effect = $this->createEffect();
+        $fileId = $this->createTenantFile($tenant->id, $user->id);
+        $completedJob = $this->createTenantJob($tenant, $user, $effect, $fileId);
+        $failedJob = $this->createTenantJob($tenant, $user, $effect, $fileId);
+
+        $this->createDispatch($tenant->id, $completedJob->id);
+        $this->createDispatch($tenant->id, $failedJob->id);
+
+        $poll = $this->postJson('/api/worker/poll', [
+            'worker_id' => 'worker-timings',
+            'current_load' => 0,
+            'max_concurrency' => 2,
+            'max_jobs' => 2,
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ]);
+
+        $jobs = $poll->json('data.jobs');
+        $this->assertCount(2, $jobs);
+        $timings = [
+            'total_ms' => 5123.4,
+            'stages' => ['comfyui_queue_wait' => 800.0, 'comfyui_execution' => 4000.5],
+            'spans' => [['stage' => 'comfyui_queue_wait', 'start_ms' => 12.0, 'duration_ms' => 800.0]],
+        ];
+
+        $this->postJson('/api/worker/complete', [
+            'dispatch_id' => $jobs[0]['dispatch_id'],
+            'lease_token' => $jobs[0]['lease_token'],
+            'worker_id' => 'worker-timings',
+            'provider_job_id' => 'prompt-1',
+            'output' => ['metadata' => ['timings' => $timings]],
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(200);
+
+        $this->postJson('/api/worker/fail', [
+            'dispatch_id' => $jobs[1]['dispatch_id'],
+            'lease_token' => $jobs[1]['lease_token'],
+            'worker_id' => 'worker-timings',
+            'error_message' => 'boom',
+            'output' => ['metadata' => ['timings' => $timings]],
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(200);
+
+        foreach ($jobs as $leased) {
+            $dispatch = AiJobDispatch::query()->find($leased['dispatch_id']);
+            $this->assertSame(4000.5, $dispatch?->stage_timings['stages']['comfyui_execution']);
+        }
+
+        $this->postJson('/api/worker/fail', [
+            'dispatch_id' => $jobs[1]['dispatch_id'],
+            'lease_token' => $jobs[1]['lease_token'],
+            'worker_id' => 'worker-timings',
+            'output' => ['metadata' => ['timings' => ['stages' => ['comfyui_execution' => 'slow']]]],
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(422);
+    }
+
     public function test_fail_does_not_override_completed(): void
     {
         [$user, $tenant] = $this->createUserTenant();
@@ -631,6 +762,71 @@ public function test_complete_updates_output_file_metadata(): void
         $this->assertNotEmpty($file->url);
     }
 
+    public function test_output_multipart_requires_matching_lease_and_presigns_parts(): void
+    {
+        [$user, $tenant] = $this->createUserTenant();
+        $effect = $this->createEffect();
+        $inputFileId = $this->createTenantFile($tenant->id, $user->id);
+        $outputFileId = $this->createTenantFile($tenant->id, $user->id);
+
+        $job = $this->createTenantJob($tenant, $user, $effect, $inputFileId);
+        $this->setJobOutputFile($tenant, $job, $outputFileId);
+        $this->createDispatch($tenant->id, $job->id);
+
+        $poll = $this->postJson('/api/worker/poll', [
+            'worker_id' => 'worker-multipart',
+            'current_load' => 0,
+            'max_concurrency' => 1,
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ]);
+
+        $dispatchId = $poll->json('data.job.dispatch_id');
+        $leaseToken = $poll->json('data.job.lease_token');
+
+        $this->postJson('/api/worker/output-multipart', [
+            'dispatch_id' => $dispatchId,
+            'lease_token' => 'wrong-token',
+            'size_bytes' => 40 * 1024 * 1024,
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(404);
+
+        $create = $this->postJson('/api/worker/output-multipart', [
+            'dispatch_id' => $dispatchId,
+            'lease_token' => $leaseToken,
+            'size_bytes' => 40 * 1024 * 1024,
+            'mime_type' => 'video/mp4',
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(200);
+
+        $this->assertSame('upload-1', $create->json('data.upload_id'));
+        $this->assertSame(16 * 1024 * 1024, $create->json('data.part_size'));
+        $this->assertCount(3, $create->json('data.part_urls'));
+
+        $this->postJson('/api/worker/output-multipart/complete', [
+            'dispatch_id' => $dispatchId,
+            'lease_token' => $leaseToken,
+            'upload_id' => 'upload-1',
+            'parts' => [
+                ['part_number' => 1, 'etag' => '"a"'],
+                ['part_number' => 2, 'etag' => '"b"'],
+                ['part_number' => 3, 'etag' => '"c"'],
+            ],
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(200);
+
+        $this->postJson('/api/worker/output-multipart/abort', [
+            'dispatch_id' => $dispatchId,
+            'lease_token' => $leaseToken,
+            'upload_id' => 'upload-1',
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(204);
+    }
+
     public function test_complete_persists_partner_usage_events_and_catalog_entries(): void
     {
         [$user, $tenant] = $this->createUserTenant();
@@ -847,6 +1043,145 @@ public function test_worker_auth_required(): void
         ])->assertStatus(401);
     }
 
+    public function test_poll_long_polls_until_wait_expires_when_no_jobs(): void
+    {
+        config(['services.comfyui.poll_max_wait_seconds' => 1]);
+        config(['services.comfyui.poll_wait_interval_ms' => 100]);
+
+        $started = microtime(true);
+        $this->postJson('/api/worker/poll', [
+            'worker_id' => 'worker-long-poll',
+            'current_load' => 0,
+            'max_concurrency' => 1,
+            'wait_seconds' => 30,
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(200)
+            ->assertJsonPath('data.job', null)
+            ->assertJsonPath('data.long_poll', true)
+            ->assertJsonPath('data.wait_seconds', 1);
+
+        $this->assertGreaterThanOrEqual(1.0, microtime(true) - $started);
+    }
+
+    public function test_poll_long_poll_returns_immediately_when_job_available(): void
+    {
+        config(['services.comfyui.poll_max_wait_seconds' => 5]);
+
+        [$user, $tenant] = $this->createUserTenant();
+        $effect = $this->createEffect();
+        $fileId = $this->createTenantFile($tenant->id, $user->id);
+        $job = $this->createTenantJob($tenant, $user, $effect, $fileId);
+        $this->createDispatch($tenant->id, $job->id);
+
+        $started = microtime(true);
+        $response = $this->postJson('/api/worker/poll', [
+            'worker_id' => 'worker-long-poll',
+            'current_load' => 0,
+            'max_concurrency' => 1,
+            'wait_seconds' => 5,
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(200);
+
+        $this->assertNotNull($response->json('data.job.dispatch_id'));
+        $this->assertLessThan(5.0, microtime(true) - $started);
+    }
+
+    public function test_queueing_a_dispatch_bumps_the_long_poll_signal(): void
+    {
+        [$user, $tenant] = $this->createUserTenant();
+        $effect = $this->createEffect();
+        $fileId = $this->createTenantFile($tenant->id, $user->id);
+        $job = $this->createTenantJob($tenant, $user, $effect, $fileId);
+
+        $before = AiJobDispatch::queuedSignal();
+        $dispatch = $this->createDispatch($tenant->id, $job->id);
+        $queued = AiJobDispatch::queuedSignal();
+        $this->assertNotNull($queued);
+        $this->assertNotSame($before, $queued);
+
+        $dispatch->update(['status' => 'leased']);
+        $dispatch->update(['priority' => 5]);
+        $this->assertSame($queued, AiJobDispatch::queuedSignal());
+
+        $dispatch->update(['status' => 'queued']);
+        $this->assertNotSame($queued, AiJobDispatch::queuedSignal());
+    }
+
+    public function test_poll_leases_batch_up_to_free_capacity(): void
+    {
+        [$user, $tenant] = $this->createUserTenant();
+        $effect = $this->createEffect();
+        $dispatchIds = [];
+        for ($i = 0; $i < 3; $i++) {
+            $fileId = $this->createTenantFile($tenant->id, $user->id);
+            $job = $this->createTenantJob($tenant, $user, $effect, $fileId);
+            $dispatchIds[] = $this->createDispatch($tenant->id, $job->id)->id;
+        }
+
+        $response = $this->postJson('/api/worker/poll', [
+            'worker_id' => 'worker-batch',
+            'current_load' => 1,
+            'max_concurrency' => 3,
+            'max_jobs' => 5,
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(200);
+
+        $jobs = $response->json('data.jobs');
+        $this->assertCount(2, $jobs);
+        $this->assertSame($jobs[0]['dispatch_id'], $response->json('data.job.dispatch_id'));
+        $this->assertNotSame($jobs[0]['lease_token'], $jobs[1]['lease_token']);
+
+        $leased = AiJobDispatch::query()->whereIn('id', $dispatchIds)->where('status', 'leased')->count();
+        $this->assertSame(2, $leased);
+    }
+
+    public function test_poll_omits_workflow_the_worker_has_cached(): void
+    {
+        [$user, $tenant] = $this->createUserTenant();
+        $effect = $this->createEffect();
+        $jobs = [];
+        for ($i = 0; $i < 2; $i++) {
+            $fileId = $this->createTenantFile($tenant->id, $user->id);
+            $job = $this->createTenantJob($tenant, $user, $effect, $fileId);
+            $this->setJobInputPayload($tenant->id, $job->id, [
+                'workflow' => ['1' => ['inputs' => ['text' => 'hello']]],
+                'workflow_hash' => 'hash-' . $i,
+                'workflow_values' => ['{{PROMPT}}' => 'hello'],
+            ]);
+            $this->createDispatch($tenant->id, $job->id);
+            $jobs[] = $job;
+        }
+
+        $response = $this->postJson('/api/worker/poll', [
+            'worker_id' => 'worker-templates',
+            'current_load' => 0,
+            'max_concurrency' => 2,
+            'max_jobs' => 2,
+            'workflow_hashes' => ['hash-1'],
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(200);
+
+        $payloads = collect($response->json('data.jobs'))->keyBy('input_payload.workflow_hash');
+        $this->assertArrayHasKey('workflow', $payloads['hash-0']['input_payload']);
+        $this->assertArrayNotHasKey('workflow', $payloads['hash-1']['input_payload']);
+        $this->assertSame($this->defaultWorkflow->id, $payloads['hash-1']['workflow_id']);
+    }
+
+    public function test_workflow_template_requires_assigned_workflow(): void
+    {
+        $otherWorkflow = $this->createWorkflow();
+
+        $this->postJson('/api/worker/workflow-template', [
+            'workflow_id' => $otherWorkflow->id,
+        ], [
+            'Authorization' => 'Bearer ' . $this->defaultToken,
+        ])->assertStatus(404);
+    }
+
     public function test_worker_auth_rejects_invalid_token(): void
     {
         $this->postJson('/api/worker/poll', [
@@ -230,6 +230,36 @@ public function test_build_job_payload_loads_workflow_json_and_replaces_text_pla
         $this->assertSame('my custom prompt', $payload['workflow']['node1']['inputs']['text']);
     }
 
+    public function test_build_job_payload_includes_template_hash_and_text_values(): void
+    {
+        $path = 'workflows/test/workflow.json';
+        $this->seedWorkflowJson($path, [
+            'node1' => ['inputs' => ['text' => '{{PROMPT}}']],
+        ]);
+
+        $workflow = $this->createWorkflow([
+            'comfyui_workflow_path' => $path,
+            'properties' => [
+                [
+                    'key' => 'prompt',
+                    'type' => 'text',
+                    'default_value' => 'default',
+                    'placeholder' => '{{PROMPT}}',
+                ],
+            ],
+        ]);
+
+        $effect = $this->createEffect(['workflow_id' => $workflow->id]);
+
+        $payload = $this->service->buildJobPayload($effect, ['prompt' => 'default'], null);
+        $template = $this->service->loadWorkflowTemplate($workflow);
+
+        $this->assertSame(hash('sha256', Storage::disk('s3')->get($path)), $payload['workflow_hash']);
+        $this->assertSame($template['hash'], $payload['workflow_hash']);
+        $this->assertSame('{{PROMPT}}', $template['workflow']['node1']['inputs']['text']);
+        $this->assertSame(['{{PROMPT}}' => 'default'], (array) $payload['workflow_values']);
+    }
+
     public function test_build_job_payload_adds_primary_input_to_assets(): void
     {
         $path = 'workflows/test/workflow.json';
@@ -157,9 +157,12 @@ export class FleetAsg extends Construct {
       `FLEET_STAGE="${fleetStage}"`,
       `ASG_NAME="${asgName}"`,
       'COMFYUI_BASE_URL="http://127.0.0.1:8188"',
+      'COMFYUI_ROOT="/opt/comfyui"',
       'POLL_INTERVAL_SECONDS=3',
       'HEARTBEAT_INTERVAL_SECONDS=30',
       'MAX_CONCURRENCY=1',
+      'JOB_PREFETCH_DEPTH=1',
+      'ASSET_CACHE_DIR=/opt/worker/asset-cache',
       'EOF',
       'chown ubuntu:ubuntu /opt/worker/env',
       'chmod 600 /opt/worker/env',
@@ -4,8 +4,8 @@ set -euo pipefail
 echo "=== Installing Python worker ==="
 
 # Create worker directory
-sudo mkdir -p /opt/worker
-sudo chown ubuntu:ubuntu /opt/worker
+sudo mkdir -p /opt/worker /opt/worker/asset-cache
+sudo chown ubuntu:ubuntu /opt/worker /opt/worker/asset-cache
 
 # Copy worker script (uploaded via Packer file provisioner)
 if [ -f /tmp/comfyui_worker.py ]; then
@@ -17,7 +17,7 @@ fi
 
 # Create requirements file for worker deps
 cat > /opt/worker/requirements.txt <<'EOF'
-requests>=2.31.0
+aiohttp>=3.11.0
 boto3>=1.34.0
 EOF
 
@@ -57,9 +57,12 @@ FLEET_SLUG=
 FLEET_STAGE=
 ASG_NAME=
 COMFYUI_BASE_URL=http://127.0.0.1:8188
+COMFYUI_ROOT=/opt/comfyui
 POLL_INTERVAL_SECONDS=3
 HEARTBEAT_INTERVAL_SECONDS=30
 MAX_CONCURRENCY=1
+JOB_PREFETCH_DEPTH=1
+ASSET_CACHE_DIR=/opt/worker/asset-cache
 EOF
 
 sudo systemctl daemon-reload
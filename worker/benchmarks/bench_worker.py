@@ -0,0 +1,649 @@
+"""Benchmarks for the worker hot paths.
+
+Run from ``worker/``::
+
+    python benchmarks/bench_worker.py                  # run all, compare with baseline.json
+    python benchmarks/bench_worker.py --save-baseline  # record a new baseline
+    python benchmarks/bench_worker.py --only prepare_workflow_large --iterations 200
+
+Each benchmark reports throughput, latency percentiles and peak traced memory.
+Latencies are compared with the stored baseline after dividing by a fixed
+pure-Python calibration loop timed alongside each benchmark, so a baseline recorded on one machine stays
+usable on another; the process exits non-zero when a benchmark regresses past
+the tolerances. Transfer benchmarks run against local stand-in HTTP servers
+for S3, ComfyUI ``/view`` and the backend multipart endpoints.
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import math
+import os
+import platform
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+WORKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, WORKER_DIR)
+
+import comfyui_worker as worker  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+BUNDLED_WORKFLOWS_GLOB = os.path.join(
+    WORKER_DIR, "..", "backend", "resources", "comfyui", "workflows", "*", "workflow.json"
+)
+
+DEFAULT_LATENCY_TOLERANCE = 0.50
+DEFAULT_MEMORY_TOLERANCE = 0.20
+# Peak memory below this much over baseline is never reported as a regression
+MEMORY_SLACK_KIB = 256
+# Loopback I/O and thread interleaving make transfer timings and peaks about twice as noisy
+TRANSFER_TOLERANCE_FACTOR = 2.0
+
+_MIB = 1024 * 1024
+
+
+class Benchmark:
+    """A named operation, how often to time it, and whether one run moves ``transfer_bytes``."""
+
+    def __init__(
+        self,
+        name: str,
+        setup: Callable[["BenchContext"], Callable[[], Any]],
+        iterations: int,
+        transfer: bool = False,
+    ) -> None:
+        self.name = name
+        self.setup = setup
+        self.iterations = iterations
+        self.transfer = transfer
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+class SkipBenchmark(Exception):
+    """Raised by a setup whose inputs are unavailable on this machine."""
+
+
+def benchmark(name: str, iterations: int, transfer: bool = False):
+    def register(setup: Callable[["BenchContext"], Callable[[], Any]]):
+        BENCHMARKS[name] = Benchmark(name, setup, iterations, transfer)
+        return setup
+
+    return register
+
+
+class BenchContext:
+    """Shared inputs, built lazily so ``--only`` runs skip unneeded setup."""
+
+    def __init__(self, transfer_bytes: int) -> None:
+        self.transfer_bytes = transfer_bytes
+        self._history: Optional[Dict[str, Any]] = None
+        self._server: Optional["StandInServer"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._cleanup: List[Callable[[], None]] = []
+
+    @property
+    def history(self) -> Dict[str, Any]:
+        if self._history is None:
+            self._history = synthetic_history()
+        return self._history
+
+    @property
+    def server(self) -> "StandInServer":
+        if self._server is None:
+            self._server = StandInServer(self.transfer_bytes)
+            self._cleanup.append(self._server.close)
+        return self._server
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """One event loop for every transfer run, so the worker's HTTP pools stay warm between them."""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._cleanup.append(self._close_loop)
+        return self._loop
+
+    def _close_loop(self) -> None:
+        self._loop.run_until_complete(worker._close_http_pools())
+        self._loop.close()
+        self._loop = None
+
+    def close(self) -> None:
+        while self._cleanup:
+            self._cleanup.pop()()
+
+
+# Inputs
+
+
+def bundled_workflows() -> List[Dict[str, Any]]:
+    workflows = []
+    for path in sorted(glob.glob(BUNDLED_WORKFLOWS_GLOB)):
+        with open(path, "r", encoding="utf-8") as handle:
+            workflows.append(json.load(handle))
+    return workflows
+
+
+def synthetic_workflow(nodes: int = 600, assets: int = 20) -> Dict[str, Any]:
+    """A graph the size of a large production workflow (~600 nodes, ~0.5 MB)."""
+    rng = random.Random(17)
+    workflow: Dict[str, Any] = {}
+    for index in range(nodes):
+        kind = index % 4
+        if kind == 0:
+            node = {"class_type": "LoadImage", "inputs": {"image": f"__ASSET_{index % assets}__"}}
+        elif kind == 1:
+            node = {
+                "class_type": "KlingOmniProVideoToVideoNode",
+                "inputs": {
+                    "model_name": "kling-video-o1",
+                    "prompt": " ".join(rng.choice(("keep", "faces", "style", "motion", "colour")) for _ in range(80)),
+                    "duration": 3,
+                    "reference_video": [str(index - 1), 0],
+                    "reference_images": [str(index - 1), 0],
+                },
+            }
+        elif kind == 2:
+            node = {"class_type": "LoadVideo", "inputs": {"file": "__INPUT_PATH__", "video-preview": ""}}
+        else:
+            node = {
+                "class_type": "KSampler",
+                "inputs": {
+                    "seed": rng.randrange(2 ** 32),
+                    "steps": 20,
+                    "cfg": 7.5,
+                    "sampler_name": "euler",
+                    "positive": [str(index - 2), 0],
+                    "lora": f"loras/__ASSET_{index % assets}__",
+                },
+            }
+        node["_meta"] = {"title": f"{node['class_type']} {index}"}
+        workflow[str(index)] = node
+    return workflow
+
+
+def synthetic_history(nodes: int = 200) -> Dict[str, Any]:
+    """A ComfyUI history record with partner usage, large ``ui.text`` blobs and outputs."""
+    outputs: Dict[str, Any] = {}
+    for index in range(nodes):
+        node_output: Dict[str, Any] = {
+            "ui": {
+                "text": ["Rendered frame batch with colour grading applied. " * 80] * 8,
+                "meta": {"frames": 72, "fps": 24, "details": {"sampler": {"steps": 20}}},
+            },
+        }
+        if index % 5 == 0:
+            node_output["usage"] = {
+                "prompt_tokens": 1200 + index,
+                "completion_tokens": 300,
+                "model": "gpt-4o",
+                "billing": {"credits_used": 0.5},
+            }
+        if index % 7 == 0:
+            node_output["ui"]["text"].append("Total tokens: 1,540 / cost $0.0123")
+        if index == nodes - 1:
+            node_output["videos"] = [{"filename": "out.mp4", "subfolder": "", "type": "output"}]
+        outputs[str(index)] = node_output
+    return {"outputs": outputs, "status": {"status_str": "success", "completed": True}}
+
+
+def history_workflow(nodes: int = 200) -> Dict[str, Any]:
+    classes = ("OpenAIChatNode", "GeminiImageNode", "KlingVideoNode", "SaveVideo")
+    return {
+        str(index): {
+            "class_type": classes[index % len(classes)],
+            "inputs": {"model": "gpt-4o", "prompt": "a cat", "provider": "openai"},
+            "_meta": {"title": f"Node {index}"},
+        }
+        for index in range(nodes)
+    }
+
+
+# Stand-in servers
+
+
+class StandInServer:
+    """One local HTTP server acting as S3, ComfyUI ``/view`` and the backend multipart API.
+
+    ``GET /object`` and ``GET /view`` serve the same in-memory blob with Range
+    support; every PUT is drained and acknowledged with an ETag.
+    """
+
+    PART_SIZE = 8 * _MIB
+
+    def __init__(self, size: int) -> None:
+        self.blob = os.urandom(size)
+        self.etag = '"bench-object"'
+        server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        server.daemon_threads = True
+        self._server = server
+        self.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        self._thread = threading.Thread(target=server.serve_forever, name="bench-standin", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle_post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """The ``data`` of the backend's reply to a JSON POST."""
+        if path != "/api/worker/output-multipart":
+            return {}
+        parts = math.ceil(int(payload["size_bytes"]) / self.PART_SIZE)
+        return {
+            "upload_id": "bench-upload",
+            "part_size": self.PART_SIZE,
+            "part_urls": [
+                {"part_number": number, "url": f"{self.base_url}/parts/{number}"}
+                for number in range(1, parts + 1)
+            ],
+        }
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args: Any) -> None:
+                return None
+
+            def do_GET(self) -> None:
+                path = urlsplit(self.path).path
+                if path not in ("/object", "/view"):
+                    self._reply(404, b"")
+                    return
+                self._send_blob(stand_in.blob, stand_in.etag)
+
+            def do_PUT(self) -> None:
+                remaining = int(self.headers.get("Content-Length") or 0)
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, _MIB))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                self._reply(200, b"", {"ETag": f'"part-{urlsplit(self.path).path.rsplit("/", 1)[-1]}"'})
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                data = stand_in.handle_post(urlsplit(self.path).path, payload)
+                self._reply_json({"success": True, "data": data})
+
+            def _send_blob(self, blob: Any, etag: str, head: bool = False) -> None:
+                """Serve ``blob`` whole or as the single range asked for; ``head`` sends headers only."""
+                match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+                if match is None:
+                    self._reply(200, blob, {"Accept-Ranges": "bytes", "ETag": etag}, head)
+                    return
+                start = int(match.group(1))
+                end = min(int(match.group(2) or len(blob) - 1), len(blob) - 1)
+                if start >= len(blob):
+                    self._reply(416, b"", {"Content-Range": f"bytes */{len(blob)}"})
+                    return
+                self._reply(206, memoryview(blob)[start:end + 1], {
+                    "Accept-Ranges": "bytes",
+                    "ETag": etag,
+                    "Content-Range": f"bytes {start}-{end}/{len(blob)}",
+                }, head)
+
+            def _reply_json(self, payload: Any, status: int = 200) -> None:
+                self._reply(status, json.dumps(payload).encode("utf-8"), {"Content-Type": "application/json"})
+
+            def _reply(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None, head: bool = False) -> None:
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if not body or head:
+                    return
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the worker closes /view probes early when it switches to ranged reads
+                    self.close_connection = True
+
+        return Handler
+
+
+@contextmanager
+def patched(module: Any, **values: Any) -> Iterator[None]:
+    previous = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(module, name, value)
+
+
+# Benchmarks
+
+
+@benchmark("prepare_workflow_bundled", iterations=2000)
+def _bench_prepare_bundled(ctx: BenchContext) -> Callable[[], Any]:
+    workflows = bundled_workflows()
+    if not workflows:
+        raise SkipBenchmark("bundled workflows not found next to the worker")
+    payloads = [{"workflow": workflow, "input_reference_prefix": ""} for workflow in workflows]
+    state = {"index": 0}
+
+    def run() -> Any:
+        state["index"] = (state["index"] + 1) % len(payloads)
+        return worker.prepare_workflow(payloads[state["index"]], "input/clip.mp4", {"__ASSET_0__": "asset.png"})
+
+    return run
+
+
+@benchmark("prepare_workflow_large", iterations=200)
+def _bench_prepare_large(ctx: BenchContext) -> Callable[[], Any]:
+    payload = {"workflow": synthetic_workflow(), "input_reference_prefix": "", "input_node_id": "2", "input_field": "file"}
+    assets = {f"__ASSET_{index}__": f"asset_{index}.png" for index in range(20)}
+    return lambda: worker.prepare_workflow(payload, "input/clip.mp4", assets)
+
+
+@benchmark("prepare_workflow_cached_template", iterations=500)
+def _bench_prepare_cached(ctx: BenchContext) -> Callable[[], Any]:
+    cache = worker._WorkflowTemplateCache(max_entries=4)
+    cache.put("bench", synthetic_workflow())
+    payload = {"workflow_hash": "bench", "workflow_values": {}, "input_reference_prefix": ""}
+    assets = {f"__ASSET_{index}__": f"asset_{index}.png" for index in range(20)}
+
+    def run() -> Any:
+        with patched(worker, _workflow_templates=cache):
+            return worker.prepare_workflow(payload, "input/clip.mp4", assets)
+
+    return run
+
+
+@benchmark("extract_partner_usage_events", iterations=100)
+def _bench_usage(ctx: BenchContext) -> Callable[[], Any]:
+    workflow = history_workflow()
+    history = ctx.history
+    return lambda: worker.extract_partner_usage_events(workflow, history)
+
+
+@benchmark("sanitize_json", iterations=300)
+def _bench_sanitize(ctx: BenchContext) -> Callable[[], Any]:
+    payloads = [output["ui"] for output in ctx.history["outputs"].values()]
+    return lambda: [worker._sanitize_json(payload) for payload in payloads]
+
+
+@benchmark("extract_output_file", iterations=5000)
+def _bench_output_file(ctx: BenchContext) -> Callable[[], Any]:
+    outputs = ctx.history["outputs"]
+
+    def run() -> Any:
+        worker.extract_output_file(outputs, None)
+        return worker.extract_output_file(outputs, str(len(outputs) - 1))
+
+    return run
+
+
+@benchmark("download_input_ranged", iterations=10, transfer=True)
+def _bench_download(ctx: BenchContext) -> Callable[[], Any]:
+    url = f"{ctx.server.base_url}/object?key=input.mp4"
+    segment = max(_MIB, ctx.transfer_bytes // 4)
+
+    def run() -> Any:
+        with patched(worker, INPUT_DOWNLOAD_SEGMENT_BYTES=segment):
+            path = ctx.loop.run_until_complete(worker.download_input(url))
+        os.remove(path)
+
+    return run
+
+
+@benchmark("transfer_output_stream", iterations=10, transfer=True)
+def _bench_stream_upload(ctx: BenchContext) -> Callable[[], Any]:
+    server = ctx.server
+
+    def run() -> Any:
+        with patched(worker, COMFYUI_BASE_URL=server.base_url, COMFYUI_ROOT="", OUTPUT_STREAMING_ENABLED=True):
+            ctx.loop.run_until_complete(worker.transfer_comfyui_output(
+                {"filename": "out.mp4", "type": "output"}, f"{server.base_url}/put/out", {}
+            ))
+
+    return run
+
+
+@benchmark("transfer_output_multipart", iterations=10, transfer=True)
+def _bench_multipart_upload(ctx: BenchContext) -> Callable[[], Any]:
+    server = ctx.server
+
+    def run() -> Any:
+        with patched(
+            worker,
+            API_BASE_URL=server.base_url,
+            COMFYUI_BASE_URL=server.base_url,
+            COMFYUI_ROOT="",
+            OUTPUT_MULTIPART_THRESHOLD_BYTES=1,
+        ):
+            ctx.loop.run_until_complete(worker.transfer_comfyui_output(
+                {"filename": "out.mp4", "type": "output"}, f"{server.base_url}/put/out", {},
+                dispatch_id=1, lease_token="bench",
+            ))
+
+    return run
+
+
+# Runner
+
+
+def calibrate(rounds: int = 5) -> float:
+    """Fastest of ``rounds`` runs of a fixed dict/str/json workload, in milliseconds.
+
+    Results are normalized by this; the minimum is the least noisy estimate of
+    what the machine can do.
+    """
+    document = {"nodes": [{"id": index, "name": f"node-{index}", "values": list(range(20))} for index in range(200)]}
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(20):
+            decoded = json.loads(json.dumps(document))
+            sum(len(node["name"]) + sum(node["values"]) for node in decoded["nodes"])
+        samples.append((time.perf_counter() - start) * 1000)
+    return min(samples)
+
+
+def _percentile(sorted_samples: List[float], fraction: float) -> float:
+    index = min(len(sorted_samples) - 1, max(0, math.ceil(fraction * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+
+def _peak_kib(run: Callable[[], Any], iterations: int) -> float:
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            floor = tracemalloc.get_traced_memory()[0]
+            run()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - floor)
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def run_benchmark(bench: Benchmark, ctx: BenchContext, iterations: Optional[int] = None, memory_iterations: int = 5) -> Dict[str, Any]:
+    run = bench.setup(ctx)
+    count = max(1, iterations or bench.iterations)
+    run()  # warm caches and connection pools
+    # calibrated next to the timing so drift in machine speed during a run cancels out
+    calibration = calibrate()
+
+    samples = []
+    started = time.perf_counter()
+    for _ in range(count):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    elapsed = time.perf_counter() - started
+    samples.sort()
+
+    result: Dict[str, Any] = {
+        "iterations": count,
+        "calibration_ms": round(min(calibration, calibrate(rounds=3)), 4),
+        "ops_per_sec": round(count / elapsed, 2) if elapsed > 0 else None,
+        "p50_ms": round(_percentile(samples, 0.50), 4),
+        "p95_ms": round(_percentile(samples, 0.95), 4),
+        "p99_ms": round(_percentile(samples, 0.99), 4),
+        "peak_kib": _peak_kib(run, memory_iterations) if memory_iterations > 0 else None,
+    }
+    if bench.transfer and elapsed > 0:
+        result["mib_per_sec"] = round(ctx.transfer_bytes * count / elapsed / _MIB, 1)
+    return result
+
+
+def run_benchmarks(
+    names: Optional[List[str]] = None,
+    iterations: Optional[int] = None,
+    memory_iterations: int = 5,
+    transfer_bytes: int = 32 * _MIB,
+) -> Dict[str, Any]:
+    selected = [BENCHMARKS[name] for name in names] if names else list(BENCHMARKS.values())
+    ctx = BenchContext(transfer_bytes)
+    results: Dict[str, Any] = {}
+    try:
+        for bench in selected:
+            try:
+                results[bench.name] = run_benchmark(bench, ctx, iterations, memory_iterations)
+            except SkipBenchmark as exc:
+                results[bench.name] = {"skipped": str(exc)}
+    finally:
+        ctx.close()
+    calibrations = [result["calibration_ms"] for result in results.values() if "calibration_ms" in result]
+    return {
+        "calibration_ms": min(calibrations) if calibrations else round(calibrate(), 4),
+        "python": platform.python_version(),
+        "transfer_bytes": transfer_bytes,
+        "benchmarks": results,
+    }
+
+
+def compare(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    latency_tolerance: float = DEFAULT_LATENCY_TOLERANCE,
+    memory_tolerance: float = DEFAULT_MEMORY_TOLERANCE,
+) -> Dict[str, List[str]]:
+    """Regressions against ``baseline`` by benchmark name; empty when there are none."""
+    regressions: Dict[str, List[str]] = {}
+    for name, result in report["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base or "skipped" in result or "skipped" in base:
+            continue
+        factor = TRANSFER_TOLERANCE_FACTOR if BENCHMARKS[name].transfer else 1.0
+        expected_ms = base["p50_ms"] * _scale(report, result, baseline, base)
+        if result["p50_ms"] > expected_ms * (1 + latency_tolerance * factor):
+            regressions.setdefault(name, []).append(
+                f"p50 {result['p50_ms']:.3f} ms vs {expected_ms:.3f} ms expected "
+                f"(+{(result['p50_ms'] / expected_ms - 1) * 100:.0f}%)"
+            )
+        if result.get("peak_kib") is None or base.get("peak_kib") is None:
+            continue
+        if BENCHMARKS[name].transfer and report["transfer_bytes"] != baseline.get("transfer_bytes"):
+            continue
+        allowed = base["peak_kib"] * (1 + memory_tolerance * factor) + MEMORY_SLACK_KIB
+        if result["peak_kib"] > allowed:
+            regressions.setdefault(name, []).append(f"peak {result['peak_kib']:.0f} KiB vs {allowed:.0f} KiB allowed")
+    return regressions
+
+
+def _scale(report: Dict[str, Any], result: Dict[str, Any], baseline: Dict[str, Any], base: Dict[str, Any]) -> float:
+    current = result.get("calibration_ms") or report["calibration_ms"]
+    recorded = base.get("calibration_ms") or baseline["calibration_ms"]
+    return current / recorded
+
+
+def _print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    print(f"calibration {report['calibration_ms']:.2f} ms, python {report['python']}")
+    print(f"{'benchmark':36} {'ops/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'peak KiB':>10} {'vs base':>8}")
+    for name, result in report["benchmarks"].items():
+        if "skipped" in result:
+            print(f"{name:36} skipped: {result['skipped']}")
+            continue
+        base = (baseline or {}).get("benchmarks", {}).get(name)
+        delta = ""
+        if base and "p50_ms" in base:
+            expected_ms = base["p50_ms"] * _scale(report, result, baseline, base)
+            delta = f"{(result['p50_ms'] / expected_ms - 1) * 100:+.0f}%"
+        throughput = f" {result['mib_per_sec']} MiB/s" if "mib_per_sec" in result else ""
+        peak = result["peak_kib"] if result["peak_kib"] is not None else "-"
+        print(
+            f"{name:36} {result['ops_per_sec']:>10} {result['p50_ms']:>10.3f} {result['p95_ms']:>10.3f} "
+            f"{result['p99_ms']:>10.3f} {peak:>10} {delta:>8}{throughput}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="run just this benchmark (repeatable)")
+    parser.add_argument("--iterations", type=int, help="override every benchmark's iteration count")
+    parser.add_argument("--memory-iterations", type=int, default=5, help="runs traced for peak memory (0 disables)")
+    parser.add_argument("--transfer-mib", type=int, default=32, help="object size for the transfer benchmarks")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare with or write")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    parser.add_argument("--latency-tolerance", type=float, default=DEFAULT_LATENCY_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    parser.add_argument("--json", dest="json_path", help="also write the report to this path")
+    args = parser.parse_args(argv)
+
+    transfer_bytes = args.transfer_mib * _MIB
+    report = run_benchmarks(args.only, args.iterations, args.memory_iterations, transfer_bytes)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+
+    regressions: Dict[str, List[str]] = {}
+    if baseline is not None:
+        regressions = compare(report, baseline, args.latency_tolerance, args.memory_tolerance)
+        if regressions:
+            # one noisy run should not fail a bake; keep each benchmark's faster run
+            rerun = run_benchmarks(list(regressions), args.iterations, args.memory_iterations, transfer_bytes)
+            for name, result in rerun["benchmarks"].items():
+                first = report["benchmarks"][name]
+                if result.get("p50_ms", math.inf) < first.get("p50_ms", math.inf):
+                    result, first = first, result
+                    report["benchmarks"][name] = first
+                if result.get("peak_kib") is not None and first.get("peak_kib") is not None:
+                    first["peak_kib"] = min(first["peak_kib"], result["peak_kib"])
+            regressions = compare(report, baseline, args.latency_tolerance, args.memory_tolerance)
+    _print_report(report, baseline)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+            handle.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if baseline is None:
+        print("no baseline to compare with; run with --save-baseline to record one")
+        return 0
+
+    for name, lines in regressions.items():
+        for line in lines:
+            print(f"REGRESSION {name}: {line}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
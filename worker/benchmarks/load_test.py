@@ -0,0 +1,870 @@
+"""End-to-end load test of the worker against a simulated ComfyUI, backend and S3.
+
+Run from ``worker/``::
+
+    python benchmarks/load_test.py                                  # 50 jobs, defaults below
+    python benchmarks/load_test.py --jobs 200 --execution lognormal:2,0.4 --output-mib uniform:4,32
+    python benchmarks/load_test.py --no-websocket --rate 0.5
+
+The worker's real poll loop and ``process_job`` pipeline run unchanged on a
+CPU-only machine: ComfyUI is replaced by an in-process simulator that serves
+``/prompt``, ``/history``, ``/queue``, ``/interrupt``, ``/view``,
+``/upload/image``, ``/system_stats`` and ``/ws`` and "renders" each prompt by
+sleeping for a sampled execution time, and the backend and S3 by stand-ins
+that lease a fixed batch of jobs and accept their inputs and outputs.
+Execution times and output sizes are drawn from configurable distributions
+and a configurable share of prompts fail. The run reports job throughput,
+latency percentiles, per-stage medians and how busy the simulated GPU was;
+the process exits non-zero when jobs fail for reasons other than the
+injected errors or the run times out.
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+WORKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, WORKER_DIR)
+
+from benchmarks.bench_worker import StandInServer, _MIB, _percentile, patched, worker  # noqa: E402
+
+SIMULATED_ERROR = "Simulated ComfyUI execution error"
+OUTPUT_NODE_ID = "9"
+
+# The smallest graph that exercises every substitution the pipeline makes
+LOAD_TEST_WORKFLOW: Dict[str, Any] = {
+    "1": {"class_type": "LoadVideo", "inputs": {"file": "__INPUT_PATH__"}},
+    "2": {"class_type": "LoadImage", "inputs": {"image": "__STYLE_IMAGE__"}},
+    "9": {
+        "class_type": "SaveVideo",
+        "inputs": {"video": ["1", 0], "reference": ["2", 0], "filename_prefix": "load_test"},
+    },
+}
+
+
+class Distribution:
+    """A sampled quantity given as ``fixed:V``, ``uniform:LOW,HIGH`` or ``lognormal:MEDIAN,SIGMA``.
+
+    Samples are multiplied by ``scale`` (e.g. MiB to bytes) and never negative.
+    """
+
+    KINDS = {"fixed": 1, "uniform": 2, "lognormal": 2}
+
+    def __init__(self, spec: str, scale: float = 1.0) -> None:
+        kind, _, raw = spec.partition(":")
+        if kind not in self.KINDS:
+            raise ValueError(f"unknown distribution {kind!r}; use one of {', '.join(self.KINDS)}")
+        try:
+            params = [float(value) for value in raw.split(",")] if raw else []
+        except ValueError:
+            raise ValueError(f"distribution parameters must be numbers: {spec!r}") from None
+        if len(params) != self.KINDS[kind] or any(value < 0 for value in params):
+            raise ValueError(f"{kind} takes {self.KINDS[kind]} non-negative parameter(s): {spec!r}")
+        if kind == "lognormal" and params[0] <= 0:
+            raise ValueError(f"lognormal median must be positive: {spec!r}")
+        self.spec = spec
+        self.kind = kind
+        self.params = params
+        self.scale = scale
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            value = self.params[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(*self.params)
+        else:
+            value = rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        return max(0.0, value * self.scale)
+
+    def __str__(self) -> str:
+        return self.spec
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_WS_OP_TEXT, _WS_OP_CLOSE, _WS_OP_PING, _WS_OP_PONG = 0x1, 0x8, 0x9, 0xA
+
+
+def _ws_read_frame(reader: Any) -> Tuple[bool, int, bytes]:
+    """Read one (masked client) frame from a buffered reader. Returns (fin, opcode, payload)."""
+    head = reader.read(2)
+    if len(head) < 2:
+        raise ConnectionError("WebSocket closed.")
+    fin = bool(head[0] & 0x80)
+    opcode = head[0] & 0x0F
+    masked = bool(head[1] & 0x80)
+    length = head[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(reader.read(2), "big")
+    elif length == 127:
+        length = int.from_bytes(reader.read(8), "big")
+    mask = reader.read(4) if masked else b""
+    payload = reader.read(length) if length else b""
+    if len(payload) < length:
+        raise ConnectionError("WebSocket closed mid-frame.")
+    if masked:
+        payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    return fin, opcode, payload
+
+
+def _ws_server_frame(opcode: int, payload: bytes) -> bytes:
+    """Encode a single unmasked server frame (RFC 6455 section 5.2)."""
+    header = bytearray([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header.append(length)
+    elif length < 1 << 16:
+        header.append(126)
+        header += length.to_bytes(2, "big")
+    else:
+        header.append(127)
+        header += length.to_bytes(8, "big")
+    return bytes(header) + payload
+
+
+def _multipart_fields(content_type: str, body: bytes) -> Dict[str, Tuple[Optional[str], bytes]]:
+    """Parse a ``multipart/form-data`` body into name -> (filename, content)."""
+    boundary = ""
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "boundary":
+            boundary = value.strip('"')
+    fields: Dict[str, Tuple[Optional[str], bytes]] = {}
+    if not boundary:
+        return fields
+    for part in body.split(b"--" + boundary.encode("latin-1"))[1:]:
+        if part.startswith(b"--"):
+            break
+        head, _, content = part.partition(b"\r\n\r\n")
+        disposition = {}
+        for line in head.decode("latin-1").split("\r\n"):
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-disposition":
+                for item in value.split(";")[1:]:
+                    key, _, raw = item.strip().partition("=")
+                    disposition[key.lower()] = raw.strip('"')
+        if "name" in disposition:
+            fields[disposition["name"]] = (disposition.get("filename"), content[:-2] if content.endswith(b"\r\n") else content)
+    return fields
+
+
+class _WebSocketClient:
+    """One ``/ws`` connection; frames from the executor thread are serialised by a lock."""
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def send(self, opcode: int, payload: bytes) -> None:
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(_ws_server_frame(opcode, payload))
+            except OSError:
+                self.closed = True
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class ComfyUISimulator(StandInServer):
+    """A single-GPU ComfyUI stand-in: prompts run one at a time on a serial executor thread.
+
+    Each queued prompt samples its execution time, output size and whether it
+    fails; running it means sleeping (interruptible through ``/interrupt``)
+    and then writing a history record with ComfyUI's status messages and one
+    video output. Event stream clients get ``status``, ``execution_start`` and
+    the terminal events ComfyUI sends for their ``clientId``.
+    """
+
+    def __init__(
+        self,
+        execution_seconds: Distribution,
+        output_bytes: Distribution,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        vram_total: int = 24 * 1024 * _MIB,
+    ) -> None:
+        self.execution_seconds = execution_seconds
+        self.output_bytes = output_bytes
+        self.error_rate = min(1.0, max(0.0, error_rate))
+        self.vram_total = vram_total
+        self.stats = {"prompts": 0, "errors": 0, "interrupted": 0, "deleted": 0, "uploads": 0, "busy_seconds": 0.0}
+        self._rng = random.Random(seed)
+        self._payload = b""
+        self._cond = threading.Condition()
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._running: Optional[Dict[str, Any]] = None
+        self._interrupt = threading.Event()
+        self._history: Dict[str, Dict[str, Any]] = {}
+        self._files: Dict[Tuple[str, str], int] = {}
+        self._clients: Dict[str, List[_WebSocketClient]] = {}
+        self._number = 0
+        self._closed = False
+        super().__init__(0)
+        self._executor = threading.Thread(target=self._execute_loop, name="comfyui-sim", daemon=True)
+        self._executor.start()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._interrupt.set()
+            self._cond.notify_all()
+            clients = [client for group in self._clients.values() for client in group]
+        for client in clients:
+            client.close()
+        super().close()
+
+    # Prompt queue
+
+    def queue_prompt(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = payload.get("prompt")
+        if not isinstance(prompt, dict) or not prompt:
+            raise ValueError("prompt must be a non-empty node graph")
+        client_id = str(payload.get("client_id") or "")
+        extra_data = dict(payload.get("extra_data") or {})
+        extra_data["client_id"] = client_id
+        with self._cond:
+            self._number += 1
+            item = {
+                "number": self._number,
+                "prompt_id": str(uuid.uuid4()),
+                "prompt": prompt,
+                "extra_data": extra_data,
+                "client_id": client_id,
+                "seconds": self.execution_seconds.sample(self._rng),
+                "size": max(1, int(self.output_bytes.sample(self._rng))),
+                "fail": self._rng.random() < self.error_rate,
+            }
+            self._pending.append(item)
+            self.stats["prompts"] += 1
+            self._cond.notify_all()
+        self._broadcast_status()
+        return {"prompt_id": item["prompt_id"], "number": item["number"], "node_errors": {}}
+
+    def queue_state(self) -> Dict[str, Any]:
+        with self._cond:
+            running = [self._running] if self._running else []
+            return {
+                "queue_running": [self._queue_entry(item) for item in running],
+                "queue_pending": [self._queue_entry(item) for item in self._pending],
+            }
+
+    @staticmethod
+    def _queue_entry(item: Dict[str, Any]) -> List[Any]:
+        return [item["number"], item["prompt_id"], item["prompt"], item["extra_data"], [OUTPUT_NODE_ID]]
+
+    def delete(self, prompt_ids: List[Any]) -> None:
+        wanted = {str(prompt_id) for prompt_id in prompt_ids}
+        with self._cond:
+            kept = [item for item in self._pending if item["prompt_id"] not in wanted]
+            self.stats["deleted"] += len(self._pending) - len(kept)
+            self._pending = deque(kept)
+        self._broadcast_status()
+
+    def interrupt(self, prompt_id: Optional[str] = None) -> None:
+        with self._cond:
+            if self._running and (not prompt_id or self._running["prompt_id"] == str(prompt_id)):
+                self._interrupt.set()
+
+    def history(self, prompt_id: Optional[str] = None) -> Dict[str, Any]:
+        with self._cond:
+            if prompt_id is None:
+                return dict(self._history)
+            record = self._history.get(prompt_id)
+            return {prompt_id: record} if record else {}
+
+    def _execute_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                item = self._pending.popleft()
+                self._running = item
+                self._interrupt.clear()
+            self._execute(item)
+
+    def _execute(self, item: Dict[str, Any]) -> None:
+        prompt_id = item["prompt_id"]
+        started_ms = _now_ms()
+        messages: List[List[Any]] = [["execution_start", {"prompt_id": prompt_id, "timestamp": started_ms}]]
+        self._send(item["client_id"], "execution_start", {"prompt_id": prompt_id, "timestamp": started_ms})
+        self._broadcast_status()
+
+        started = time.monotonic()
+        interrupted = self._interrupt.wait(item["seconds"])
+        busy = time.monotonic() - started
+
+        node = {"prompt_id": prompt_id, "node_id": OUTPUT_NODE_ID, "node_type": "SaveVideo", "timestamp": _now_ms()}
+        outputs: Dict[str, Any] = {}
+        if interrupted:
+            event, data = "execution_interrupted", dict(node, executed=[])
+        elif item["fail"]:
+            event, data = "execution_error", dict(
+                node, exception_message=SIMULATED_ERROR, exception_type="RuntimeError", traceback=[]
+            )
+        else:
+            filename = f"load_test_{item['number']:05d}_.mp4"
+            outputs[OUTPUT_NODE_ID] = {"images": [{"filename": filename, "subfolder": "", "type": "output"}], "animated": [True]}
+            event, data = "execution_success", {"prompt_id": prompt_id, "timestamp": node["timestamp"]}
+        messages.append([event, data])
+        record = {
+            "prompt": self._queue_entry(item),
+            "outputs": outputs,
+            "status": {"status_str": "success" if outputs else "error", "completed": bool(outputs), "messages": messages},
+            "meta": {},
+        }
+        with self._cond:
+            if outputs:
+                self._files[("output", outputs[OUTPUT_NODE_ID]["images"][0]["filename"])] = item["size"]
+                self._grow_payload(item["size"])
+            self._history[prompt_id] = record
+            self._running = None
+            self.stats["busy_seconds"] += busy
+            if interrupted:
+                self.stats["interrupted"] += 1
+            elif item["fail"]:
+                self.stats["errors"] += 1
+
+        self._send(item["client_id"], event, data)
+        if outputs:
+            # ComfyUI signals the end of a successful prompt after writing history
+            self._send(item["client_id"], "executing", {"node": None, "prompt_id": prompt_id})
+        self._broadcast_status()
+
+    def _grow_payload(self, size: int) -> None:
+        if size > len(self._payload):
+            self._payload += os.urandom(size - len(self._payload))
+
+    # Files
+
+    def store_upload(self, filename: str, content: bytes, file_type: str = "input") -> Dict[str, Any]:
+        with self._cond:
+            self._files[(file_type, filename)] = len(content)
+            self._grow_payload(len(content))
+            self.stats["uploads"] += 1
+        return {"name": filename, "subfolder": "", "type": file_type}
+
+    def file_bytes(self, file_type: str, filename: str) -> Optional[memoryview]:
+        with self._cond:
+            size = self._files.get((file_type, filename))
+            return None if size is None else memoryview(self._payload)[:size]
+
+    def system_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            busy = self._running is not None
+        return {
+            "system": {"os": sys.platform, "python_version": sys.version.split()[0], "embedded_python": False},
+            "devices": [{
+                "name": "simulated-gpu",
+                "type": "cuda",
+                "index": 0,
+                "vram_total": self.vram_total,
+                "vram_free": self.vram_total // 4 if busy else self.vram_total,
+                "torch_vram_total": 0,
+                "torch_vram_free": 0,
+            }],
+        }
+
+    # Event stream
+
+    def attach(self, client_id: str, client: _WebSocketClient) -> None:
+        with self._cond:
+            self._clients.setdefault(client_id, []).append(client)
+        client.send(_WS_OP_TEXT, json.dumps({
+            "type": "status",
+            "data": {"status": {"exec_info": {"queue_remaining": self._queue_remaining()}}, "sid": client_id},
+        }).encode("utf-8"))
+
+    def detach(self, client_id: str, client: _WebSocketClient) -> None:
+        with self._cond:
+            group = self._clients.get(client_id, [])
+            if client in group:
+                group.remove(client)
+
+    def _queue_remaining(self) -> int:
+        with self._cond:
+            return len(self._pending) + (1 if self._running else 0)
+
+    def _send(self, client_id: str, event: str, data: Dict[str, Any]) -> None:
+        with self._cond:
+            clients = list(self._clients.get(client_id, []))
+        message = json.dumps({"type": event, "data": data}).encode("utf-8")
+        for client in clients:
+            client.send(_WS_OP_TEXT, message)
+
+    def _broadcast_status(self) -> None:
+        message = json.dumps({
+            "type": "status",
+            "data": {"status": {"exec_info": {"queue_remaining": self._queue_remaining()}}},
+        }).encode("utf-8")
+        with self._cond:
+            clients = [client for group in self._clients.values() for client in group]
+        for client in clients:
+            client.send(_WS_OP_TEXT, message)
+
+    def _handler(self):
+        simulator = self
+        base = super()._handler()
+
+        class Handler(base):
+            def do_GET(self) -> None:
+                parts = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+                if parts.path == "/ws":
+                    self._upgrade(query.get("clientId", ""))
+                elif parts.path == "/view":
+                    self._view(query)
+                elif parts.path == "/queue":
+                    self._reply_json(simulator.queue_state())
+                elif parts.path == "/history":
+                    self._reply_json(simulator.history())
+                elif parts.path.startswith("/history/"):
+                    self._reply_json(simulator.history(parts.path[len("/history/"):]))
+                elif parts.path == "/system_stats":
+                    self._reply_json(simulator.system_stats())
+                else:
+                    self._reply(404, b"")
+
+            def do_HEAD(self) -> None:
+                parts = urlsplit(self.path)
+                if parts.path != "/view":
+                    self._reply(404, b"", head=True)
+                    return
+                self._view({key: values[0] for key, values in parse_qs(parts.query).items()}, head=True)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                path = urlsplit(self.path).path
+                if path == "/upload/image":
+                    fields = _multipart_fields(self.headers.get("Content-Type", ""), body)
+                    filename, content = fields.get("image", (None, b""))
+                    if not filename:
+                        self._reply(400, b"")
+                        return
+                    file_type = (fields.get("type") or (None, b"input"))[1].decode("utf-8") or "input"
+                    self._reply_json(simulator.store_upload(filename, content, file_type))
+                    return
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    self._reply(400, b"")
+                    return
+                if path == "/prompt":
+                    try:
+                        self._reply_json(simulator.queue_prompt(payload))
+                    except ValueError as exc:
+                        self._reply_json({"error": {"type": "invalid_prompt", "message": str(exc)}, "node_errors": {}}, 400)
+                elif path == "/queue":
+                    if payload.get("clear"):
+                        simulator.delete([entry[1] for entry in simulator.queue_state()["queue_pending"]])
+                    simulator.delete(payload.get("delete") or [])
+                    self._reply(200, b"")
+                elif path == "/interrupt":
+                    simulator.interrupt(payload.get("prompt_id"))
+                    self._reply(200, b"")
+                else:
+                    self._reply(404, b"")
+
+            def _view(self, query: Dict[str, str], head: bool = False) -> None:
+                blob = simulator.file_bytes(query.get("type", "output"), query.get("filename", ""))
+                if blob is None:
+                    self._reply(404, b"", head=head)
+                    return
+                self._send_blob(blob, f'"{query.get("filename")}"', head)
+
+            def _upgrade(self, client_id: str) -> None:
+                key = self.headers.get("Sec-WebSocket-Key")
+                if not key or self.headers.get("Upgrade", "").lower() != "websocket":
+                    self._reply(400, b"")
+                    return
+                accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode("ascii")).digest())
+                self.send_response(101)
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept.decode("ascii"))
+                self.end_headers()
+                self.close_connection = True
+                client = _WebSocketClient(self.connection)
+                simulator.attach(client_id, client)
+                try:
+                    while True:
+                        _, opcode, payload = _ws_read_frame(self.rfile)
+                        if opcode == _WS_OP_CLOSE:
+                            client.send(_WS_OP_CLOSE, payload[:2])
+                            break
+                        if opcode == _WS_OP_PING:
+                            client.send(_WS_OP_PONG, payload)
+                except (ConnectionError, OSError):
+                    pass
+                finally:
+                    simulator.detach(client_id, client)
+                    client.closed = True
+
+        return Handler
+
+
+class BackendStandIn(StandInServer):
+    """The worker API and S3 for a fixed batch of jobs.
+
+    Jobs are released all at once, or ``rate`` per second from ``start``.
+    Polls are held like the real long poll until a job is released. Inputs
+    are served from ``/object`` and outputs are PUT back. Each lease and
+    report is timestamped so the run can be summarised. ``on_done`` is
+    called once every job has completed or failed.
+    """
+
+    def __init__(self, jobs: int, input_bytes: int, rate: float = 0.0) -> None:
+        super().__init__(input_bytes)
+        self.total = max(1, jobs)
+        self.rate = max(0.0, rate)
+        self.on_done: Optional[Callable[[], None]] = None
+        self.done = threading.Event()
+        self.records: Dict[int, Dict[str, Any]] = {}
+        self._pending: Deque[int] = deque()
+        self._cond = threading.Condition()
+
+    def start(self) -> None:
+        threading.Thread(target=self._release_jobs, name="backend-standin-jobs", daemon=True).start()
+
+    def close(self) -> None:
+        with self._cond:
+            self.done.set()
+            self._cond.notify_all()
+        super().close()
+
+    def job(self, dispatch_id: int) -> Dict[str, Any]:
+        return {
+            "dispatch_id": dispatch_id,
+            "lease_token": f"lease-{dispatch_id}",
+            "input_url": f"{self.base_url}/object?key=inputs/{dispatch_id}.mp4",
+            "output_url": f"{self.base_url}/outputs/{dispatch_id}.mp4",
+            "output_headers": {},
+            "input_payload": {
+                "workflow": LOAD_TEST_WORKFLOW,
+                "output_node_id": OUTPUT_NODE_ID,
+                "assets": [{
+                    "placeholder": "__STYLE_IMAGE__",
+                    "download_url": f"{self.base_url}/object?key=assets/style.png",
+                    "content_hash": "sha256:load-test-style",
+                }],
+            },
+        }
+
+    def handle_post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if path == "/api/worker/poll":
+            return self._lease(payload)
+        if path in ("/api/worker/complete", "/api/worker/fail"):
+            self._finish(payload, "completed" if path.endswith("complete") else "failed")
+            return {}
+        if path == "/api/worker/requeue":
+            self._requeue(payload)
+            return {}
+        return super().handle_post(path, payload)
+
+    def _release_jobs(self) -> None:
+        started = time.monotonic()
+        for dispatch_id in range(1, self.total + 1):
+            if self.rate:
+                delay = started + (dispatch_id - 1) / self.rate - time.monotonic()
+                if delay > 0 and self.done.wait(delay):
+                    return
+            with self._cond:
+                if self.done.is_set():
+                    return
+                self.records[dispatch_id] = {
+                    "created": time.monotonic(), "leased": None, "finished": None, "outcome": None,
+                    "error": None, "leases": 0, "output_bytes": 0, "stages": {},
+                }
+                self._pending.append(dispatch_id)
+                self._cond.notify_all()
+
+    def _lease(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        wait = max(0, int(payload.get("wait_seconds") or 0))
+        max_jobs = max(1, int(payload.get("max_jobs") or 1))
+        deadline = time.monotonic() + wait
+        leased: List[Dict[str, Any]] = []
+        with self._cond:
+            while not self._pending and not self.done.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            while self._pending and len(leased) < max_jobs:
+                dispatch_id = self._pending.popleft()
+                record = self.records[dispatch_id]
+                record["leased"] = time.monotonic()
+                record["leases"] += 1
+                leased.append(self.job(dispatch_id))
+        if leased:
+            return {"job": leased[0], "jobs": leased}
+        # once everything has finished, an empty poll should not keep the worker in a long poll
+        return {"job": None, "long_poll": wait > 0, "wait_seconds": 0 if self.done.is_set() else wait}
+
+    def _finish(self, payload: Dict[str, Any], outcome: str) -> None:
+        output = payload.get("output") or {}
+        callback = None
+        with self._cond:
+            record = self.records.get(int(payload["dispatch_id"]))
+            if record is None or record["outcome"]:
+                return
+            record["finished"] = time.monotonic()
+            record["outcome"] = outcome
+            record["error"] = payload.get("error_message")
+            record["output_bytes"] = int(output.get("size") or 0)
+            record["stages"] = ((output.get("metadata") or {}).get("timings") or {}).get("stages") or {}
+            finished = sum(1 for item in self.records.values() if item["outcome"])
+            if finished >= self.total and not self.done.is_set():
+                self.done.set()
+                self._cond.notify_all()
+                callback = self.on_done
+        if callback is not None:
+            callback()
+
+    def _requeue(self, payload: Dict[str, Any]) -> None:
+        with self._cond:
+            dispatch_id = int(payload["dispatch_id"])
+            record = self.records.get(dispatch_id)
+            if record is None or record["outcome"] or dispatch_id in self._pending:
+                return
+            record["leased"] = None
+            self._pending.appendleft(dispatch_id)
+            self._cond.notify_all()
+
+
+class _NoScaleInProtection:
+    def set(self, protected: bool) -> None:
+        return None
+
+    def flush(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        return None
+
+
+def _summary_ms(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+    return {
+        "p50": round(_percentile(ordered, 0.50), 1),
+        "p95": round(_percentile(ordered, 0.95), 1),
+        "p99": round(_percentile(ordered, 0.99), 1),
+        "max": round(ordered[-1], 1),
+    }
+
+
+async def _serve_worker() -> None:
+    try:
+        await worker._serve(_NoScaleInProtection())
+    finally:
+        await worker._close_event_streams()
+        await worker._close_http_pools()
+
+
+def run_load_test(
+    jobs: int = 50,
+    concurrency: int = 1,
+    prefetch: int = 1,
+    execution: str = "lognormal:1,0.3",
+    output_mib: str = "fixed:8",
+    error_rate: float = 0.0,
+    input_mib: float = 4,
+    rate: float = 0.0,
+    websocket: bool = True,
+    seed: int = 7,
+    timeout: float = 600.0,
+    quiet: bool = True,
+    instances: int = 1,
+) -> Dict[str, Any]:
+    """Run the worker's serve loop until ``jobs`` jobs have finished and summarise the run.
+
+    With ``instances`` > 1 the worker drives that many simulators as a ComfyUIPool.
+    """
+    simulators = [
+        ComfyUISimulator(Distribution(execution), Distribution(output_mib, scale=_MIB), error_rate, seed + index)
+        for index in range(max(1, instances))
+    ]
+    endpoints = [simulator.base_url for simulator in simulators]
+    backend = BackendStandIn(jobs, max(1, int(input_mib * _MIB)), rate)
+    cache_dir = tempfile.mkdtemp(prefix="load-test-assets-")
+    timer = threading.Timer(timeout, worker._request_shutdown, ("load_test_timeout",))
+    timer.daemon = True
+    output = open(os.devnull, "w") if quiet else None
+    started = time.monotonic()
+    try:
+        with contextlib.ExitStack() as stack:
+            if output is not None:
+                stack.enter_context(contextlib.redirect_stdout(output))
+            stack.enter_context(patched(
+                worker,
+                API_BASE_URL=backend.base_url,
+                COMFYUI_BASE_URL=endpoints[0],
+                COMFYUI_BASE_URLS=endpoints if len(endpoints) > 1 else [],
+                COMFYUI_ROOT="",
+                COMFYUI_ROOTS=[],
+                COMFYUI_WS_ENABLED=websocket,
+                MAX_CONCURRENCY=concurrency,
+                JOB_PREFETCH_DEPTH=prefetch,
+                ASG_NAME="",
+                FLEET_SECRET="",
+                JOB_TIMING_LOG_PATH="",
+                SHUTDOWN_GRACE_SECONDS=10,
+                _asset_cache=worker._AssetCache(cache_dir, worker.ASSET_CACHE_MAX_BYTES),
+                _shutdown_requested=False,
+                _shutdown_reason="",
+            ))
+            backend.on_done = lambda: worker._request_shutdown("load_test_done")
+            timer.start()
+            backend.start()
+            asyncio.run(_serve_worker())
+            timed_out = worker._shutdown_reason == "load_test_timeout"
+    finally:
+        timer.cancel()
+        backend.close()
+        for simulator in simulators:
+            simulator.close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        if output is not None:
+            output.close()
+
+    records = [record for record in backend.records.values() if record["outcome"]]
+    completed = [record for record in records if record["outcome"] == "completed"]
+    failed = [record for record in records if record["outcome"] == "failed"]
+    finished_at = max((record["finished"] for record in records), default=time.monotonic())
+    elapsed = max(1e-9, finished_at - started)
+    stage_names = sorted({stage for record in completed for stage in record["stages"]})
+    comfyui = {key: sum(simulator.stats[key] for simulator in simulators) for key in simulators[0].stats}
+    comfyui["busy_fraction"] = round(comfyui["busy_seconds"] / (elapsed * len(simulators)), 3)
+    comfyui["prompts_per_instance"] = [simulator.stats["prompts"] for simulator in simulators]
+    injected = comfyui["errors"]
+    return {
+        "config": {
+            "jobs": jobs, "concurrency": concurrency, "prefetch": prefetch,
+            "execution_seconds": execution, "output_mib": output_mib, "error_rate": error_rate,
+            "input_mib": input_mib, "rate": rate, "websocket": websocket, "seed": seed,
+            "instances": len(simulators),
+        },
+        "timed_out": timed_out,
+        "elapsed_s": round(elapsed, 3),
+        "completed": len(completed),
+        "failed": len(failed),
+        "unexpected_failures": max(0, len(failed) - injected),
+        "errors": sorted({record["error"] for record in failed if record["error"]}),
+        "requeues": sum(max(0, record["leases"] - 1) for record in backend.records.values()),
+        "jobs_per_sec": round(len(records) / elapsed, 3),
+        "output_mib_per_sec": round(sum(record["output_bytes"] for record in completed) / elapsed / _MIB, 2),
+        # from release to the report reaching the backend, and from lease to report
+        "latency_ms": _summary_ms([(record["finished"] - record["created"]) * 1000 for record in records]),
+        "service_ms": _summary_ms([
+            (record["finished"] - record["leased"]) * 1000 for record in records if record["leased"] is not None
+        ]),
+        "stage_p50_ms": {
+            stage: round(_percentile(sorted(record["stages"].get(stage, 0.0) for record in completed), 0.50), 1)
+            for stage in stage_names
+        },
+        "comfyui": comfyui,
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    config = report["config"]
+    print(
+        f"{config['jobs']} jobs, {config['instances']} ComfyUI instance(s), "
+        f"concurrency {config['concurrency']} + prefetch {config['prefetch']} each, execution {config['execution_seconds']} s, output {config['output_mib']} MiB, "
+        f"error rate {config['error_rate']}"
+    )
+    print(
+        f"completed {report['completed']}, failed {report['failed']} "
+        f"({report['unexpected_failures']} unexpected), requeues {report['requeues']}, "
+        f"{report['elapsed_s']:.1f} s{' (timed out)' if report['timed_out'] else ''}"
+    )
+    print(
+        f"throughput {report['jobs_per_sec']} jobs/s, {report['output_mib_per_sec']} MiB/s out, "
+        f"ComfyUI busy {report['comfyui']['busy_fraction'] * 100:.0f}%"
+    )
+    if config["instances"] > 1:
+        print("prompts per instance: " + ", ".join(str(count) for count in report["comfyui"]["prompts_per_instance"]))
+    print(f"{'ms':12} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10}")
+    for name in ("latency_ms", "service_ms"):
+        values = report[name]
+        print(f"{name[:-3]:12} " + " ".join(f"{'-' if values[key] is None else values[key]:>10}" for key in ("p50", "p95", "p99", "max")))
+    if report["stage_p50_ms"]:
+        print("stage p50 ms: " + ", ".join(f"{stage} {value}" for stage, value in report["stage_p50_ms"].items()))
+    for error in report["errors"]:
+        print(f"error: {error}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--jobs", type=int, default=50, help="jobs to run through the worker")
+    parser.add_argument("--concurrency", type=int, default=1, help="the worker's MAX_CONCURRENCY")
+    parser.add_argument("--prefetch", type=int, default=1, help="the worker's JOB_PREFETCH_DEPTH")
+    parser.add_argument("--execution", type=Distribution, default=Distribution("lognormal:1,0.3"),
+                        help="prompt execution seconds: fixed:V, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--output-mib", type=Distribution, default=Distribution("fixed:8"),
+                        help="output size in MiB, same forms as --execution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of prompts that fail in ComfyUI")
+    parser.add_argument("--input-mib", type=float, default=4, help="input video and asset size")
+    parser.add_argument("--rate", type=float, default=0.0, help="jobs released per second (0 releases all at once)")
+    parser.add_argument("--no-websocket", dest="websocket", action="store_false", help="poll /history instead of /ws")
+    parser.add_argument("--instances", type=int, default=1, help="simulated ComfyUI instances (one per GPU)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=600.0, help="stop the run after this many seconds")
+    parser.add_argument("--verbose", action="store_true", help="show the worker's own output")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this path")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(
+        jobs=args.jobs,
+        concurrency=args.concurrency,
+        prefetch=args.prefetch,
+        execution=str(args.execution),
+        output_mib=str(args.output_mib),
+        error_rate=args.error_rate,
+        input_mib=args.input_mib,
+        rate=args.rate,
+        websocket=args.websocket,
+        seed=args.seed,
+        timeout=args.timeout,
+        quiet=not args.verbose,
+        instances=args.instances,
+    )
+    _print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+    return 1 if report["timed_out"] or report["unexpected_failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
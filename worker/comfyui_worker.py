@@ -1,18 +1,29 @@
+import asyncio
+import base64
+import bisect
+import copy
+import functools
 import hashlib
 import json
 import math
 import mimetypes
 import os
+import random
 import re
+import shutil
 import signal
 import tempfile
 import threading
 import time
 import uuid
-from typing import Any, Dict, Optional, Tuple, List
-from urllib.parse import urlencode
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, Tuple, List
+from urllib.parse import parse_qsl, urlencode, urlsplit
 
-import requests
+import aiohttp
 
 
 API_BASE_URL = os.environ.get("API_BASE_URL", "http://localhost")
@@ -21,24 +32,457 @@ WORKER_TOKEN = os.environ.get("WORKER_TOKEN", "")
 FLEET_SECRET = os.environ.get("FLEET_SECRET", "")
 
 COMFYUI_BASE_URL = os.environ.get("COMFYUI_BASE_URL", "http://localhost:8188")
+COMFYUI_WS_ENABLED = os.environ.get("COMFYUI_WS_ENABLED", "1").lower() not in ("0", "false", "no")
+COMFYUI_JOB_TIMEOUT_SECONDS = int(os.environ.get("COMFYUI_JOB_TIMEOUT_SECONDS", "3600"))
+# ComfyUI install dir on this node (e.g. /opt/comfyui); enables direct input/output file access
+COMFYUI_ROOT = os.environ.get("COMFYUI_ROOT", "")
+# Several local ComfyUI instances (one per GPU), comma separated; overrides COMFYUI_BASE_URL
+COMFYUI_BASE_URLS = [url.strip().rstrip("/") for url in os.environ.get("COMFYUI_BASE_URLS", "").split(",") if url.strip()]
+# Install dir of each instance, in COMFYUI_BASE_URLS order; missing entries fall back to COMFYUI_ROOT
+COMFYUI_ROOTS = [root.strip() for root in os.environ.get("COMFYUI_ROOTS", "").split(",")]
+# Check ComfyUI's /queue and /system_stats before each poll and only lease what it can start promptly
+ADMISSION_CONTROL_ENABLED = os.environ.get("ADMISSION_CONTROL_ENABLED", "1").lower() not in ("0", "false", "no")
+# Hold off leasing while the GPU has less free VRAM than this (0 disables)
+ADMISSION_MIN_FREE_VRAM_MB = int(os.environ.get("ADMISSION_MIN_FREE_VRAM_MB", "0"))
 
 POLL_INTERVAL_SECONDS = int(os.environ.get("POLL_INTERVAL_SECONDS", "3"))
+# Long-poll: ask the backend to hold /poll open this long for work (0 disables)
+POLL_LONG_WAIT_SECONDS = int(os.environ.get("POLL_LONG_WAIT_SECONDS", "20"))
+# Without long-poll, empty polls back off exponentially (with jitter) between these bounds
+POLL_BACKOFF_MIN_SECONDS = float(os.environ.get("POLL_BACKOFF_MIN_SECONDS", "0.5"))
+POLL_BACKOFF_MAX_SECONDS = float(os.environ.get("POLL_BACKOFF_MAX_SECONDS", "10"))
 HEARTBEAT_INTERVAL_SECONDS = int(os.environ.get("HEARTBEAT_INTERVAL_SECONDS", "30"))
 MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "1"))
 CAPABILITIES = os.environ.get("CAPABILITIES", "")
+SHUTDOWN_GRACE_SECONDS = int(os.environ.get("SHUTDOWN_GRACE_SECONDS", "60"))
+# Extra jobs leased ahead of free GPU slots so their inputs download during a render
+JOB_PREFETCH_DEPTH = int(os.environ.get("JOB_PREFETCH_DEPTH", "1"))
+JOB_PREFETCH_MAX_WAIT_SECONDS = int(os.environ.get("JOB_PREFETCH_MAX_WAIT_SECONDS", "300"))
+# JSON-lines log of per-stage job timings ("" disables); rotated to <path>.1 past the size cap
+JOB_TIMING_LOG_PATH = os.environ.get(
+    "JOB_TIMING_LOG_PATH", os.path.join(tempfile.gettempdir(), "comfyui-worker-timings.jsonl")
+)
+JOB_TIMING_LOG_MAX_BYTES = int(os.environ.get("JOB_TIMING_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Prometheus metrics endpoint (GET /metrics); 0 disables
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
 
 # ASG / Spot instance support
 ASG_NAME = os.environ.get("ASG_NAME", "")
 FLEET_SLUG = os.environ.get("FLEET_SLUG", "")
 FLEET_STAGE = os.environ.get("FLEET_STAGE", "")
+# IMDS: session token lifetime and how often the termination watcher makes its one request
+IMDS_TOKEN_TTL_SECONDS = int(os.environ.get("IMDS_TOKEN_TTL_SECONDS", "21600"))
+TERMINATION_CHECK_INTERVAL_SECONDS = float(os.environ.get("TERMINATION_CHECK_INTERVAL_SECONDS", "2"))
+# Dropping scale-in protection waits this long so idle gaps between jobs don't flip it
+SCALE_IN_PROTECTION_SETTLE_SECONDS = float(os.environ.get("SCALE_IN_PROTECTION_SETTLE_SECONDS", "10"))
+
+# HTTP connection pools (keep-alive sessions per upstream)
+HTTP_RETRY_BACKOFF_SECONDS = float(os.environ.get("HTTP_RETRY_BACKOFF_SECONDS", "0.5"))
+BACKEND_HTTP_TIMEOUT_SECONDS = float(os.environ.get("BACKEND_HTTP_TIMEOUT_SECONDS", "30"))
+BACKEND_HTTP_RETRIES = int(os.environ.get("BACKEND_HTTP_RETRIES", "2"))
+COMFYUI_HTTP_TIMEOUT_SECONDS = float(os.environ.get("COMFYUI_HTTP_TIMEOUT_SECONDS", "30"))
+COMFYUI_HTTP_RETRIES = int(os.environ.get("COMFYUI_HTTP_RETRIES", "2"))
+S3_HTTP_TIMEOUT_SECONDS = float(os.environ.get("S3_HTTP_TIMEOUT_SECONDS", "300"))
+S3_HTTP_RETRIES = int(os.environ.get("S3_HTTP_RETRIES", "3"))
+
+# Input download: large objects are fetched as parallel, resumable Range segments
+INPUT_DOWNLOAD_SEGMENT_BYTES = int(os.environ.get("INPUT_DOWNLOAD_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+INPUT_DOWNLOAD_CONCURRENCY = int(os.environ.get("INPUT_DOWNLOAD_CONCURRENCY", "4"))
+INPUT_DOWNLOAD_RETRIES = int(os.environ.get("INPUT_DOWNLOAD_RETRIES", "3"))
+
+# Output transfer: pipe ComfyUI /view straight into the presigned PUT
+OUTPUT_STREAMING_ENABLED = os.environ.get("OUTPUT_STREAMING_ENABLED", "1").lower() not in ("0", "false", "no")
+# S3 presigned PUTs require Content-Length; only enable for targets that accept chunked uploads
+OUTPUT_STREAM_ALLOW_CHUNKED = os.environ.get("OUTPUT_STREAM_ALLOW_CHUNKED", "0").lower() in ("1", "true", "yes")
+# Outputs at least this large go up as parallel multipart parts (0 disables)
+OUTPUT_MULTIPART_THRESHOLD_BYTES = int(os.environ.get("OUTPUT_MULTIPART_THRESHOLD_BYTES", str(64 * 1024 * 1024)))
+OUTPUT_MULTIPART_CONCURRENCY = int(os.environ.get("OUTPUT_MULTIPART_CONCURRENCY", "4"))
+OUTPUT_MULTIPART_PART_RETRIES = int(os.environ.get("OUTPUT_MULTIPART_PART_RETRIES", "3"))
 
 # Shutdown state
 _shutdown_requested = False
 _shutdown_reason = ""
-_current_job: Optional[Dict[str, Any]] = None
+# Called (from any thread) once shutdown is requested; the serve loop uses them to wake up
+_shutdown_listeners: List[Callable[[], None]] = []
+
+# Shutdown reasons where in-flight jobs are handed back instead of failed
+_REQUEUE_REASONS = ("spot_interruption", "spot_rebalance", "asg_termination")
+
+# Asset cache (content-hash addressed, persisted across restarts;
+# kept outside /tmp so it survives reboots and instance restarts)
+ASSET_CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", "/opt/worker/asset-cache")
+ASSET_CACHE_MAX_BYTES = int(os.environ.get("ASSET_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+ASSET_CACHE_VERIFY_SECONDS = int(os.environ.get("ASSET_CACHE_VERIFY_SECONDS", "300"))
+ASSET_FETCH_CONCURRENCY = int(os.environ.get("ASSET_FETCH_CONCURRENCY", "4"))
+
+# Compiled workflow templates kept in memory, keyed by workflow content hash
+WORKFLOW_TEMPLATE_CACHE_SIZE = int(os.environ.get("WORKFLOW_TEMPLATE_CACHE_SIZE", "32"))
+
+
+# Metrics: counters, gauges and histograms served in the Prometheus text format
+
+
+class _Metric:
+    """One metric family; each label combination keeps its own value (or buckets)."""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        kind: str,
+        label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = (),
+    ) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (non-cumulative), then sum and count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def value(self, **labels: Any) -> Any:
+        with self._lock:
+            value = self._values.get(self._key(labels))
+            return copy.deepcopy(value)
+
+    def render(self, const_labels: Dict[str, str], openmetrics: bool) -> List[str]:
+        # OpenMetrics names the counter family without its _total suffix
+        family = self.name[:-6] if openmetrics and self.kind == "counter" else self.name
+        lines = [f"# HELP {family} {self.help_text}", f"# TYPE {family} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+            values = [(key, copy.deepcopy(value)) for key, value in values]
+        for key, value in values:
+            labels = {**const_labels, **dict(zip(self.label_names, key))}
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{_render_labels(labels)} {_render_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _render_labels({**labels, "le": _render_number(bound)})
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_bucket{_render_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_render_labels(labels)} {_render_number(total)}")
+            lines.append(f"{self.name}_count{_render_labels(labels)} {count}")
+        return lines
+
+
+def _render_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _render_number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _MetricsRegistry:
+    """The worker's metrics, every sample labeled with this node's fleet slug and stage."""
+
+    def __init__(self, const_labels: Dict[str, str]) -> None:
+        self.const_labels = const_labels
+        self._metrics: List[_Metric] = []
+
+    def _add(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> _Metric:
+        return self._add(_Metric(name, help_text, "counter", label_names))
+
+    def gauge(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> _Metric:
+        return self._add(_Metric(name, help_text, "gauge", label_names))
+
+    def histogram(
+        self, name: str, help_text: str, buckets: Tuple[float, ...], label_names: Tuple[str, ...] = ()
+    ) -> _Metric:
+        return self._add(_Metric(name, help_text, "histogram", label_names, buckets))
+
+    def render(self, openmetrics: bool = False) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render(self.const_labels, openmetrics))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+_POLL_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+_STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+_metrics = _MetricsRegistry({"fleet_slug": FLEET_SLUG, "fleet_stage": FLEET_STAGE})
+_metric_poll_seconds = _metrics.histogram(
+    "comfyui_worker_poll_duration_seconds", "Backend /poll round trip, long polls included.",
+    _POLL_BUCKETS, ("long_poll",),
+)
+_metric_polls = _metrics.counter(
+    "comfyui_worker_polls_total", "Backend polls by result (jobs, empty, error).", ("result",)
+)
+_metric_jobs = _metrics.counter(
+    "comfyui_worker_jobs_total", "Finished jobs by outcome.", ("outcome",)
+)
+_metric_job_seconds = _metrics.histogram(
+    "comfyui_worker_job_duration_seconds", "Wall-clock time from lease to outcome.",
+    _STAGE_BUCKETS, ("outcome",),
+)
+_metric_stage_seconds = _metrics.histogram(
+    "comfyui_worker_stage_duration_seconds", "Job stage spans (see JobTimings).",
+    _STAGE_BUCKETS, ("stage",),
+)
+_metric_transfer_bytes = _metrics.counter(
+    "comfyui_worker_transfer_bytes_total",
+    "Bytes moved between presigned storage and this node, by direction.",
+    ("direction",),
+)
+_metric_asset_fetches = _metrics.counter(
+    "comfyui_worker_asset_fetches_total",
+    "Asset resolutions by source (cache hit, local blob, download).",
+    ("source",),
+)
+_metric_comfyui_queue = _metrics.gauge(
+    "comfyui_worker_comfyui_queue_remaining", "Prompts queued or running in ComfyUI, last reported.", ("instance",)
+)
+_metric_active_jobs = _metrics.gauge(
+    "comfyui_worker_active_jobs", "Jobs leased and not yet finished."
+)
+_metric_comfyui_vram_free = _metrics.gauge(
+    "comfyui_worker_comfyui_vram_free_bytes", "Lowest free VRAM across ComfyUI's GPUs, last checked.", ("instance",)
+)
+_metric_admission_holds = _metrics.counter(
+    "comfyui_worker_admission_holds_total", "Poll cycles skipped because ComfyUI could not start work.", ("reason",)
+)
+_metric_heartbeat_failures = _metrics.counter(
+    "comfyui_worker_heartbeat_failures_total", "Failed lease heartbeats by reason.", ("reason",)
+)
+_metric_backend_responses = _metrics.counter(
+    "comfyui_worker_backend_responses_total",
+    "Backend API responses by path and status code (\"error\" when no response arrived).",
+    ("path", "code"),
+)
 
-# Asset upload cache: (endpoint, content_hash) → comfyui_filename
-_asset_cache: Dict[Tuple[str, str], str] = {}
+
+def _count_backend_response(url: str, status: Optional[int]) -> None:
+    _metric_backend_responses.inc(path=urlsplit(url).path, code=status if status is not None else "error")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in (self.headers.get("Accept") or "")
+        body = _metrics.render(openmetrics).encode("utf-8")
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            "application/openmetrics-text; version=1.0.0; charset=utf-8"
+            if openmetrics else "text/plain; version=0.0.4; charset=utf-8",
+        )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_: Any) -> None:
+        pass  # scrapes are not worth a log line
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> ThreadingHTTPServer:
+    """Serve ``/metrics`` from a daemon thread; returns the server so it can be shut down."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class _HttpPool:
+    """Keep-alive aiohttp.ClientSession with its own timeout, retry and backoff policy.
+
+    Retries only cover failures where re-sending is safe: connection errors for
+    every method, plus the listed status codes for ``status_methods``. A call
+    passing ``idempotent=True`` also gets status retries whatever its method.
+    ``timeout`` bounds connecting and each read, not the whole transfer.
+
+    The session belongs to the event loop that opened it; a pool used from a
+    new loop (tests, one-off scripts) opens a fresh one.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        retries: int = 0,
+        backoff: float = 0.0,
+        status_forcelist: Tuple[int, ...] = (),
+        status_methods: Tuple[str, ...] = ("GET", "HEAD"),
+        pool_maxsize: int = 10,
+        on_response: Optional[Callable[[str, Optional[int]], None]] = None,
+    ) -> None:
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.status_forcelist = status_forcelist
+        self.status_methods = status_methods
+        self.pool_maxsize = pool_maxsize
+        # called with (url, status) after every request; status is None when none arrived
+        self.on_response = on_response
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = self._build_session()
+            self._session_loop = loop
+        return self._session
+
+    def _build_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_maxsize),
+            timeout=aiohttp.ClientTimeout(total=None),
+        )
+
+    @asynccontextmanager
+    async def request(
+        self, method: str, url: str, idempotent: bool = False, **kwargs: Any
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Send a request and yield the response; its connection is released on exit."""
+        resp = await self.send(method, url, idempotent, **kwargs)
+        try:
+            yield resp
+        finally:
+            resp.release()
+
+    async def send(
+        self, method: str, url: str, idempotent: bool = False, timeout: Optional[float] = None, **kwargs: Any
+    ) -> aiohttp.ClientResponse:
+        """Send a request and return the response; the caller must release it."""
+        timeout = self.timeout if timeout is None else timeout
+        kwargs["timeout"] = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        status_retry = idempotent or method in self.status_methods
+        attempt = 0
+        while True:
+            try:
+                resp = await self.session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError):
+                # nothing reached the server yet, so any method may go again
+                if attempt >= self.retries:
+                    self._count(url, None)
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self._count(url, None)
+                raise
+            else:
+                if not (status_retry and resp.status in self.status_forcelist and attempt < self.retries):
+                    self._count(url, resp.status)
+                    return resp
+                resp.release()
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def _count(self, url: str, status: Optional[int]) -> None:
+        if self.on_response is not None:
+            self.on_response(url, status)
+
+    def get(self, url: str, **kwargs: Any):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs: Any):
+        return self.request("PUT", url, **kwargs)
+
+    async def close(self) -> None:
+        session, self._session = self._session, None
+        if session is not None and not session.closed and self._session_loop is asyncio.get_running_loop():
+            await session.close()
+        self._session_loop = None
+
+
+# Transport failures from the pools; a read timeout surfaces as asyncio.TimeoutError
+_HTTP_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+# Each leased job (GPU slots plus prefetch, per ComfyUI instance) may have a few transfers in flight
+_HTTP_POOL_MAXSIZE = max(4, 4 * (MAX_CONCURRENCY + JOB_PREFETCH_DEPTH) * max(1, len(set(COMFYUI_BASE_URLS))))
+
+# Backend API: retry gateway errors the ALB returns before reaching PHP. A 502
+# can follow a committed lease or completion, so POSTs only get status retries
+# when the call is safe to repeat (idempotent=True).
+_backend_http = _HttpPool(
+    "backend",
+    timeout=BACKEND_HTTP_TIMEOUT_SECONDS,
+    retries=BACKEND_HTTP_RETRIES,
+    backoff=HTTP_RETRY_BACKOFF_SECONDS,
+    status_forcelist=(502, 503),
+    pool_maxsize=_HTTP_POOL_MAXSIZE,
+    on_response=_count_backend_response,
+)
+# Local ComfyUI: plain HTTP on loopback, only connection errors are retried.
+_comfyui_http = _HttpPool(
+    "comfyui",
+    timeout=COMFYUI_HTTP_TIMEOUT_SECONDS,
+    retries=COMFYUI_HTTP_RETRIES,
+    backoff=HTTP_RETRY_BACKOFF_SECONDS,
+    pool_maxsize=_HTTP_POOL_MAXSIZE,
+)
+# Presigned S3: PUT bodies are streamed, so status retries stay on GET/HEAD.
+_s3_http = _HttpPool(
+    "s3",
+    timeout=S3_HTTP_TIMEOUT_SECONDS,
+    retries=S3_HTTP_RETRIES,
+    backoff=HTTP_RETRY_BACKOFF_SECONDS,
+    status_forcelist=(500, 502, 503, 504),
+    pool_maxsize=_HTTP_POOL_MAXSIZE,
+)
+# IMDS: link-local and rate limited, fail fast without retries.
+_IMDS_HTTP_TIMEOUT_SECONDS = 1
+_imds_http = _HttpPool("imds", timeout=_IMDS_HTTP_TIMEOUT_SECONDS, pool_maxsize=2)
+
+
+async def _close_http_pools() -> None:
+    for pool in (_backend_http, _comfyui_http, _s3_http, _imds_http):
+        await pool.close()
 
 
 def _backend_headers() -> Dict[str, str]:
@@ -48,11 +492,14 @@ def _backend_headers() -> Dict[str, str]:
     return headers
 
 
-def _backend_post(path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+async def _backend_post(
+    path: str, payload: Dict[str, Any], timeout: Optional[float] = None, idempotent: bool = False
+) -> Dict[str, Any]:
     url = f"{API_BASE_URL}{path}"
-    resp = requests.post(url, json=payload, headers=_backend_headers(), timeout=30)
-    resp.raise_for_status()
-    return resp.json()
+    kwargs: Dict[str, Any] = {"timeout": timeout} if timeout is not None else {}
+    async with _backend_http.post(url, json=payload, headers=_backend_headers(), idempotent=idempotent, **kwargs) as resp:
+        resp.raise_for_status()
+        return await resp.json()
 
 
 def _parse_capabilities() -> Optional[Dict[str, Any]]:
@@ -64,107 +511,284 @@ def _parse_capabilities() -> Optional[Dict[str, Any]]:
         return {"raw": CAPABILITIES}
 
 
-def _fetch_imds(path: str) -> Optional[str]:
-    try:
-        tok = requests.put(
-            "http://169.254.169.254/latest/api/token",
-            headers={"X-aws-ec2-metadata-token-ttl-seconds": "30"},
-            timeout=1,
-        ).text
-        resp = requests.get(
-            f"http://169.254.169.254/latest/{path}",
-            headers={"X-aws-ec2-metadata-token": tok},
-            timeout=1,
-        )
-        if resp.status_code != 200:
+class _ImdsClient:
+    """IMDSv2 client that reuses its session token and caches static metadata."""
+
+    BASE_URL = "http://169.254.169.254/latest"
+
+    def __init__(self, http: _HttpPool, token_ttl: int = IMDS_TOKEN_TTL_SECONDS) -> None:
+        self._http = http
+        self._token_ttl = max(1, min(int(token_ttl), 21600))
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self._static: Dict[str, str] = {}
+
+    async def _session_token(self, refresh: bool = False) -> Optional[str]:
+        async with self._lock:
+            now = time.monotonic()
+            if not refresh and self._token and now < self._token_expires_at:
+                return self._token
+            async with self._http.put(
+                f"{self.BASE_URL}/api/token",
+                headers={"X-aws-ec2-metadata-token-ttl-seconds": str(self._token_ttl)},
+            ) as resp:
+                if resp.status != 200:
+                    self._token = None
+                    return None
+                self._token = await resp.text()
+            # renew a little early so a token never expires between check and use
+            self._token_expires_at = now + self._token_ttl * 0.9
+            return self._token
+
+    async def get(self, path: str) -> Optional[str]:
+        try:
+            token = await self._session_token()
+            if not token:
+                return None
+            status, text = await self._read(path, token)
+            if status == 401:
+                token = await self._session_token(refresh=True)
+                if not token:
+                    return None
+                status, text = await self._read(path, token)
+            if status != 200:
+                return None
+            return text
+        except Exception:
             return None
-        return resp.text
-    except Exception:
-        return None
 
+    async def _read(self, path: str, token: str) -> Tuple[int, str]:
+        async with self._http.get(f"{self.BASE_URL}/{path}", headers={"X-aws-ec2-metadata-token": token}) as resp:
+            return resp.status, await resp.text()
+
+    async def get_static(self, path: str) -> Optional[str]:
+        """Like ``get`` for values that never change on a running instance."""
+        if path in self._static:
+            return self._static[path]
+        value = await self.get(path)
+        if value is not None:
+            self._static[path] = value
+        return value
+
+
+_imds = _ImdsClient(_imds_http)
 
-def _detect_capacity_type() -> Optional[str]:
-    lifecycle = _fetch_imds("meta-data/instance-life-cycle")
-    if lifecycle and lifecycle.strip().lower() == "spot":
+
+async def _fetch_imds(path: str) -> Optional[str]:
+    return await _imds.get(path)
+
+
+async def _instance_lifecycle() -> Optional[str]:
+    lifecycle = await _imds.get_static("meta-data/instance-life-cycle")
+    return lifecycle.strip().lower() if lifecycle else None
+
+
+async def _detect_capacity_type() -> Optional[str]:
+    if await _instance_lifecycle() == "spot":
         return "spot"
     return "on-demand"
 
 
-def _detect_instance_type() -> Optional[str]:
-    instance_type = _fetch_imds("meta-data/instance-type")
+async def _detect_instance_type() -> Optional[str]:
+    instance_type = await _imds.get_static("meta-data/instance-type")
     return instance_type.strip() if instance_type else None
 
 
-def _check_spot_interruption() -> bool:
+async def _check_spot_interruption() -> bool:
     """Check EC2 instance metadata for Spot interruption notice (2-min warning)."""
-    return _fetch_imds("meta-data/spot/instance-action") is not None
+    return await _fetch_imds("meta-data/spot/instance-action") is not None
 
 
-def _check_spot_rebalance() -> bool:
+async def _check_spot_rebalance() -> bool:
     """Check EC2 instance metadata for Spot rebalance recommendation."""
-    return _fetch_imds("meta-data/events/recommendations/rebalance") is not None
+    return await _fetch_imds("meta-data/events/recommendations/rebalance") is not None
 
 
-def _check_asg_termination() -> bool:
+async def _check_asg_termination() -> bool:
     """Check ASG target lifecycle state (scale-in/termination intent)."""
-    state = _fetch_imds("meta-data/autoscaling/target-lifecycle-state")
+    state = await _fetch_imds("meta-data/autoscaling/target-lifecycle-state")
     if not state:
         return False
     return state.strip() not in ("InService", "")
 
 
-def _termination_monitor() -> None:
-    """Background thread polling for termination/rebalance signals every 5 seconds."""
+def _request_shutdown(reason: str) -> None:
+    """Flag the worker for shutdown; the first reason wins. Safe to call from any thread."""
     global _shutdown_requested, _shutdown_reason
+    _shutdown_requested = True
+    if not _shutdown_reason:
+        _shutdown_reason = reason
+    for listener in list(_shutdown_listeners):
+        listener()
+
+
+async def _termination_checks() -> List[Tuple[str, Callable[[], Awaitable[bool]], str]]:
+    checks: List[Tuple[str, Callable[[], Awaitable[bool]], str]] = []
+    # Spot signals can't fire on on-demand capacity; keep them when the lifecycle is unknown.
+    if await _instance_lifecycle() in (None, "spot"):
+        checks.append(("spot_interruption", _check_spot_interruption, "Spot interruption notice received!"))
+        checks.append(("spot_rebalance", _check_spot_rebalance, "Spot rebalance recommendation received!"))
+    checks.append(("asg_termination", _check_asg_termination, "ASG termination intent detected!"))
+    return checks
+
+
+async def _termination_monitor(interval: float = TERMINATION_CHECK_INTERVAL_SECONDS) -> None:
+    """Background task watching IMDS for termination/rebalance signals.
+
+    Each tick makes a single IMDS request, rotating through the signals that
+    apply to this instance, so every signal is seen within len(checks) ticks.
+    """
+    checks = await _termination_checks()
+    tick = 0
     while not _shutdown_requested:
-        if _check_spot_interruption():
-            _shutdown_requested = True
-            _shutdown_reason = "spot_interruption"
-            print("[worker] Spot interruption notice received!")
-            break
-        if _check_spot_rebalance():
-            _shutdown_requested = True
-            _shutdown_reason = "spot_rebalance"
-            print("[worker] Spot rebalance recommendation received!")
-            break
-        if _check_asg_termination():
-            _shutdown_requested = True
-            _shutdown_reason = "asg_termination"
-            print("[worker] ASG termination intent detected!")
+        reason, check, message = checks[tick % len(checks)]
+        tick += 1
+        if await check():
+            print(f"[worker] {message}")
+            _request_shutdown(reason)
             break
-        time.sleep(5)
+        await _sleep_unless_shutdown(interval)
 
 
-def _requeue_job(dispatch_id: int, lease_token: str, reason: str) -> None:
+async def _requeue_job(dispatch_id: int, lease_token: str, reason: str) -> None:
     """Ask backend to requeue job (don't count as failed attempt)."""
     try:
-        requests.post(
+        async with _backend_http.post(
             f"{API_BASE_URL}/api/worker/requeue",
             json={"dispatch_id": dispatch_id, "lease_token": lease_token, "reason": reason},
             headers=_backend_headers(),
             timeout=10,
-        )
+        ):
+            pass
     except Exception as e:
         print(f"[worker] Requeue failed: {e}")
 
 
-def _set_scale_in_protection(protected: bool) -> None:
-    """Set ASG scale-in protection for this instance."""
-    if not ASG_NAME:
-        return
-    try:
+class ScaleInProtection:
+    """ASG scale-in protection for this instance, synced in the background.
+
+    ``set`` only records the desired state. A daemon thread calls
+    ``set_instance_protection`` when it differs from what AWS last accepted:
+    protecting is applied straight away, unprotecting after
+    ``settle_seconds`` so the idle gap between two jobs costs no API calls.
+    Failed calls are retried with backoff.
+    """
+
+    _MAX_RETRY_SECONDS = 60.0
+
+    def __init__(
+        self,
+        asg_name: str,
+        instance_id: str,
+        settle_seconds: float = SCALE_IN_PROTECTION_SETTLE_SECONDS,
+        client_factory: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        self.asg_name = asg_name
+        self.instance_id = instance_id
+        self.settle_seconds = settle_seconds
+        self._client_factory = client_factory or self._boto3_client
+        self._client: Any = None
+        self._cond = threading.Condition()
+        self._apply_lock = threading.Lock()
+        self._desired: Optional[bool] = None
+        self._applied: Optional[bool] = None
+        self._changed_at = 0.0
+        self._retry_at = 0.0
+        self._retry_delay = HTTP_RETRY_BACKOFF_SECONDS or 1.0
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    @staticmethod
+    def _boto3_client() -> Any:
         import boto3
-        client = boto3.client("autoscaling")
-        client.set_instance_protection(
-            InstanceIds=[WORKER_ID],
-            AutoScalingGroupName=ASG_NAME,
-            ProtectedFromScaleIn=protected,
-        )
-    except Exception as e:
-        print(f"[worker] Scale-in protection error: {e}")
+        return boto3.client("autoscaling")
+
+    @property
+    def applied(self) -> Optional[bool]:
+        return self._applied
+
+    def set(self, protected: bool) -> None:
+        if not self.asg_name:
+            return
+        with self._cond:
+            if protected != self._desired:
+                self._desired = protected
+                self._changed_at = time.monotonic()
+                self._retry_at = 0.0
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="scale-in-protection", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self) -> bool:
+        """Apply the desired state now, skipping the settle delay. Used on shutdown."""
+        with self._cond:
+            desired = self._desired
+        if desired is None or desired == self._applied:
+            return True
+        return self._apply(desired)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    desired = self._desired
+                    now = time.monotonic()
+                    if desired is None or desired == self._applied:
+                        self._cond.wait()
+                        continue
+                    due = self._retry_at
+                    if not desired:
+                        due = max(due, self._changed_at + self.settle_seconds)
+                    if now < due:
+                        self._cond.wait(due - now)
+                        continue
+                    break
+            self._apply(desired)
 
+    def _apply(self, protected: bool) -> bool:
+        with self._apply_lock:
+            if protected == self._applied:
+                return True
+            try:
+                if self._client is None:
+                    self._client = self._client_factory()
+                self._client.set_instance_protection(
+                    InstanceIds=[self.instance_id],
+                    AutoScalingGroupName=self.asg_name,
+                    ProtectedFromScaleIn=protected,
+                )
+            except Exception as e:
+                print(f"[worker] Scale-in protection error: {e}")
+                with self._cond:
+                    self._retry_at = time.monotonic() + self._retry_delay
+                    self._retry_delay = min(self._retry_delay * 2, self._MAX_RETRY_SECONDS)
+                return False
+            with self._cond:
+                self._applied = protected
+                self._retry_delay = HTTP_RETRY_BACKOFF_SECONDS or 1.0
+                self._cond.notify_all()
+            return True
 
-def _fleet_register() -> Tuple[str, str]:
+
+def _comfyui_instance_count() -> int:
+    return len(dict.fromkeys(COMFYUI_BASE_URLS)) or 1
+
+
+def _lease_capacity() -> int:
+    """Jobs the worker holds at once (GPU slots plus prefetch, per instance): the backend's max_concurrency."""
+    return (max(1, MAX_CONCURRENCY) + max(0, JOB_PREFETCH_DEPTH)) * _comfyui_instance_count()
+
+
+async def _fleet_register() -> Tuple[str, str]:
     """Register this worker with the backend via fleet secret. Returns (worker_id, token)."""
     if not FLEET_SLUG:
         raise RuntimeError("FLEET_SLUG is required for fleet registration.")
@@ -172,107 +796,401 @@ def _fleet_register() -> Tuple[str, str]:
         "worker_id": WORKER_ID,
         "display_name": WORKER_ID,
         "capabilities": _parse_capabilities(),
-        "max_concurrency": MAX_CONCURRENCY,
+        "max_concurrency": _lease_capacity(),
         "fleet_slug": FLEET_SLUG,
     }
     if FLEET_STAGE:
         payload["stage"] = FLEET_STAGE
-    capacity_type = _detect_capacity_type()
+    # IMDS is still read through its blocking session
+    capacity_type = await _detect_capacity_type()
     if capacity_type:
         payload["capacity_type"] = capacity_type
-    instance_type = _detect_instance_type()
+    instance_type = await _detect_instance_type()
     if instance_type:
         payload["instance_type"] = instance_type
 
-    resp = requests.post(
+    async with _backend_http.post(
         f"{API_BASE_URL}/api/worker/register",
         json=payload,
         headers={"Content-Type": "application/json", "X-Fleet-Secret": FLEET_SECRET},
-        timeout=30,
-    )
-    resp.raise_for_status()
-    data = resp.json().get("data", {})
+    ) as resp:
+        resp.raise_for_status()
+        data = (await resp.json()).get("data", {})
     return data["worker_id"], data["token"]
 
 
-def _fleet_deregister(reason: Optional[str] = None) -> None:
+async def _fleet_deregister(reason: Optional[str] = None) -> None:
     """Deregister this worker from the backend."""
     try:
         payload = {"reason": reason} if reason else {}
-        requests.post(
+        async with _backend_http.post(
             f"{API_BASE_URL}/api/worker/deregister",
             json=payload,
             headers=_backend_headers(),
             timeout=10,
-        )
+        ):
+            pass
     except Exception as e:
         print(f"[worker] Deregister failed: {e}")
 
 
-def poll(current_load: int) -> Optional[Dict[str, Any]]:
+async def _poll_backend(
+    current_load: int,
+    max_concurrency: Optional[int] = None,
+    wait_seconds: int = 0,
+    max_jobs: int = 1,
+) -> Dict[str, Any]:
     payload = {
         "worker_id": WORKER_ID,
         "current_load": current_load,
-        "max_concurrency": MAX_CONCURRENCY,
+        "max_concurrency": _lease_capacity() if max_concurrency is None else max_concurrency,
         "capabilities": _parse_capabilities(),
     }
-    data = _backend_post("/api/worker/poll", payload)
-    return data.get("data", {}).get("job")
+    if max_jobs > 1:
+        payload["max_jobs"] = max_jobs
+    workflow_hashes = _workflow_templates.hashes()
+    if workflow_hashes:
+        payload["workflow_hashes"] = workflow_hashes
+    timeout = None
+    if wait_seconds > 0:
+        payload["wait_seconds"] = wait_seconds
+        timeout = BACKEND_HTTP_TIMEOUT_SECONDS + wait_seconds
+    started = time.monotonic()
+    try:
+        data = await _backend_post("/api/worker/poll", payload, timeout=timeout)
+    except Exception:
+        _metric_polls.inc(result="error")
+        raise
+    finally:
+        _metric_poll_seconds.observe(time.monotonic() - started, long_poll="true" if wait_seconds > 0 else "false")
+    data = data.get("data") or {}
+    _metric_polls.inc(result="jobs" if _leased_jobs(data) else "empty")
+    return data
+
+
+async def poll(
+    current_load: int, max_concurrency: Optional[int] = None, wait_seconds: int = 0
+) -> Optional[Dict[str, Any]]:
+    return (await _poll_backend(current_load, max_concurrency, wait_seconds)).get("job")
+
+
+def _leased_jobs(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    jobs = data.get("jobs")
+    if isinstance(jobs, list):
+        return [job for job in jobs if job]
+    # backends without batch leasing only send "job"
+    return [data["job"]] if data.get("job") else []
+
+
+async def _hand_back_jobs(jobs: List[Dict[str, Any]], reason: str) -> None:
+    for job in jobs:
+        await _requeue_job(job["dispatch_id"], job["lease_token"], reason)
+
+
+async def _sleep_unless_shutdown(seconds: float) -> None:
+    """Sleep for ``seconds``, returning as soon as shutdown is requested."""
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+
+    def wake() -> None:
+        try:
+            loop.call_soon_threadsafe(woken.set)
+        except RuntimeError:
+            pass  # loop already closed
+
+    _shutdown_listeners.append(wake)
+    try:
+        if not _shutdown_requested:
+            await asyncio.wait_for(woken.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        _shutdown_listeners.remove(wake)
 
 
-def heartbeat(dispatch_id: int, lease_token: str) -> None:
-    _backend_post("/api/worker/heartbeat", {
+class JobPoller:
+    """Job acquisition loop state: long-poll when the backend supports it, else back off.
+
+    A backend that honours ``wait_seconds`` marks its empty responses with
+    ``long_poll``; the worker then goes straight back into the next long poll.
+    Otherwise (older backend, draining, at capacity, errors) empty polls sleep
+    with exponential backoff and equal jitter, reset as soon as a job arrives.
+    """
+
+    LONG_POLL_REPROBE_SECONDS = 300.0
+
+    def __init__(
+        self,
+        long_wait: int = POLL_LONG_WAIT_SECONDS,
+        min_delay: float = POLL_BACKOFF_MIN_SECONDS,
+        max_delay: float = POLL_BACKOFF_MAX_SECONDS,
+        sleep: Callable[[float], Awaitable[None]] = _sleep_unless_shutdown,
+    ) -> None:
+        self.long_wait = max(0, long_wait)
+        self.min_delay = max(0.05, min_delay)
+        self.max_delay = max(self.min_delay, max_delay)
+        self._sleep = sleep
+        self._delay = self.min_delay
+        self._long_poll_retry_at = 0.0
+
+    @property
+    def long_poll(self) -> bool:
+        return self.long_wait > 0 and time.monotonic() >= self._long_poll_retry_at
+
+    async def next_jobs(
+        self,
+        current_load: int,
+        max_concurrency: Optional[int] = None,
+        max_jobs: int = 1,
+    ) -> List[Dict[str, Any]]:
+        """Lease up to ``max_jobs`` jobs in one round trip; empty when none arrived."""
+        wait = self.long_wait if self.long_poll else 0
+        try:
+            data = await _poll_backend(current_load, max_concurrency, wait, max_jobs)
+        except Exception as exc:
+            print(f"[worker] Poll failed: {exc}")
+            await self.backoff()
+            return []
+
+        jobs, back_off = self._receive(data, wait)
+        if back_off:
+            await self.backoff()
+        return jobs
+
+    def _receive(self, data: Dict[str, Any], wait: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """Return the leased jobs and whether to back off before the next poll."""
+        jobs = _leased_jobs(data)
+        if jobs:
+            self._delay = self.min_delay
+            return jobs, False
+        if wait and not data.get("long_poll"):
+            print("[worker] Backend ignores wait_seconds; falling back to polling with backoff.")
+            self._long_poll_retry_at = time.monotonic() + self.LONG_POLL_REPROBE_SECONDS
+        elif wait and data.get("wait_seconds"):
+            # the backend already spent the idle time holding the request
+            self._delay = self.min_delay
+            return [], False
+        return [], True
+
+    async def backoff(self) -> None:
+        await self._sleep(self._next_delay())
+
+    def _next_delay(self) -> float:
+        delay = self._delay
+        self._delay = min(self.max_delay, max(delay * 2, self.min_delay))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+async def heartbeat(dispatch_id: int, lease_token: str) -> Dict[str, Any]:
+    data = await _backend_post("/api/worker/heartbeat", {
         "dispatch_id": dispatch_id,
         "lease_token": lease_token,
         "worker_id": WORKER_ID,
-    })
+    }, idempotent=True)
+    return data.get("data") or {}
 
 
-def complete_job(
+async def complete_job(
     dispatch_id: int,
     lease_token: str,
     provider_job_id: str,
-    output_path: str,
+    output_path: Optional[str],
     output_metadata: Optional[Dict[str, Any]] = None,
+    output_size: Optional[int] = None,
+    output_mime_type: Optional[str] = None,
 ) -> None:
-    mime_type, _ = mimetypes.guess_type(output_path)
+    """Report a finished job. Size and mime type come from ``output_path`` unless given."""
+    mime_type = output_mime_type
+    if mime_type is None and output_path:
+        mime_type, _ = mimetypes.guess_type(output_path)
+    if output_size is None:
+        if not output_path:
+            raise ValueError("complete_job needs output_path or output_size.")
+        output_size = os.path.getsize(output_path)
     payload = {
         "dispatch_id": dispatch_id,
         "lease_token": lease_token,
         "worker_id": WORKER_ID,
         "provider_job_id": provider_job_id,
         "output": {
-            "size": os.path.getsize(output_path),
+            "size": output_size,
             "mime_type": mime_type or "video/mp4",
         },
     }
     if output_metadata:
         payload["output"]["metadata"] = output_metadata
-    _backend_post("/api/worker/complete", payload)
+    await _backend_post("/api/worker/complete", payload)
 
 
-def fail_job(dispatch_id: int, lease_token: str, message: str) -> None:
-    _backend_post("/api/worker/fail", {
+async def fail_job(
+    dispatch_id: int,
+    lease_token: str,
+    message: str,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> None:
+    payload: Dict[str, Any] = {
         "dispatch_id": dispatch_id,
         "lease_token": lease_token,
         "worker_id": WORKER_ID,
         "error_message": message,
-    })
+    }
+    if metadata:
+        payload["output"] = {"metadata": metadata}
+    await _backend_post("/api/worker/fail", payload)
+
+
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)$")
+_SHA256_HEX_RE = re.compile(r"[0-9a-f]{64}")
+
+
+def _content_range_total(resp: aiohttp.ClientResponse) -> Optional[int]:
+    match = _CONTENT_RANGE_RE.match(resp.headers.get("Content-Range", ""))
+    return int(match.group(3)) if match else None
 
 
-def download_input(input_url: str) -> str:
-    resp = requests.get(input_url, stream=True, timeout=60)
-    resp.raise_for_status()
+def _preallocate(path: str, size: int) -> None:
+    with open(path, "r+b") as handle:
+        handle.truncate(size)
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(handle.fileno(), 0, size)
+            except OSError:
+                pass  # sparse file still works, just without the up-front reservation
+
+
+async def _download_range(
+    url: str,
+    path: str,
+    start: int,
+    end: int,
+    etag: Optional[str] = None,
+    resp: Optional[aiohttp.ClientResponse] = None,
+    stop: Optional[asyncio.Event] = None,
+) -> None:
+    """Fill bytes [start, end] of ``path``, resuming after the last written byte on resets."""
+    offset = start
+    failures = 0
+    delay = HTTP_RETRY_BACKOFF_SECONDS
+    with open(path, "r+b") as handle:
+        while offset <= end and not (stop is not None and stop.is_set()):
+            attempt_offset = offset
+            try:
+                if resp is None:
+                    headers = {"Range": f"bytes={offset}-{end}"}
+                    if etag:
+                        headers["If-Match"] = etag
+                    resp = await _s3_http.send("GET", url, headers=headers, timeout=60)
+                    resp.raise_for_status()
+                    if resp.status != 206:
+                        raise RuntimeError(f"Input server ignored range request (HTTP {resp.status}).")
+                handle.seek(offset)
+                async for chunk in resp.content.iter_chunked(1024 * 1024):
+                    if stop is not None and stop.is_set():
+                        break
+                    if offset + len(chunk) > end + 1:
+                        raise RuntimeError(f"Input range {start}-{end} returned too many bytes.")
+                    handle.write(chunk)
+                    offset += len(chunk)
+                if stop is not None and stop.is_set():
+                    return
+                if offset <= end:
+                    raise aiohttp.ClientPayloadError(f"Input range {start}-{end} ended at byte {offset}.")
+            except aiohttp.ClientResponseError as exc:
+                if exc.status < 500:
+                    raise
+                failures += 1
+                if failures > INPUT_DOWNLOAD_RETRIES:
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
+            except _HTTP_ERRORS:
+                failures = 0 if offset > attempt_offset else failures + 1
+                if failures > INPUT_DOWNLOAD_RETRIES:
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
+            finally:
+                if resp is not None:
+                    resp.release()
+                    resp = None
+
+
+def _verify_content_hash(path: str, content_hash: Optional[str]) -> None:
+    expected = (content_hash or "").strip().lower().removeprefix("sha256:")
+    if not _SHA256_HEX_RE.fullmatch(expected):
+        return
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    if digest.hexdigest() != expected:
+        raise RuntimeError(f"Downloaded input failed integrity check (expected sha256 {expected}).")
+
+
+async def download_input(input_url: str, content_hash: Optional[str] = None) -> str:
+    """Download a presigned object to a temp file and return its path.
+
+    The first request asks for one segment by Range. When the server honours it,
+    the remaining segments are fetched concurrently into a preallocated file, each
+    resuming from its last written byte after a reset; otherwise the plain body
+    is streamed. A sha256 ``content_hash`` is checked before the path is returned.
+    """
     url_path = input_url.split("?", 1)[0]
     suffix = os.path.splitext(url_path)[1] or ".bin"
     with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        for chunk in resp.iter_content(chunk_size=1024 * 1024):
-            if chunk:
-                tmp.write(chunk)
-        return tmp.name
+        path = tmp.name
 
-
-def upload_output(output_url: str, output_headers: Dict[str, str], output_path: str) -> None:
+    try:
+        segment = max(1, INPUT_DOWNLOAD_SEGMENT_BYTES)
+        resp = await _s3_http.send("GET", input_url, headers={"Range": f"bytes=0-{segment - 1}"}, timeout=60)
+        if resp.status == 416:
+            # S3 rejects any range on an empty object
+            resp.release()
+            resp = await _s3_http.send("GET", input_url, timeout=60)
+        total = _content_range_total(resp) if resp.status == 206 else None
+
+        if total is None:
+            try:
+                resp.raise_for_status()
+                with open(path, "wb") as handle:
+                    async for chunk in resp.content.iter_chunked(1024 * 1024):
+                        handle.write(chunk)
+            finally:
+                resp.release()
+        else:
+            _preallocate(path, total)
+            etag = resp.headers.get("ETag")
+            ranges = [(start, min(start + segment, total) - 1) for start in range(segment, total, segment)]
+            if not ranges:
+                await _download_range(input_url, path, 0, total - 1, etag, resp)
+            else:
+                limit = asyncio.Semaphore(max(1, INPUT_DOWNLOAD_CONCURRENCY))
+                stop = asyncio.Event()
+
+                async def fetch(start: int, end: int, first: Optional[aiohttp.ClientResponse]) -> None:
+                    async with limit:
+                        await _download_range(input_url, path, start, end, etag, first, stop)
+
+                tasks = [asyncio.ensure_future(fetch(0, segment - 1, resp))]
+                tasks += [asyncio.ensure_future(fetch(start, end, None)) for start, end in ranges]
+                try:
+                    await asyncio.gather(*tasks)
+                except BaseException:
+                    stop.set()
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+
+        await asyncio.to_thread(_verify_content_hash, path, content_hash)
+    except BaseException:
+        _safe_unlink(path)
+        raise
+    _metric_transfer_bytes.inc(os.path.getsize(path), direction="download")
+    return path
+
+
+def _normalize_output_headers(output_headers: Optional[Dict[str, Any]]) -> Dict[str, str]:
     headers = output_headers or {}
     normalized = {}
     for key, value in headers.items():
@@ -281,120 +1199,762 @@ def upload_output(output_url: str, output_headers: Dict[str, str], output_path:
                 normalized[key] = value[0]
             continue
         normalized[key] = value
+    return normalized
+
+
+async def upload_output(output_url: str, output_headers: Dict[str, str], output_path: str) -> None:
+    normalized = _normalize_output_headers(output_headers)
     with open(output_path, "rb") as handle:
-        resp = requests.put(output_url, data=handle, headers=normalized, timeout=300)
-        resp.raise_for_status()
+        async with _s3_http.put(output_url, data=handle, headers=normalized) as resp:
+            resp.raise_for_status()
+
+
+# S3 answers BadDigest/RequestTimeout with 400; both are worth another attempt
+_PART_RETRY_STATUS_CODES = (400, 408, 429, 500, 502, 503, 504)
+
+RangeReader = Callable[[int, int], Awaitable[bytes]]
+
+
+def _read_file_range(path: str, start: int, length: int) -> bytes:
+    with open(path, "rb") as handle:
+        handle.seek(start)
+        return handle.read(length)
+
+
+def _file_range_reader(path: str) -> RangeReader:
+    async def read_range(start: int, length: int) -> bytes:
+        return await asyncio.to_thread(_read_file_range, path, start, length)
+
+    return read_range
+
+
+async def _init_output_multipart(
+    dispatch_id: int,
+    lease_token: str,
+    size: int,
+    mime_type: Optional[str],
+) -> Optional[Dict[str, Any]]:
+    try:
+        data = await _backend_post("/api/worker/output-multipart", {
+            "dispatch_id": dispatch_id,
+            "lease_token": lease_token,
+            "size_bytes": size,
+            "mime_type": mime_type,
+        })
+    except _HTTP_ERRORS as exc:
+        print(f"[worker] Multipart upload unavailable, using single PUT: {exc}")
+        return None
+    upload = data.get("data") or {}
+    if not upload.get("upload_id") or not upload.get("part_urls") or not upload.get("part_size"):
+        return None
+    return upload
+
+
+async def _abort_output_multipart(dispatch_id: int, lease_token: str, upload_id: str) -> None:
+    try:
+        await _backend_post("/api/worker/output-multipart/abort", {
+            "dispatch_id": dispatch_id,
+            "lease_token": lease_token,
+            "upload_id": upload_id,
+        })
+    except _HTTP_ERRORS as exc:
+        print(f"[worker] Failed to abort multipart upload {upload_id}: {exc}")
+
+
+def _md5_header(data: bytes) -> str:
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+async def _upload_output_part(url: str, start: int, length: int, read_range: RangeReader) -> str:
+    delay = HTTP_RETRY_BACKOFF_SECONDS
+    for attempt in range(OUTPUT_MULTIPART_PART_RETRIES + 1):
+        last_attempt = attempt == OUTPUT_MULTIPART_PART_RETRIES
+        try:
+            data = await read_range(start, length)
+            if len(data) != length:
+                raise RuntimeError(f"Short read for part at {start}: got {len(data)} of {length} bytes.")
+            digest = await asyncio.to_thread(_md5_header, data)
+            async with _s3_http.put(url, data=data, headers={"Content-MD5": digest}) as resp:
+                final = resp.status not in _PART_RETRY_STATUS_CODES or last_attempt
+                if final:
+                    resp.raise_for_status()
+                etag = resp.headers.get("ETag")
+        except aiohttp.ClientResponseError:
+            raise
+        except (*_HTTP_ERRORS, RuntimeError):
+            if last_attempt:
+                raise
+        else:
+            if final:
+                if not etag:
+                    raise RuntimeError(f"S3 returned no ETag for part at {start}.")
+                return etag
+        await asyncio.sleep(delay)
+        delay *= 2
+    raise RuntimeError("unreachable")
+
+
+async def upload_output_multipart(
+    dispatch_id: int,
+    lease_token: str,
+    size: int,
+    mime_type: Optional[str],
+    read_range: RangeReader,
+) -> bool:
+    """Upload ``size`` bytes as concurrent multipart parts read via ``read_range``.
+
+    Returns False when the backend could not start a multipart upload, so the
+    caller can fall back to the single presigned PUT. Any part failure aborts
+    the upload on S3 before the error propagates.
+    """
+    upload = await _init_output_multipart(dispatch_id, lease_token, size, mime_type)
+    if upload is None:
+        return False
+
+    upload_id = upload["upload_id"]
+    part_size = int(upload["part_size"])
+    part_urls = sorted(upload["part_urls"], key=lambda part: int(part["part_number"]))
+    if len(part_urls) != math.ceil(size / part_size):
+        await _abort_output_multipart(dispatch_id, lease_token, upload_id)
+        return False
+
+    limit = asyncio.Semaphore(max(1, OUTPUT_MULTIPART_CONCURRENCY))
+
+    async def send(index: int, part: Dict[str, Any]) -> str:
+        start = index * part_size
+        async with limit:
+            return await _upload_output_part(part["url"], start, min(part_size, size - start), read_range)
+
+    tasks = [asyncio.ensure_future(send(index, part)) for index, part in enumerate(part_urls)]
+    try:
+        etags = await asyncio.gather(*tasks)
+        parts = [
+            {"part_number": int(part["part_number"]), "etag": etag}
+            for part, etag in zip(part_urls, etags)
+        ]
+        await _backend_post("/api/worker/output-multipart/complete", {
+            "dispatch_id": dispatch_id,
+            "lease_token": lease_token,
+            "upload_id": upload_id,
+            "parts": parts,
+        })
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.shield(_abort_output_multipart(dispatch_id, lease_token, upload_id))
+        raise
+    return True
+
+
+def _comfyui_root(endpoint: str) -> str:
+    if endpoint in COMFYUI_BASE_URLS:
+        index = COMFYUI_BASE_URLS.index(endpoint)
+        if index < len(COMFYUI_ROOTS) and COMFYUI_ROOTS[index]:
+            return COMFYUI_ROOTS[index]
+    return COMFYUI_ROOT
+
+
+def _colocated_dir(endpoint: str, file_type: str = "input") -> Optional[str]:
+    """ComfyUI's input/output/temp directory when it shares this node's filesystem."""
+    root = _comfyui_root(endpoint)
+    if not root or file_type not in ("input", "output", "temp"):
+        return None
+    return os.path.join(root, file_type)
+
+
+def _colocated_path(base_dir: str, filename: str, subfolder: str = "") -> str:
+    base = os.path.realpath(base_dir)
+    path = os.path.realpath(os.path.join(base, subfolder or "", filename))
+    if os.path.commonpath([base, path]) != base:
+        raise RuntimeError(f"ComfyUI file path escapes {base_dir}: {subfolder}/{filename}")
+    return path
+
+
+def _place_comfyui_input(file_path: str, input_dir: str, file_name: str) -> str:
+    """Put a file into ComfyUI's input dir by hardlink (copy across filesystems)."""
+    target = _colocated_path(input_dir, file_name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    staging = f"{target}.{uuid.uuid4().hex}.part"
+    try:
+        os.link(file_path, staging)
+    except OSError:
+        shutil.copyfile(file_path, staging)
+    os.replace(staging, target)
+    return file_name
+
+
+async def upload_to_comfyui(file_path: str, endpoint: str, upload_name: Optional[str] = None) -> str:
+    """Upload a file to local ComfyUI via POST /upload/image.
 
+    When COMFYUI_ROOT is set the file is linked into ComfyUI's input dir instead.
+    """
+    file_name = upload_name or os.path.basename(file_path)
+    input_dir = _colocated_dir(endpoint)
+    if input_dir:
+        return await asyncio.to_thread(_place_comfyui_input, file_path, input_dir, file_name)
 
-def upload_to_comfyui(file_path: str, endpoint: str) -> str:
-    """Upload a file to local ComfyUI via POST /upload/image."""
     url = f"{endpoint}/upload/image"
-    file_name = os.path.basename(file_path)
     mime_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
     with open(file_path, "rb") as handle:
-        files = {"image": (file_name, handle, mime_type)}
-        resp = requests.post(url, files=files, data={"type": "input", "overwrite": "true"}, timeout=300)
-        resp.raise_for_status()
-        result = resp.json()
-        name = result.get("name")
-        if not name:
-            raise RuntimeError("ComfyUI upload did not return a filename.")
+        form = aiohttp.FormData()
+        form.add_field("image", handle, filename=file_name, content_type=mime_type)
+        form.add_field("type", "input")
+        form.add_field("overwrite", "true")
+        async with _comfyui_http.post(url, data=form, timeout=300) as resp:
+            resp.raise_for_status()
+            result = await resp.json()
+    name = result.get("name")
+    if not name:
+        raise RuntimeError("ComfyUI upload did not return a filename.")
+    return name
+
+
+async def _comfyui_has_input(endpoint: str, filename: str) -> bool:
+    """Check that ComfyUI's input directory still holds ``filename``."""
+    input_dir = _colocated_dir(endpoint)
+    if input_dir:
+        return os.path.isfile(_colocated_path(input_dir, filename))
+    params = urlencode({"filename": filename, "type": "input"})
+    try:
+        async with _comfyui_http.request("HEAD", f"{endpoint}/view?{params}", timeout=10) as resp:
+            return resp.status == 200
+    except _HTTP_ERRORS:
+        return False
+
+
+class _AssetCache:
+    """Disk-backed asset cache keyed by content hash.
+
+    Each asset is kept once under ``root/blobs`` and the index remembers which
+    ComfyUI input filename holds it per endpoint. The index survives restarts;
+    ComfyUI copies are re-checked via ``/view`` before reuse, and blobs are
+    evicted least-recently-used once they exceed ``max_bytes``. Cache hits only
+    touch ``last_used`` in memory; the index is written on store, forget and
+    eviction, and at most every ``_SAVE_INTERVAL_SECONDS`` otherwise.
+    """
+
+    _MAX_ENTRIES = 10000
+    _SAVE_INTERVAL_SECONDS = 60.0
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max(0, max_bytes)
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._verified: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.RLock()
+        # content hash -> [asyncio.Lock, holders and waiters]; dropped when the count reaches zero
+        self._key_locks: Dict[str, List[Any]] = {}
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.root, "index.json")
+
+    def _blob_file(self, content_hash: str) -> str:
+        digest = hashlib.sha256(content_hash.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, "blobs", digest)
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            try:
+                with open(self._index_path, "r", encoding="utf-8") as handle:
+                    data = json.load(handle)
+                self._entries = data if isinstance(data, dict) else {}
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self) -> None:
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                json.dump(self._load(), handle)
+            os.replace(tmp_path, self._index_path)
+        except OSError as exc:
+            print(f"[worker] Asset cache index not saved: {exc}")
+
+    @asynccontextmanager
+    async def key_lock(self, content_hash: str) -> AsyncIterator[None]:
+        """Per-hash lock so concurrent jobs fetch and upload an asset only once."""
+        slot = self._key_locks.setdefault(content_hash, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self._key_locks[content_hash]
+
+    async def lookup(self, content_hash: str, endpoint: str) -> Optional[str]:
+        """Return the ComfyUI filename for ``content_hash`` if ComfyUI still has it."""
+        with self._lock:
+            entry = self._load().get(content_hash)
+            name = (entry or {}).get("uploads", {}).get(endpoint)
+            if not name:
+                return None
+            verified_at = self._verified.get((endpoint, content_hash))
+        if verified_at is None or time.monotonic() - verified_at > ASSET_CACHE_VERIFY_SECONDS:
+            if not await _comfyui_has_input(endpoint, name):
+                self.forget_upload(content_hash, endpoint)
+                return None
+        with self._lock:
+            self._verified[(endpoint, content_hash)] = time.monotonic()
+            entry = self._load().get(content_hash)
+            if entry is not None:
+                entry["last_used"] = time.time()
+                self._dirty = True
+            if self._dirty and time.monotonic() - self._saved_at >= self._SAVE_INTERVAL_SECONDS:
+                self._save()
         return name
 
+    def flush(self) -> None:
+        """Write out ``last_used`` updates from cache hits not yet in the index."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def has_upload(self, content_hash: str, endpoint: str) -> bool:
+        """Whether ``endpoint`` was last known to hold ``content_hash``; not re-verified."""
+        with self._lock:
+            entry = self._load().get(content_hash)
+            return bool((entry or {}).get("uploads", {}).get(endpoint))
+
+    def blob_path(self, content_hash: str) -> Optional[str]:
+        with self._lock:
+            entry = self._load().get(content_hash)
+            if not entry or not entry.get("size"):
+                return None
+        path = self._blob_file(content_hash)
+        return path if os.path.exists(path) else None
+
+    def store(self, content_hash: str, endpoint: str, name: str, source_path: Optional[str] = None) -> None:
+        """Record an upload and, when given, move ``source_path`` into the blob store.
+
+        Moving a blob may copy across filesystems, so callers on the event loop
+        pass ``source_path`` through ``asyncio.to_thread``.
+        """
+        with self._lock:
+            entries = self._load()
+            entry = entries.setdefault(content_hash, {"size": 0, "uploads": {}})
+            entry["uploads"][endpoint] = name
+            entry["last_used"] = time.time()
+            self._verified[(endpoint, content_hash)] = time.monotonic()
+            if source_path and not entry.get("size") and self.max_bytes:
+                blob = self._blob_file(content_hash)
+                try:
+                    os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    shutil.move(source_path, blob)
+                    entry["size"] = os.path.getsize(blob)
+                except OSError as exc:
+                    print(f"[worker] Asset cache blob not stored: {exc}")
+            self._evict()
+            self._save()
+
+    def forget_upload(self, content_hash: str, endpoint: str) -> None:
+        with self._lock:
+            entry = self._load().get(content_hash)
+            if entry is not None:
+                entry.get("uploads", {}).pop(endpoint, None)
+                self._save()
+            self._verified.pop((endpoint, content_hash), None)
+
+    def _evict(self) -> None:
+        entries = self._load()
+        by_age = sorted(entries.items(), key=lambda item: item[1].get("last_used", 0))
+        total = sum(entry.get("size", 0) for entry in entries.values())
+        for content_hash, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            if entry.get("size"):
+                _safe_unlink(self._blob_file(content_hash))
+                total -= entry["size"]
+                entry["size"] = 0
+        excess = len(entries) - self._MAX_ENTRIES
+        for content_hash, _ in by_age[:max(0, excess)]:
+            _safe_unlink(self._blob_file(content_hash))
+            entries.pop(content_hash, None)
+
+
+_asset_cache = _AssetCache(ASSET_CACHE_DIR, ASSET_CACHE_MAX_BYTES)
+
+
+def _asset_upload_name(content_hash: str, download_url: str) -> str:
+    """Stable ComfyUI input filename so identical content always lands on one file."""
+    suffix = os.path.splitext(download_url.split("?", 1)[0])[1] or ".bin"
+    safe_hash = re.sub(r"[^A-Za-z0-9]+", "_", content_hash).strip("_")[:64]
+    return f"asset_{safe_hash}{suffix}"
+
 
-def download_and_upload_assets(
+async def _fetch_cached_asset(
+    content_hash: str,
+    download_url: str,
+    endpoint: str,
+    job_timings: Optional["JobTimings"] = None,
+) -> Tuple[str, str]:
+    """Resolve a cacheable asset. Returns (comfyui_filename, source)."""
+    async with _asset_cache.key_lock(content_hash):
+        name = await _asset_cache.lookup(content_hash, endpoint)
+        if name:
+            return name, "cache"
+
+        upload_name = _asset_upload_name(content_hash, download_url)
+        blob = _asset_cache.blob_path(content_hash)
+        if blob:
+            with _timed(job_timings, "comfyui_upload"):
+                name = await upload_to_comfyui(blob, endpoint, upload_name)
+            _asset_cache.store(content_hash, endpoint, name)
+            return name, "blob"
+
+        with _timed(job_timings, "asset_download"):
+            tmp_path = await download_input(download_url, content_hash)
+        try:
+            with _timed(job_timings, "comfyui_upload"):
+                name = await upload_to_comfyui(tmp_path, endpoint, upload_name)
+            await asyncio.to_thread(_asset_cache.store, content_hash, endpoint, name, tmp_path)
+            return name, "download"
+        finally:
+            _safe_unlink(tmp_path)
+
+
+async def _fetch_asset(asset: Dict[str, Any], endpoint: str, job_timings: Optional["JobTimings"] = None) -> Dict[str, Any]:
+    placeholder = asset["placeholder"]
+    download_url = asset["download_url"]
+    content_hash = asset.get("content_hash")
+    started = time.monotonic()
+
+    # Non-primary assets with a content hash go through the shared cache
+    if content_hash and not asset.get("is_primary_input", False):
+        name, source = await _fetch_cached_asset(str(content_hash), download_url, endpoint, job_timings)
+    else:
+        # Download the asset and upload it to ComfyUI on this self-hosted node.
+        with _timed(job_timings, "asset_download"):
+            tmp_path = await download_input(download_url)
+        try:
+            with _timed(job_timings, "comfyui_upload"):
+                name, source = await upload_to_comfyui(tmp_path, endpoint), "download"
+        finally:
+            _safe_unlink(tmp_path)
+
+    _metric_asset_fetches.inc(source=source)
+    return {
+        "placeholder": placeholder,
+        "filename": name,
+        "source": source,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+async def download_and_upload_assets(
     assets: List[Dict[str, Any]],
     endpoint: str,
+    timings: Optional[List[Dict[str, Any]]] = None,
+    job_timings: Optional["JobTimings"] = None,
 ) -> Dict[str, str]:
     """Download assets from presigned URLs and upload to ComfyUI.
 
-    Returns a mapping of placeholder → comfyui_filename.
+    Assets are fetched concurrently (up to ASSET_FETCH_CONCURRENCY at once).
+    Returns a mapping of placeholder → comfyui_filename in asset order; when
+    ``timings`` is given, one entry per asset is appended to it. Download and
+    upload spans go to ``job_timings``.
     """
+    pending = [
+        asset for asset in assets
+        if asset.get("placeholder") and asset.get("download_url")
+    ]
+    if not pending:
+        return {}
+
+    limit = asyncio.Semaphore(max(1, ASSET_FETCH_CONCURRENCY))
+
+    async def fetch(asset: Dict[str, Any]) -> Dict[str, Any]:
+        async with limit:
+            return await _fetch_asset(asset, endpoint, job_timings)
+
+    tasks = [asyncio.ensure_future(fetch(asset)) for asset in pending]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
     placeholder_map: Dict[str, str] = {}
-    for asset in assets:
-        placeholder = asset.get("placeholder")
-        download_url = asset.get("download_url")
-        content_hash = asset.get("content_hash")
-        is_primary = asset.get("is_primary_input", False)
+    for result in results:
+        placeholder_map[result["placeholder"]] = result["filename"]
+        print(
+            f"[worker] Asset {result['placeholder']} -> {result['filename']} "
+            f"({result['source']}, {result['seconds']:.3f}s)"
+        )
+    if timings is not None:
+        timings.extend(results)
+    return placeholder_map
 
-        if not placeholder or not download_url:
-            continue
 
-        # Check cache for non-primary assets with a content hash
-        cache_key = (endpoint, content_hash) if content_hash and not is_primary else None
-        if cache_key and cache_key in _asset_cache:
-            placeholder_map[placeholder] = _asset_cache[cache_key]
-            continue
+@functools.lru_cache(maxsize=256)
+def _placeholder_pattern(tokens: Tuple[str, ...]) -> Optional["re.Pattern[str]"]:
+    # Longest first, so a token that extends another ("asset://__X__" vs "__X__") wins the match
+    ordered = sorted(tokens, key=len, reverse=True)
+    if not ordered:
+        return None
+    return re.compile("|".join(re.escape(token) for token in ordered))
+
+
+WorkflowPath = Tuple[Any, ...]
+
+
+class WorkflowTemplate:
+    """A workflow graph indexed by the string values that hold placeholder tokens.
 
-        # Download the asset
-        tmp_path = download_input(download_url)
+    The index is built with one walk over the graph. ``render`` then rewrites
+    each indexed string with a single regex pass (replacements are never
+    rescanned) and copies only the containers on the path to a changed value,
+    so the source workflow is never mutated or re-serialized.
+    """
+
+    def __init__(self, workflow: Dict[str, Any], tokens: Iterable[str]) -> None:
+        self.workflow = workflow
+        self.tokens = tuple(sorted({token for token in tokens if token}))
+        self._pattern = _placeholder_pattern(self.tokens)
+        self.slots: List[Tuple[WorkflowPath, str]] = []
+        if self._pattern is not None:
+            self._index(workflow, ())
+
+    def _index(self, value: Any, path: WorkflowPath) -> None:
+        if isinstance(value, str):
+            if self._pattern.search(value):
+                self.slots.append((path, value))
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                self._index(item, path + (key,))
+        elif isinstance(value, list):
+            for position, item in enumerate(value):
+                self._index(item, path + (position,))
+
+    def render(
+        self,
+        values: Dict[str, str],
+        assignments: Iterable[Tuple[WorkflowPath, Any]] = (),
+    ) -> Dict[str, Any]:
+        """Substitute ``values`` (token -> replacement) and apply ``assignments`` (path -> value)."""
+        root = dict(self.workflow)
+        copied: Dict[WorkflowPath, Any] = {(): root}
+
+        def assign(path: WorkflowPath, new_value: Any) -> None:
+            parent = root
+            for depth in range(1, len(path)):
+                node = copied.get(path[:depth])
+                if node is None:
+                    original = parent[path[depth - 1]]
+                    node = dict(original) if isinstance(original, dict) else list(original)
+                    parent[path[depth - 1]] = node
+                    copied[path[:depth]] = node
+                parent = node
+            parent[path[-1]] = new_value
+
+        if values and self._pattern is not None:
+            def replace(match: "re.Match[str]") -> str:
+                token = match.group(0)
+                return values.get(token, token)
+
+            for path, text in self.slots:
+                rendered = self._pattern.sub(replace, text)
+                if rendered != text:
+                    assign(path, rendered)
+
+        for path, value in assignments:
+            assign(path, value)
+        return root
+
+
+def _input_reference_values(input_payload: Dict[str, Any], input_reference: str) -> Tuple[Dict[str, str], str]:
+    """Placeholder tokens for the primary input, and the value injected into ``input_field``."""
+    placeholder = input_payload.get("input_path_placeholder", "__INPUT_PATH__")
+    reference_prefix = input_payload.get("input_reference_prefix")
+    is_asset_reference = reference_prefix is None and not os.path.exists(input_reference)
+
+    if reference_prefix:
+        value = f"{reference_prefix}{input_reference}"
+        values = {f"{reference_prefix}{placeholder}": value, placeholder: value}
+    elif reference_prefix is not None:
+        values = {f"asset://{placeholder}": input_reference, placeholder: input_reference}
+    elif is_asset_reference:
+        value = f"asset://{input_reference}"
+        values = {f"asset://{placeholder}": value, placeholder: value}
+    else:
+        values = {placeholder: input_reference}
+
+    field_value = input_reference
+    if reference_prefix and not str(field_value).startswith(reference_prefix):
+        field_value = f"{reference_prefix}{field_value}"
+    elif is_asset_reference and not str(field_value).startswith("asset://"):
+        field_value = f"asset://{field_value}"
+    return values, field_value
+
+
+class _WorkflowTemplateCache:
+    """LRU of raw workflow graphs by content hash, each with its compiled templates.
+
+    A workflow is compiled once per distinct placeholder set (effects sharing a
+    workflow normally use the same one), so a job only pays for rendering.
+    """
+
+    _MAX_COMPILED_PER_WORKFLOW = 16
+
+    def __init__(self, max_entries: int = WORKFLOW_TEMPLATE_CACHE_SIZE) -> None:
+        self.max_entries = max(0, max_entries)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetching: set = set()
+        # background loads, held here so the loop does not drop them mid-flight
+        self._tasks: set = set()
+
+    def hashes(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def __contains__(self, workflow_hash: str) -> bool:
+        with self._lock:
+            return workflow_hash in self._entries
+
+    def put(self, workflow_hash: str, workflow: Dict[str, Any]) -> None:
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[workflow_hash] = {"workflow": workflow, "compiled": OrderedDict()}
+            self._entries.move_to_end(workflow_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def compiled(self, workflow_hash: str, tokens: Iterable[str]) -> Optional[WorkflowTemplate]:
+        key = tuple(sorted({token for token in tokens if token}))
+        with self._lock:
+            entry = self._entries.get(workflow_hash)
+            if entry is None:
+                return None
+            self._entries.move_to_end(workflow_hash)
+            compiled = entry["compiled"]
+            template = compiled.get(key)
+            if template is not None:
+                compiled.move_to_end(key)
+                return template
+        template = WorkflowTemplate(entry["workflow"], key)
+        with self._lock:
+            compiled[key] = template
+            while len(compiled) > self._MAX_COMPILED_PER_WORKFLOW:
+                compiled.popitem(last=False)
+        return template
+
+    async def fetch(self, workflow_id: Any, workflow_hash: str) -> bool:
+        """Load a template from the backend. Returns True once ``workflow_hash`` is cached."""
         try:
-            # Upload to ComfyUI on this self-hosted node.
-            comfyui_name = upload_to_comfyui(tmp_path, endpoint)
+            data = await _backend_post("/api/worker/workflow-template", {"workflow_id": workflow_id}, idempotent=True)
+        except _HTTP_ERRORS as exc:
+            print(f"[worker] Workflow template {workflow_id} unavailable: {exc}")
+            return False
+        template = data.get("data") or {}
+        fetched_hash = template.get("workflow_hash")
+        workflow = template.get("workflow")
+        if not fetched_hash or not isinstance(workflow, dict) or not workflow:
+            return False
+        # Cached under whatever the backend serves now; an edited workflow simply misses
+        self.put(fetched_hash, workflow)
+        return fetched_hash == workflow_hash
+
+    def fetch_in_background(self, workflow_id: Any, workflow_hash: str) -> None:
+        with self._lock:
+            if workflow_hash in self._fetching or not self.max_entries:
+                return
+            self._fetching.add(workflow_hash)
 
-            placeholder_map[placeholder] = comfyui_name
+        async def run() -> None:
+            try:
+                await self.fetch(workflow_id, workflow_hash)
+            finally:
+                with self._lock:
+                    self._fetching.discard(workflow_hash)
 
-            # Cache for future use
-            if cache_key:
-                _asset_cache[cache_key] = comfyui_name
-        finally:
-            _safe_unlink(tmp_path)
+        task = asyncio.get_running_loop().create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
-    return placeholder_map
 
+_workflow_templates = _WorkflowTemplateCache()
 
-def prepare_workflow(input_payload: Dict[str, Any], input_reference: Optional[str], placeholder_map: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
-    workflow = input_payload.get("workflow") or input_payload.get("comfyui_workflow")
-    if not workflow:
-        raise ValueError("Missing ComfyUI workflow in input_payload.")
 
-    # Apply placeholder_map replacements (from asset pipeline)
-    if placeholder_map:
-        serialized = json.dumps(workflow)
-        for placeholder, filename in placeholder_map.items():
-            serialized = serialized.replace(placeholder, filename)
-        workflow = json.loads(serialized)
+async def _load_workflow_template(input_payload: Dict[str, Any], workflow_id: Any) -> bool:
+    """Make sure the template a hash-rendered job needs is cached before ``prepare_workflow``.
+
+    A cache miss with the full graph present uses the graph now and loads the
+    template in the background; a hash-only payload waits for the load.
+    Returns False when a hash-only payload's template could not be loaded,
+    e.g. because the workflow was edited and the backend now serves another hash.
+    """
+    workflow_hash = input_payload.get("workflow_hash")
+    if not workflow_hash or input_payload.get("workflow_values") is None or workflow_id is None:
+        return True
+    if workflow_hash in _workflow_templates:
+        return True
+    if input_payload.get("workflow") or input_payload.get("comfyui_workflow"):
+        _workflow_templates.fetch_in_background(workflow_id, workflow_hash)
+        return True
+    return await _workflow_templates.fetch(workflow_id, workflow_hash)
+
+
+def prepare_workflow(
+    input_payload: Dict[str, Any],
+    input_reference: Optional[str],
+    placeholder_map: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Build the prompt graph for a job.
+
+    Jobs carrying ``workflow_hash`` and ``workflow_values`` render from the
+    compiled template cache; the backend leaves ``workflow`` out entirely for
+    hashes this worker reported in its poll. ``_load_workflow_template`` fills
+    the cache first; a miss falls back to the full graph.
+    """
+    values: Dict[str, str] = {}
+    assignments: List[Tuple[WorkflowPath, Any]] = []
 
     if input_reference:
+        input_values, field_value = _input_reference_values(input_payload, input_reference)
         placeholder = input_payload.get("input_path_placeholder", "__INPUT_PATH__")
-        reference_prefix = input_payload.get("input_reference_prefix")
-        is_asset_reference = reference_prefix is None and not os.path.exists(input_reference)
-        serialized = json.dumps(workflow)
-        if placeholder in serialized:
-            if reference_prefix is not None:
-                if reference_prefix:
-                    serialized = serialized.replace(
-                        f"{reference_prefix}{placeholder}",
-                        f"{reference_prefix}{input_reference}",
-                    )
-                    serialized = serialized.replace(
-                        placeholder, f"{reference_prefix}{input_reference}"
-                    )
-                else:
-                    serialized = serialized.replace(
-                        f"asset://{placeholder}", input_reference
-                    )
-                    serialized = serialized.replace(placeholder, input_reference)
-            elif is_asset_reference:
-                serialized = serialized.replace(
-                    f"asset://{placeholder}", f"asset://{input_reference}"
-                )
-                serialized = serialized.replace(placeholder, f"asset://{input_reference}")
-            else:
-                serialized = serialized.replace(placeholder, input_reference)
-            workflow = json.loads(serialized)
+        # Asset placeholders were historically substituted first and so take precedence
+        if not placeholder_map or placeholder not in placeholder_map:
+            values.update(input_values)
 
         input_node_id = input_payload.get("input_node_id")
         input_field = input_payload.get("input_field")
         if input_node_id is not None and input_field:
-            value = input_reference
-            if reference_prefix and not str(value).startswith(reference_prefix):
-                value = f"{reference_prefix}{value}"
-            elif is_asset_reference and not str(value).startswith("asset://"):
-                value = f"asset://{value}"
-            workflow[str(input_node_id)]["inputs"][input_field] = value
+            assignments.append(((str(input_node_id), "inputs", input_field), field_value))
+
+    if placeholder_map:
+        values.update({placeholder: str(filename) for placeholder, filename in placeholder_map.items()})
 
-    return workflow
+    workflow = input_payload.get("workflow") or input_payload.get("comfyui_workflow")
+    workflow_hash = input_payload.get("workflow_hash")
+    workflow_values = input_payload.get("workflow_values")
+    if workflow_hash and workflow_values is not None:
+        # text values were baked into "workflow" by the backend; the raw template still needs them
+        template_values = {
+            str(placeholder): str(value)
+            for placeholder, value in (workflow_values.items() if isinstance(workflow_values, dict) else ())
+        }
+        template_values.update(values)
+        template = _workflow_templates.compiled(workflow_hash, template_values)
+        if template is not None:
+            return template.render(template_values, assignments)
+
+    if not workflow:
+        raise ValueError("Missing ComfyUI workflow in input_payload.")
+
+    return WorkflowTemplate(workflow, values).render(values, assignments)
 
 
 _INPUT_TOKEN_KEYS = {
@@ -479,12 +2039,43 @@ _TEXT_PATTERNS = {
     "credits": re.compile(r"credits?\D+([0-9]+(?:\.[0-9]+)?)", re.IGNORECASE),
     "cost_usd_reported": re.compile(r"(?:cost|price)\D+\$?\s*([0-9]+(?:\.[0-9]+)?)", re.IGNORECASE),
 }
+# Words one of which must appear for the pattern to match; checked before searching
+_TEXT_PATTERN_KEYWORDS = {
+    "input_tokens": ("token",),
+    "output_tokens": ("token",),
+    "total_tokens": ("token",),
+    "credits": ("credit",),
+    "cost_usd_reported": ("cost", "price"),
+}
+
 
+_PROVIDER_KEYS = {"provider", "vendor", "service"}
+_TEXT_SKIP_KEYS = {"filename", "subfolder", "type"}
+_TEXT_MAX_CHUNKS = 25
+_NUMBER_SLOTS = ("input_tokens", "output_tokens", "total_tokens", "credits", "cost_usd_reported")
 
+
+@functools.lru_cache(maxsize=4096)
 def _normalize_key(value: str) -> str:
     return re.sub(r"[^a-z0-9]+", "_", value.strip().lower()).strip("_")
 
 
+# normalized key -> (slot, is_number); the key sets are disjoint
+_USAGE_KEY_SLOTS: Dict[str, Tuple[str, bool]] = {
+    _normalize_key(key): (slot, is_number)
+    for slot, keys, is_number in (
+        ("input_tokens", _INPUT_TOKEN_KEYS, True),
+        ("output_tokens", _OUTPUT_TOKEN_KEYS, True),
+        ("total_tokens", _TOTAL_TOKEN_KEYS, True),
+        ("credits", _CREDIT_KEYS, True),
+        ("cost_usd_reported", _COST_USD_KEYS, True),
+        ("model", _MODEL_KEYS, False),
+        ("provider", _PROVIDER_KEYS, False),
+    )
+    for key in keys
+}
+
+
 def _to_float(value: Any) -> Optional[float]:
     if value is None or isinstance(value, bool):
         return None
@@ -540,95 +2131,83 @@ def _sanitize_json(value: Any, depth: int = 0) -> Any:
     return text[:200] + ("...(truncated)" if len(text) > 200 else "")
 
 
-def _iter_nested_dicts(payload: Any, depth: int = 0):
-    if depth > 5:
-        return
-    if isinstance(payload, dict):
-        yield payload
-        for nested in payload.values():
-            yield from _iter_nested_dicts(nested, depth + 1)
-    elif isinstance(payload, list):
-        for nested in payload[:30]:
-            yield from _iter_nested_dicts(nested, depth + 1)
-
-
-def _lookup_number(payload: Any, keys: set[str]) -> Optional[float]:
-    normalized_keys = {_normalize_key(key) for key in keys}
-    for dictionary in _iter_nested_dicts(payload):
-        for key, value in dictionary.items():
-            if _normalize_key(str(key)) not in normalized_keys:
-                continue
-            number = _to_float(value)
-            if number is not None:
-                return number
-    return None
-
+class _UsageScan:
+    """Single pre-order walk of a node payload that fills every usage slot.
 
-def _lookup_string(payload: Any, keys: set[str]) -> Optional[str]:
-    normalized_keys = {_normalize_key(key) for key in keys}
-    for dictionary in _iter_nested_dicts(payload):
-        for key, value in dictionary.items():
-            if _normalize_key(str(key)) not in normalized_keys:
-                continue
-            if value is None:
-                continue
-            text = str(value).strip()
-            if not text:
-                continue
-            if len(text) > 255:
-                text = text[:255] + "...(truncated)"
-            return text
-    return None
+    Dicts are visited depth-first (at most 5 levels, 30 list items) and each
+    slot keeps the first usable value, so a slot holds what a lookup for that
+    metric alone would find. The walk also notes the first nested dict with a
+    usage-looking key and gathers the strings under ``text_root`` (at most 25,
+    4 levels deep, skipping file references) for the free-text fallback.
+    """
 
+    __slots__ = ("values", "hint", "chunks", "_root", "_text_root")
 
-def _dict_has_usage_hint(payload: Dict[str, Any]) -> bool:
-    return any(_normalize_key(str(key)) in _USAGE_HINT_KEYS for key in payload.keys())
+    def __init__(self, payload: Any, text_root: Any = None) -> None:
+        self.values: Dict[str, Any] = {}
+        self.hint: Optional[Dict[str, Any]] = None
+        self.chunks: List[str] = []
+        self._root = payload
+        self._text_root = text_root
+        self._visit(payload, 0, None)
 
+    def _visit(self, value: Any, depth: int, text_depth: Optional[int]) -> None:
+        if value is self._text_root:
+            text_depth = 0
+        elif text_depth is not None and (text_depth > 4 or len(self.chunks) >= _TEXT_MAX_CHUNKS):
+            text_depth = None
 
-def _extract_usage_payload(node_output: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    for key in _USAGE_CONTAINER_KEYS:
-        value = node_output.get(key)
+        if isinstance(value, str):
+            if text_depth is not None:
+                text = value.strip()
+                if text:
+                    self.chunks.append(text[:400])
+            return
+        if depth > 5:
+            return
+
+        child_text_depth = text_depth + 1 if text_depth is not None else None
         if isinstance(value, dict):
-            return value
-    for dictionary in _iter_nested_dicts(node_output):
-        if dictionary is node_output:
-            continue
-        if _dict_has_usage_hint(dictionary):
-            return dictionary
-    return None
-
-
-def _collect_text(payload: Any, acc: List[str], depth: int = 0) -> None:
-    if depth > 4 or len(acc) >= 25:
-        return
-    if isinstance(payload, str):
-        text = payload.strip()
-        if text:
-            acc.append(text[:400])
-        return
-    if isinstance(payload, dict):
-        for key, value in payload.items():
-            normalized = _normalize_key(str(key))
-            if normalized in {"filename", "subfolder", "type"}:
-                continue
-            _collect_text(value, acc, depth + 1)
-            if len(acc) >= 25:
-                return
-    elif isinstance(payload, list):
-        for value in payload[:25]:
-            _collect_text(value, acc, depth + 1)
-            if len(acc) >= 25:
-                return
+            normalized_keys = [_normalize_key(str(key)) for key in value]
+            values = self.values
+            for normalized, nested in zip(normalized_keys, value.values()):
+                slot = _USAGE_KEY_SLOTS.get(normalized)
+                if slot is None or slot[0] in values:
+                    continue
+                name, is_number = slot
+                parsed = _to_float(nested) if is_number else _usage_text(nested)
+                if parsed is not None:
+                    values[name] = parsed
+            if self.hint is None and value is not self._root and any(key in _USAGE_HINT_KEYS for key in normalized_keys):
+                self.hint = value
+            for normalized, nested in zip(normalized_keys, value.values()):
+                skip_text = child_text_depth is None or normalized in _TEXT_SKIP_KEYS
+                self._visit(nested, depth + 1, None if skip_text else child_text_depth)
+        elif isinstance(value, list):
+            for index, nested in enumerate(value[:30]):
+                self._visit(nested, depth + 1, child_text_depth if index < _TEXT_MAX_CHUNKS else None)
+
+
+def _usage_text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    if len(text) > 255:
+        text = text[:255] + "...(truncated)"
+    return text
 
 
-def _extract_metrics_from_text(payload: Any) -> Dict[str, Optional[float]]:
-    chunks: List[str] = []
-    _collect_text(payload, chunks)
+def _metrics_from_text(chunks: List[str]) -> Dict[str, Optional[float]]:
     if not chunks:
         return {}
     text = "\n".join(chunks)[:4000]
+    lowered = text.lower()
     metrics: Dict[str, Optional[float]] = {}
     for metric, pattern in _TEXT_PATTERNS.items():
+        if not any(keyword in lowered for keyword in _TEXT_PATTERN_KEYWORDS[metric]):
+            continue
         match = pattern.search(text)
         if not match:
             continue
@@ -636,9 +2215,8 @@ def _extract_metrics_from_text(payload: Any) -> Dict[str, Optional[float]]:
     return metrics
 
 
-def _detect_provider(node_class_type: str, node_inputs: Dict[str, Any]) -> str:
+def _detect_provider(node_class_type: str, provider_hint: Optional[str]) -> str:
     haystack_parts: List[str] = [node_class_type]
-    provider_hint = _lookup_string(node_inputs, {"provider", "vendor", "service"})
     if provider_hint:
         haystack_parts.append(provider_hint)
     haystack = " ".join(haystack_parts).lower()
@@ -679,50 +2257,43 @@ def extract_partner_usage_events(
                 if title:
                     node_display_name = str(title)
 
-        usage_payload = _extract_usage_payload(node_output)
         ui_payload = node_output.get("ui") if isinstance(node_output.get("ui"), (dict, list)) else None
+        node_scan = _UsageScan(node_output, text_root=ui_payload if ui_payload is not None else node_output)
 
-        input_tokens = _lookup_number(usage_payload, _INPUT_TOKEN_KEYS) if usage_payload else None
-        output_tokens = _lookup_number(usage_payload, _OUTPUT_TOKEN_KEYS) if usage_payload else None
-        total_tokens = _lookup_number(usage_payload, _TOTAL_TOKEN_KEYS) if usage_payload else None
-        credits = _lookup_number(usage_payload, _CREDIT_KEYS) if usage_payload else None
-        cost_usd = _lookup_number(usage_payload, _COST_USD_KEYS) if usage_payload else None
-
-        if input_tokens is None:
-            input_tokens = _lookup_number(node_output, _INPUT_TOKEN_KEYS)
-        if output_tokens is None:
-            output_tokens = _lookup_number(node_output, _OUTPUT_TOKEN_KEYS)
-        if total_tokens is None:
-            total_tokens = _lookup_number(node_output, _TOTAL_TOKEN_KEYS)
-        if credits is None:
-            credits = _lookup_number(node_output, _CREDIT_KEYS)
-        if cost_usd is None:
-            cost_usd = _lookup_number(node_output, _COST_USD_KEYS)
-
-        text_metrics = _extract_metrics_from_text(ui_payload if ui_payload is not None else node_output)
-        if input_tokens is None:
-            input_tokens = text_metrics.get("input_tokens")
-        if output_tokens is None:
-            output_tokens = text_metrics.get("output_tokens")
-        if total_tokens is None:
-            total_tokens = text_metrics.get("total_tokens")
-        if credits is None:
-            credits = text_metrics.get("credits")
-        if cost_usd is None:
-            cost_usd = text_metrics.get("cost_usd_reported")
-
-        input_tokens_int = _to_int(input_tokens)
-        output_tokens_int = _to_int(output_tokens)
-        total_tokens_int = _to_int(total_tokens)
+        usage_payload = node_scan.hint
+        for key in _USAGE_CONTAINER_KEYS:
+            value = node_output.get(key)
+            if isinstance(value, dict):
+                usage_payload = value
+                break
+        usage_values = _UsageScan(usage_payload).values if usage_payload else {}
+
+        metrics: Dict[str, Optional[float]] = {}
+        for slot in _NUMBER_SLOTS:
+            value = usage_values.get(slot)
+            metrics[slot] = value if value is not None else node_scan.values.get(slot)
+        if any(value is None for value in metrics.values()):
+            text_metrics = _metrics_from_text(node_scan.chunks)
+            for slot, value in metrics.items():
+                if value is None:
+                    metrics[slot] = text_metrics.get(slot)
+
+        input_tokens_int = _to_int(metrics["input_tokens"])
+        output_tokens_int = _to_int(metrics["output_tokens"])
+        total_tokens_int = _to_int(metrics["total_tokens"])
         if total_tokens_int is None and input_tokens_int is not None and output_tokens_int is not None:
             total_tokens_int = input_tokens_int + output_tokens_int
 
-        credits_float = _to_float(credits)
-        cost_usd_float = _to_float(cost_usd)
-        model = _lookup_string(workflow_inputs, _MODEL_KEYS)
-        if model is None and usage_payload is not None:
-            model = _lookup_string(usage_payload, _MODEL_KEYS)
-        provider = _detect_provider(node_class_type, workflow_inputs if isinstance(workflow_inputs, dict) else {})
+        credits_float = _to_float(metrics["credits"])
+        cost_usd_float = _to_float(metrics["cost_usd_reported"])
+        inputs_values = _UsageScan(workflow_inputs).values
+        model = inputs_values.get("model")
+        if model is None:
+            model = usage_values.get("model")
+        provider = _detect_provider(
+            node_class_type,
+            inputs_values.get("provider") if isinstance(workflow_inputs, dict) else None,
+        )
 
         if (
             input_tokens_int is None
@@ -754,41 +2325,615 @@ def extract_partner_usage_events(
     return events
 
 
-def run_comfyui(
+_WS_RECONNECT_DELAY_SECONDS = 30
+_WS_SAFETY_CHECK_SECONDS = 30
+# Ping period on the event stream; a pong missing for half of it, or no frame
+# at all for three periods, drops the connection so a hung socket is noticed.
+_WS_HEARTBEAT_SECONDS = 15.0
+
+# ComfyUI message types that end a prompt's execution. Success is signalled by
+# ``executing`` with ``node: null``, which ComfyUI sends after writing history.
+_COMFYUI_TERMINAL_EVENTS = ("execution_error", "execution_interrupted")
+
+# History polling backoff when the event stream is unavailable
+_HISTORY_POLL_MIN_SECONDS = 0.25
+_HISTORY_POLL_MAX_SECONDS = 2.0
+
+
+class _ComfyUIEventStream:
+    """Shared ComfyUI ``/ws?clientId=...`` subscription that routes events by prompt_id.
+
+    ComfyUI keeps one socket per client id, so every job on this worker shares
+    a single connection, opened on the ComfyUI pool's session. Terminal events
+    are buffered briefly so a prompt that finishes before its waiter registers
+    is not missed.
+    """
+
+    def __init__(self, base_url: str, client_id: str) -> None:
+        self.base_url = base_url
+        self.client_id = client_id
+        self.queue_remaining: Optional[int] = None
+        self.loop = asyncio.get_running_loop()
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._connecting: Optional[asyncio.Task] = None
+        self._terminal: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._retry_after = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None
+
+    async def ensure_connected(self, timeout: float = 5.0) -> bool:
+        if self.connected:
+            return True
+        if time.monotonic() < self._retry_after:
+            return False
+        # Concurrent callers share one attempt; a caller cancelled meanwhile leaves it running for the rest.
+        if self._connecting is None:
+            self._connecting = asyncio.create_task(self._connect(timeout))
+            self._connecting.add_done_callback(self._connect_done)
+        return await asyncio.shield(self._connecting)
+
+    def _connect_done(self, task: asyncio.Task) -> None:
+        if self._connecting is task:
+            self._connecting = None
+
+    async def wait_for(self, prompt_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait for the prompt's terminal event; None on timeout.
+
+        Raises ConnectionError when the stream drops so callers can fall back.
+        """
+        prompt_id = str(prompt_id)
+        event = self._terminal.pop(prompt_id, None)
+        if event is not None:
+            return event
+        if not self.connected:
+            raise ConnectionError("ComfyUI event stream disconnected.")
+        waiter = self.loop.create_future()
+        self._waiters[prompt_id] = waiter
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if self._waiters.get(prompt_id) is waiter:
+                del self._waiters[prompt_id]
+
+    async def close(self) -> None:
+        ws, self._ws = self._ws, None
+        for task in (self._connecting, self._reader):
+            if task is not None:
+                task.cancel()
+        self._fail_waiters()
+        if ws is not None:
+            await ws.close()
+
+    async def _connect(self, timeout: float) -> bool:
+        url = f"{self.base_url.rstrip('/')}/ws?{urlencode({'clientId': self.client_id})}"
+        try:
+            ws = await asyncio.wait_for(
+                _comfyui_http.session.ws_connect(
+                    url,
+                    heartbeat=_WS_HEARTBEAT_SECONDS,
+                    timeout=aiohttp.ClientWSTimeout(ws_receive=3 * _WS_HEARTBEAT_SECONDS, ws_close=timeout),
+                ),
+                timeout,
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as exc:
+            self._retry_after = time.monotonic() + _WS_RECONNECT_DELAY_SECONDS
+            print(f"[worker] ComfyUI event stream unavailable, polling instead: {exc!r}")
+            return False
+        self._ws = ws
+        self._reader = asyncio.create_task(self._read_loop(ws))
+        return True
+
+    async def _read_loop(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        try:
+            while True:
+                message = await ws.receive()
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    self._dispatch(message.data)
+                elif message.type in (
+                    aiohttp.WSMsgType.CLOSE,
+                    aiohttp.WSMsgType.CLOSING,
+                    aiohttp.WSMsgType.CLOSED,
+                    aiohttp.WSMsgType.ERROR,
+                ):
+                    break
+                # Binary frames are preview images; they are not needed here.
+        except asyncio.TimeoutError:
+            pass  # no frame, not even a pong, for the receive timeout
+        finally:
+            if self._ws is ws:
+                self._ws = None
+                self._fail_waiters()
+            await ws.close()
+
+    def _fail_waiters(self) -> None:
+        waiters, self._waiters = self._waiters, {}
+        for waiter in waiters.values():
+            if not waiter.done():
+                waiter.set_exception(ConnectionError("ComfyUI event stream disconnected."))
+
+    def _dispatch(self, raw: str) -> None:
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+        event_type = message.get("type")
+        data = message.get("data") if isinstance(message.get("data"), dict) else {}
+        if event_type == "status":
+            exec_info = (data.get("status") or {}).get("exec_info") or {}
+            if isinstance(exec_info.get("queue_remaining"), int):
+                self.queue_remaining = exec_info["queue_remaining"]
+                _metric_comfyui_queue.set(self.queue_remaining, instance=self.base_url)
+            return
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+        terminal = event_type in _COMFYUI_TERMINAL_EVENTS or (
+            event_type == "executing" and data.get("node") is None
+        )
+        if not terminal:
+            return
+        waiter = self._waiters.pop(str(prompt_id), None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(message)
+            return
+        self._terminal[str(prompt_id)] = message
+        while len(self._terminal) > 256:
+            self._terminal.popitem(last=False)
+
+
+_event_streams: Dict[str, _ComfyUIEventStream] = {}
+
+
+async def _comfyui_event_stream(endpoint: str) -> Optional[_ComfyUIEventStream]:
+    """Return a connected event stream for ``endpoint``, or None to poll instead."""
+    if not COMFYUI_WS_ENABLED:
+        return None
+    stream = _event_streams.get(endpoint)
+    if stream is None or stream.client_id != WORKER_ID or stream.loop is not asyncio.get_running_loop():
+        if stream is not None and stream.loop is asyncio.get_running_loop():
+            await stream.close()
+        stream = _ComfyUIEventStream(endpoint, WORKER_ID)
+        _event_streams[endpoint] = stream
+    return stream if await stream.ensure_connected() else None
+
+
+async def _close_event_streams() -> None:
+    streams = [stream for stream in _event_streams.values() if stream.loop is asyncio.get_running_loop()]
+    _event_streams.clear()
+    for stream in streams:
+        await stream.close()
+
+
+async def _fetch_history_record(prompt_id: str, endpoint: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    async with _comfyui_http.get(f"{endpoint or COMFYUI_BASE_URL}/history/{prompt_id}", timeout=15) as resp:
+        resp.raise_for_status()
+        history = await resp.json()
+    return history.get(prompt_id) or history.get(str(prompt_id))
+
+
+def _history_outputs(record: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Return the record's outputs once available; raise if ComfyUI reported an error."""
+    if not record:
+        return None
+    status = record.get("status", {})
+    if status.get("status_str") == "error":
+        raise RuntimeError(status.get("message", "ComfyUI error."))
+    return record.get("outputs") or None
+
+
+async def _wait_for_prompt_events(
+    stream: _ComfyUIEventStream,
+    prompt_id: str,
+    start: float,
+    state: Optional["JobState"],
+    endpoint: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """Wait on the event stream and fetch history once at the end.
+
+    Returns the history record, or None when the caller should fall back to polling.
+    """
+    last_check = time.time()
+    while True:
+        if time.time() - start > COMFYUI_JOB_TIMEOUT_SECONDS:
+            raise TimeoutError("ComfyUI job timed out.")
+        _check_cancelled(state)
+        try:
+            event = await stream.wait_for(prompt_id, 1.0)
+        except ConnectionError:
+            return None
+        if event is None:
+            # Safety net for events lost across a reconnect.
+            if time.time() - last_check >= _WS_SAFETY_CHECK_SECONDS:
+                last_check = time.time()
+                record = await _fetch_history_record(prompt_id, endpoint)
+                if _history_outputs(record):
+                    return record
+            continue
+        return await _record_after_event(prompt_id, event, endpoint)
+
+
+async def _record_after_event(
+    prompt_id: str, event: Dict[str, Any], endpoint: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """Fetch history once a terminal event arrived; None when it has no outputs yet."""
+    record = await _fetch_history_record(prompt_id, endpoint)
+    if _history_outputs(record):
+        return record
+    if event.get("type") in ("execution_error", "execution_interrupted"):
+        data = event.get("data") or {}
+        raise RuntimeError(data.get("exception_message") or "ComfyUI execution failed.")
+    return None
+
+
+async def run_comfyui(
     workflow: Dict[str, Any],
     output_node_id: Optional[str],
-    extra_data: Optional[Dict[str, Any]] = None
+    extra_data: Optional[Dict[str, Any]] = None,
+    state: Optional["JobState"] = None,
 ) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
     prompt_payload: Dict[str, Any] = {"prompt": workflow, "client_id": WORKER_ID}
     if extra_data:
         prompt_payload["extra_data"] = extra_data
+    timings = state.timings if state is not None else None
+    endpoint = _job_endpoint(state)
 
-    resp = requests.post(f"{COMFYUI_BASE_URL}/prompt", json=prompt_payload, timeout=30)
-    resp.raise_for_status()
-    prompt_id = resp.json().get("prompt_id")
-    if not prompt_id:
-        raise RuntimeError("ComfyUI did not return prompt_id.")
+    # Subscribe before queueing so no execution event can be missed.
+    stream = await _comfyui_event_stream(endpoint)
+
+    with _timed(timings, "comfyui_submit"):
+        prompt_id = await _submit_prompt(prompt_payload, endpoint)
+    if state is not None:
+        state.prompt_id = prompt_id
 
     start = time.time()
+    submitted = time.monotonic()
+    try:
+        record = await _wait_for_prompt(stream, prompt_id, start, state, endpoint)
+    except BaseException:
+        if timings is not None:
+            timings.record("comfyui_execution", submitted, time.monotonic())
+        raise
+    if timings is not None:
+        _record_comfyui_phases(timings, record, submitted, start, time.monotonic())
+    return prompt_id, record.get("outputs", {}), record
+
+
+async def _submit_prompt(prompt_payload: Dict[str, Any], endpoint: Optional[str] = None) -> str:
+    async with _comfyui_http.post(f"{endpoint or COMFYUI_BASE_URL}/prompt", json=prompt_payload) as resp:
+        resp.raise_for_status()
+        prompt_id = (await resp.json()).get("prompt_id")
+    if not prompt_id:
+        raise RuntimeError("ComfyUI did not return prompt_id.")
+    return str(prompt_id)
+
+
+async def _wait_for_prompt(
+    stream: Optional[_ComfyUIEventStream],
+    prompt_id: str,
+    start: float,
+    state: Optional["JobState"],
+    endpoint: Optional[str] = None,
+) -> Dict[str, Any]:
+    if stream is not None:
+        record = await _wait_for_prompt_events(stream, prompt_id, start, state, endpoint)
+        if record is not None:
+            return record
+
+    delay = _HISTORY_POLL_MIN_SECONDS
     while True:
-        if time.time() - start > 3600:
+        if time.time() - start > COMFYUI_JOB_TIMEOUT_SECONDS:
             raise TimeoutError("ComfyUI job timed out.")
+        _check_cancelled(state)
+
+        record = await _fetch_history_record(prompt_id, endpoint)
+        if _history_outputs(record):
+            return record
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 1.5, _HISTORY_POLL_MAX_SECONDS)
+
+
+# History status messages that close a prompt's execution
+_COMFYUI_EXECUTION_END_MESSAGES = ("execution_success", "execution_error", "execution_interrupted")
+
 
-        history_resp = requests.get(f"{COMFYUI_BASE_URL}/history/{prompt_id}", timeout=15)
-        history_resp.raise_for_status()
-        history = history_resp.json()
-        record = history.get(prompt_id) or history.get(str(prompt_id))
+def _record_comfyui_phases(
+    timings: "JobTimings",
+    record: Dict[str, Any],
+    submitted: float,
+    submitted_wall: float,
+    finished: float,
+) -> None:
+    """Split the wait for a prompt into queue wait, execution and result fetch.
+
+    ComfyUI stamps ``execution_start`` and ``execution_success`` into the
+    history record's status messages with its wall clock in ms; it runs on
+    this node, so the stamps are mapped onto the monotonic clock through the
+    submit time. Without the stamps the whole wait counts as execution.
+    """
+    stamps: Dict[str, float] = {}
+    messages = (record.get("status") or {}).get("messages") or []
+    for message in messages:
+        if isinstance(message, (list, tuple)) and len(message) == 2 and isinstance(message[1], dict):
+            timestamp = _to_float(message[1].get("timestamp"))
+            if timestamp is not None:
+                stamps.setdefault(str(message[0]), timestamp / 1000)
+
+    started_wall = stamps.get("execution_start")
+    if started_wall is None:
+        timings.record("comfyui_execution", submitted, finished)
+        return
 
-        if record:
-            status = record.get("status", {})
-            if status.get("status_str") == "error":
-                raise RuntimeError(status.get("message", "ComfyUI error."))
+    def to_monotonic(wall: float, floor: float) -> float:
+        return min(finished, max(floor, submitted + wall - submitted_wall))
+
+    started = to_monotonic(started_wall, submitted)
+    ended_wall = next((stamps[name] for name in _COMFYUI_EXECUTION_END_MESSAGES if name in stamps), None)
+    ended = to_monotonic(ended_wall, started) if ended_wall is not None else finished
+    timings.record("comfyui_queue_wait", submitted, started)
+    timings.record("comfyui_execution", started, ended)
+    timings.record("comfyui_result_fetch", ended, finished)
+
+
+async def cancel_comfyui_prompt(prompt_id: str, endpoint: Optional[str] = None) -> None:
+    """Stop a prompt on local ComfyUI: interrupt it if running, else drop it from the queue."""
+    endpoint = endpoint or COMFYUI_BASE_URL
+    try:
+        async with _comfyui_http.get(f"{endpoint}/queue", timeout=10) as queue_resp:
+            queue_resp.raise_for_status()
+            queue_state = await queue_resp.json()
+        running = {
+            str(item[1])
+            for item in queue_state.get("queue_running", [])
+            if isinstance(item, list) and len(item) > 1
+        }
+        if str(prompt_id) in running:
+            request = _comfyui_http.post(
+                f"{endpoint}/interrupt", json={"prompt_id": prompt_id}, timeout=10
+            )
+        else:
+            request = _comfyui_http.post(
+                f"{endpoint}/queue", json={"delete": [prompt_id]}, timeout=10
+            )
+        async with request as resp:
+            resp.raise_for_status()
+    except Exception as exc:
+        print(f"[worker] Failed to cancel ComfyUI prompt {prompt_id}: {exc}")
+
+
+class ComfyUIAdmission:
+    """How much new work local ComfyUI can start promptly, checked before each poll.
+
+    Prompts in ComfyUI's queue that no active job owns (cancelled or orphaned
+    renders, or work queued by something else) hold the GPU ahead of any job
+    leased now, so each one counts against the load reported to the backend.
+    Prompts this worker queued that stay ownerless across two checks are its
+    own orphans and are removed. While ComfyUI is unreachable or free VRAM is
+    below ``min_free_vram_mb`` the worker does not poll at all.
+
+    ``endpoint`` defaults to COMFYUI_BASE_URL; ComfyUIPool keeps one per instance.
+    """
 
-            outputs = record.get("outputs", {})
-            if outputs:
-                return str(prompt_id), outputs, record
+    def __init__(
+        self,
+        enabled: bool = ADMISSION_CONTROL_ENABLED,
+        min_free_vram_mb: int = ADMISSION_MIN_FREE_VRAM_MB,
+        endpoint: Optional[str] = None,
+    ) -> None:
+        self.enabled = enabled
+        self.min_free_vram_mb = max(0, min_free_vram_mb)
+        self.endpoint = endpoint
+        self.hold_reason = ""
+        self._orphan_candidates: set = set()
+
+    async def slots(
+        self, current_load: int, capacity: int, own_prompt_ids: Iterable[Optional[str]]
+    ) -> Tuple[int, int]:
+        """Return (load to report, jobs to lease now); nothing is leased while holding off."""
+        foreign, hold = await self.check(own_prompt_ids)
+        load = min(capacity, current_load + foreign)
+        if not hold and foreign and load >= capacity:
+            hold = self._hold("comfyui_busy", f"{foreign} queued prompt(s) without a job")
+        elif not hold:
+            self._release()
+        return load, 0 if hold else capacity - load
+
+    async def check(self, own_prompt_ids: Iterable[Optional[str]]) -> Tuple[int, str]:
+        """Return (slots held by foreign prompts, reason to hold off leasing or "")."""
+        if not self.enabled:
+            return 0, ""
+        own = {str(prompt_id) for prompt_id in own_prompt_ids if prompt_id}
+        endpoint = self.endpoint or COMFYUI_BASE_URL
+        try:
+            async with _comfyui_http.get(f"{endpoint}/queue", timeout=5) as resp:
+                resp.raise_for_status()
+                queue_state = await resp.json()
+            free_vram = await self._free_vram(endpoint)
+        except Exception as exc:
+            return 0, self._hold("comfyui_unreachable", exc)
+
+        queued = [
+            item for key in ("queue_running", "queue_pending")
+            for item in queue_state.get(key) or []
+            if isinstance(item, list) and len(item) > 1
+        ]
+        _metric_comfyui_queue.set(len(queued), instance=endpoint)
+        foreign = [item for item in queued if str(item[1]) not in own]
+        # a job learns its prompt id only when /prompt returns; first sightings of ours don't count yet
+        unconfirmed = await self._reap_orphans(foreign)
+        foreign = [item for item in foreign if str(item[1]) not in unconfirmed]
+
+        if free_vram is not None and free_vram < self.min_free_vram_mb * 1024 * 1024:
+            return len(foreign), self._hold("low_vram", f"{free_vram // (1024 * 1024)} MiB free")
+        return len(foreign), ""
+
+    async def _free_vram(self, endpoint: str) -> Optional[int]:
+        async with _comfyui_http.get(f"{endpoint}/system_stats", timeout=5) as resp:
+            resp.raise_for_status()
+            stats = await resp.json()
+        devices = [d for d in stats.get("devices") or [] if isinstance(d, dict)]
+        free = [int(d["vram_free"]) for d in devices if isinstance(d.get("vram_free"), (int, float)) and d.get("vram_total")]
+        if not free:
+            return None
+        _metric_comfyui_vram_free.set(min(free), instance=endpoint)
+        return min(free)
+
+    async def _reap_orphans(self, foreign: List[List[Any]]) -> set:
+        """Cancel this worker's ownerless prompts seen twice; return the ones seen once."""
+        mine = set()
+        for item in foreign:
+            extra = item[3] if len(item) > 3 and isinstance(item[3], dict) else {}
+            if extra.get("client_id") == WORKER_ID:
+                mine.add(str(item[1]))
+        # a job may not have recorded a prompt it just queued; only act on a second sighting
+        for prompt_id in mine & self._orphan_candidates:
+            print(f"[worker] Removing orphaned ComfyUI prompt {prompt_id}.")
+            await cancel_comfyui_prompt(prompt_id, endpoint=self.endpoint)
+        self._orphan_candidates = mine - self._orphan_candidates
+        return self._orphan_candidates
+
+    def _release(self) -> None:
+        if self.hold_reason:
+            print(f"[worker] ComfyUI{self._label} can take work again ({self.hold_reason} cleared).")
+            self.hold_reason = ""
+
+    def _hold(self, reason: str, detail: Any) -> str:
+        _metric_admission_holds.inc(reason=reason)
+        if reason != self.hold_reason:
+            print(f"[worker] Holding off leasing{self._label}: {reason} ({detail}).")
+            self.hold_reason = reason
+        return reason
+
+    @property
+    def _label(self) -> str:
+        return f" on {self.endpoint}" if self.endpoint else ""
+
+
+def _workflow_key(job: Dict[str, Any]) -> Optional[str]:
+    """What identifies the models a job loads: its template hash, else its workflow id."""
+    payload = job.get("input_payload") or {}
+    key = payload.get("workflow_hash") or job.get("workflow_id")
+    return str(key) if key else None
+
+
+class ComfyUIInstance:
+    """One local ComfyUI endpoint: the jobs routed to it and what it has warm."""
+
+    WARM_WORKFLOWS = 8
+
+    def __init__(self, endpoint: str, admission: ComfyUIAdmission) -> None:
+        self.endpoint = endpoint
+        self.admission = admission
+        self.assigned = 0
+        self.routed = 0
+        # queued prompts no job owns, as of the last admission check
+        self.foreign = 0
+        self.workflows: "OrderedDict[str, None]" = OrderedDict()
+
+    @property
+    def load(self) -> int:
+        return self.assigned + self.foreign
+
+    @property
+    def held(self) -> bool:
+        return bool(self.admission.hold_reason)
+
+    def warmth(self, job: Dict[str, Any]) -> Tuple[int, int]:
+        """(ran the job's workflow recently, assets of the job it already holds)."""
+        key = _workflow_key(job)
+        assets = (job.get("input_payload") or {}).get("assets")
+        cached = sum(
+            1 for asset in (assets if isinstance(assets, list) else [])
+            if isinstance(asset, dict) and asset.get("content_hash") and not asset.get("is_primary_input", False)
+            and _asset_cache.has_upload(str(asset["content_hash"]), self.endpoint)
+        )
+        return (1 if key and key in self.workflows else 0), cached
+
+    def remember(self, job: Dict[str, Any]) -> None:
+        key = _workflow_key(job)
+        if key:
+            self.workflows[key] = None
+            self.workflows.move_to_end(key)
+            while len(self.workflows) > self.WARM_WORKFLOWS:
+                self.workflows.popitem(last=False)
+
+
+class ComfyUIPool:
+    """The node's local ComfyUI instances (one per GPU) behind one worker.
+
+    Each job goes to the instance with the fewest jobs and ownerless prompts.
+    Ties go to the one that recently ran the job's workflow (its models are
+    still loaded) and then to the one already holding more of its assets.
+    Instances admission control is holding off are skipped while another can
+    take the job. Before each poll every instance is checked on its own and
+    the backend is sent their combined load and free slots.
+    """
 
-        time.sleep(2)
+    def __init__(
+        self,
+        endpoints: Iterable[str],
+        admission_enabled: bool = ADMISSION_CONTROL_ENABLED,
+        min_free_vram_mb: int = ADMISSION_MIN_FREE_VRAM_MB,
+    ) -> None:
+        self.instances = [
+            ComfyUIInstance(endpoint, ComfyUIAdmission(admission_enabled, min_free_vram_mb, endpoint))
+            for endpoint in dict.fromkeys(endpoints)
+        ]
+        if not self.instances:
+            raise ValueError("ComfyUIPool needs at least one endpoint.")
+        self._by_endpoint = {instance.endpoint: instance for instance in self.instances}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.instances)
+
+    @property
+    def endpoints(self) -> List[str]:
+        return [instance.endpoint for instance in self.instances]
+
+    def assign(self, job: Dict[str, Any]) -> str:
+        """Route ``job`` to an instance and return its endpoint; pair with ``release``."""
+        with self._lock:
+            candidates = [instance for instance in self.instances if not instance.held] or self.instances
+            instance = min(
+                candidates,
+                key=lambda item: (item.load, tuple(-score for score in item.warmth(job)), item.routed),
+            )
+            instance.assigned += 1
+            instance.routed += 1
+            instance.remember(job)
+            return instance.endpoint
+
+    def release(self, endpoint: Optional[str]) -> None:
+        with self._lock:
+            instance = self._by_endpoint.get(endpoint or "")
+            if instance is not None:
+                instance.assigned = max(0, instance.assigned - 1)
+
+    async def slots(
+        self, current_load: int, capacity: int, own_prompt_ids: Iterable[Optional[str]]
+    ) -> Tuple[int, int]:
+        """ComfyUIAdmission.slots summed over the instances, each with its share of ``capacity``."""
+        own = list(own_prompt_ids)
+        share = max(1, capacity // len(self.instances))
+        load = free = 0
+        for instance in self.instances:
+            with self._lock:
+                assigned = instance.assigned
+            instance_load, instance_free = await instance.admission.slots(assigned, share, own)
+            instance.foreign = max(0, instance_load - assigned)
+            load += instance_load
+            free += instance_free
+        load = min(capacity, max(load, current_load))
+        return load, min(free, capacity - load)
 
 
 def extract_output_file(outputs: Dict[str, Any], output_node_id: Optional[str]) -> Dict[str, Any]:
@@ -806,7 +2951,7 @@ def extract_output_file(outputs: Dict[str, Any], output_node_id: Optional[str])
     raise RuntimeError("No output file found in ComfyUI history.")
 
 
-def download_comfyui_output(file_info: Dict[str, Any]) -> str:
+def _comfyui_view_url(file_info: Dict[str, Any], endpoint: Optional[str] = None) -> Tuple[str, str]:
     filename = file_info.get("filename")
     subfolder = file_info.get("subfolder", "")
     file_type = file_info.get("type", "output")
@@ -819,17 +2964,176 @@ def download_comfyui_output(file_info: Dict[str, Any]) -> str:
         "subfolder": subfolder,
         "type": file_type,
     })
-    url = f"{COMFYUI_BASE_URL}/view?{params}"
-    resp = requests.get(url, stream=True, timeout=60)
-    resp.raise_for_status()
+    return f"{endpoint or COMFYUI_BASE_URL}/view?{params}", filename
+
+
+async def _open_comfyui_output(
+    file_info: Dict[str, Any], endpoint: Optional[str] = None
+) -> Tuple[aiohttp.ClientResponse, str]:
+    """GET the output from ``/view``; the caller releases the response."""
+    url, filename = _comfyui_view_url(file_info, endpoint)
+    resp = await _comfyui_http.send("GET", url, timeout=60)
+    try:
+        resp.raise_for_status()
+    except aiohttp.ClientResponseError:
+        resp.release()
+        raise
+    return resp, filename
+
+
+def _view_range_reader(url: str) -> RangeReader:
+    async def read_range(start: int, length: int) -> bytes:
+        async with _comfyui_http.get(url, headers={"Range": f"bytes={start}-{start + length - 1}"}, timeout=60) as resp:
+            resp.raise_for_status()
+            if resp.status != 206:
+                raise RuntimeError(f"ComfyUI ignored range request (HTTP {resp.status}).")
+            return await resp.read()
+
+    return read_range
+
+
+async def _write_response_to_temp(resp: aiohttp.ClientResponse, filename: str) -> str:
     suffix = os.path.splitext(filename)[1] or ".bin"
     with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        for chunk in resp.iter_content(chunk_size=1024 * 1024):
-            if chunk:
+        try:
+            async for chunk in resp.content.iter_chunked(1024 * 1024):
                 tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            _safe_unlink(tmp.name)
+            raise
         return tmp.name
 
 
+async def download_comfyui_output(file_info: Dict[str, Any], endpoint: Optional[str] = None) -> str:
+    resp, filename = await _open_comfyui_output(file_info, endpoint)
+    try:
+        return await _write_response_to_temp(resp, filename)
+    finally:
+        resp.release()
+
+
+async def _counting_chunks(resp: aiohttp.ClientResponse, counter: List[int]) -> AsyncIterator[bytes]:
+    async for chunk in resp.content.iter_chunked(1024 * 1024):
+        counter[0] += len(chunk)
+        yield chunk
+
+
+def _wants_multipart(size: int, dispatch_id: Optional[int], lease_token: Optional[str]) -> bool:
+    return bool(
+        dispatch_id is not None
+        and lease_token
+        and OUTPUT_MULTIPART_THRESHOLD_BYTES > 0
+        and size >= OUTPUT_MULTIPART_THRESHOLD_BYTES
+    )
+
+
+async def _upload_file_output(
+    output_url: str,
+    output_headers: Dict[str, str],
+    path: str,
+    size: int,
+    mime_type: str,
+    dispatch_id: Optional[int],
+    lease_token: Optional[str],
+) -> None:
+    if not (
+        _wants_multipart(size, dispatch_id, lease_token)
+        and await upload_output_multipart(dispatch_id, lease_token, size, mime_type, _file_range_reader(path))
+    ):
+        await upload_output(output_url, output_headers, path)
+
+
+async def transfer_comfyui_output(
+    file_info: Dict[str, Any],
+    output_url: str,
+    output_headers: Dict[str, str],
+    dispatch_id: Optional[int] = None,
+    lease_token: Optional[str] = None,
+    timings: Optional["JobTimings"] = None,
+    endpoint: Optional[str] = None,
+) -> Tuple[int, str, Optional[str]]:
+    """Move a ComfyUI output from ``endpoint`` (COMFYUI_BASE_URL by default) to the presigned PUT URL.
+
+    Streams ``/view`` straight into the PUT when the size is known (or chunked
+    uploads are allowed), otherwise spools to a temp file first. Returns
+    (size, mime_type, temp_path); temp_path is None when nothing hit disk.
+
+    With COMFYUI_ROOT set, the file is uploaded straight from ComfyUI's output dir.
+    Given the dispatch lease, outputs over OUTPUT_MULTIPART_THRESHOLD_BYTES are
+    uploaded as concurrent multipart parts when their source can be read by range.
+
+    ``timings`` gets ``output_download`` and ``output_upload`` spans, or one
+    ``output_transfer`` span when the download is piped into the upload.
+    """
+    endpoint = endpoint or COMFYUI_BASE_URL
+    filename = file_info.get("filename")
+    base_dir = _colocated_dir(endpoint, file_info.get("type", "output"))
+    if filename and base_dir:
+        local_path = _colocated_path(base_dir, filename, file_info.get("subfolder", ""))
+        if os.path.isfile(local_path):
+            size = os.path.getsize(local_path)
+            mime_type = mimetypes.guess_type(filename)[0] or "video/mp4"
+            with _timed(timings, "output_upload"):
+                await _upload_file_output(output_url, output_headers, local_path, size, mime_type, dispatch_id, lease_token)
+            return size, mime_type, None
+
+    started = time.monotonic()
+    resp, filename = await _open_comfyui_output(file_info, endpoint)
+    try:
+        mime_type = mimetypes.guess_type(filename)[0] or "video/mp4"
+        length_header = resp.headers.get("Content-Length")
+        length = int(length_header) if length_header and length_header.isdigit() else None
+        encoding = resp.headers.get("Content-Encoding", "identity").lower()
+        ranged = encoding == "identity" and resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+        if ranged and length is not None and _wants_multipart(length, dispatch_id, lease_token):
+            resp.release()
+            view_url, _ = _comfyui_view_url(file_info, endpoint)
+            with _timed(timings, "output_transfer"):
+                uploaded = await upload_output_multipart(
+                    dispatch_id, lease_token, length, mime_type, _view_range_reader(view_url)
+                )
+            if uploaded:
+                return length, mime_type, None
+            started = time.monotonic()
+            resp, filename = await _open_comfyui_output(file_info, endpoint)
+
+        streamable = OUTPUT_STREAMING_ENABLED and encoding == "identity"
+
+        if streamable and (length is not None or OUTPUT_STREAM_ALLOW_CHUNKED):
+            counter = [0]
+            headers = _normalize_output_headers(output_headers)
+            if length is not None:
+                # an explicit length keeps aiohttp from falling back to chunked encoding
+                headers["Content-Length"] = str(length)
+            try:
+                async with _s3_http.put(output_url, data=_counting_chunks(resp, counter), headers=headers) as put:
+                    put.raise_for_status()
+            except _HTTP_ERRORS:
+                if length is not None and counter[0] < length:
+                    raise RuntimeError(f"ComfyUI output truncated: sent {counter[0]} of {length} bytes.")
+                raise
+            if length is not None and counter[0] != length:
+                raise RuntimeError(f"ComfyUI output truncated: sent {counter[0]} of {length} bytes.")
+            if timings is not None:
+                timings.record("output_transfer", started, time.monotonic())
+            return counter[0], mime_type, None
+
+        output_path = await _write_response_to_temp(resp, filename)
+    finally:
+        resp.release()
+    if timings is not None:
+        timings.record("output_download", started, time.monotonic())
+    try:
+        size = os.path.getsize(output_path)
+        with _timed(timings, "output_upload"):
+            await _upload_file_output(output_url, output_headers, output_path, size, mime_type, dispatch_id, lease_token)
+    except BaseException:
+        _safe_unlink(output_path)
+        raise
+    return size, mime_type, output_path
+
+
 def _safe_unlink(path: Optional[str]) -> None:
     if not path:
         return
@@ -839,7 +3143,279 @@ def _safe_unlink(path: Optional[str]) -> None:
         return
 
 
-def process_job(job: Dict[str, Any]) -> None:
+class JobTimings:
+    """Monotonic per-stage spans for one job.
+
+    Spans may come from other threads (asset fetches, lease heartbeats) and a
+    stage may repeat; ``stages`` sums each stage's spans, so stages that ran in
+    parallel can add up to more than ``total_ms``.
+    """
+
+    MAX_SPANS = 200
+
+    def __init__(self, started: Optional[float] = None) -> None:
+        self.started = time.monotonic() if started is None else started
+        self._spans: List[Tuple[str, float, float]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, start, time.monotonic())
+
+    def record(self, stage: str, start: float, end: float) -> None:
+        end = max(start, end)
+        with self._lock:
+            self._spans.append((stage, start, end))
+        _metric_stage_seconds.observe(end - start, stage=stage)
+
+    def metadata(self) -> Dict[str, Any]:
+        """Durations in ms: job total, per-stage sums and the spans in start order."""
+        now = time.monotonic()
+        with self._lock:
+            spans = sorted(self._spans, key=lambda span: span[1])
+        stages: Dict[str, float] = {}
+        for stage, start, end in spans:
+            stages[stage] = stages.get(stage, 0.0) + (end - start) * 1000
+        return {
+            "total_ms": round((now - self.started) * 1000, 1),
+            "stages": {stage: round(ms, 1) for stage, ms in stages.items()},
+            "spans": [
+                {
+                    "stage": stage,
+                    "start_ms": round((start - self.started) * 1000, 1),
+                    "duration_ms": round((end - start) * 1000, 1),
+                }
+                for stage, start, end in spans[:self.MAX_SPANS]
+            ],
+        }
+
+
+def _timed(timings: Optional[JobTimings], stage: str):
+    return timings.span(stage) if timings is not None else nullcontext()
+
+
+_timing_log_lock = threading.Lock()
+
+
+def _log_job_timings(state: "JobState", outcome: str) -> None:
+    """Append one JSON line per finished job to JOB_TIMING_LOG_PATH."""
+    if not JOB_TIMING_LOG_PATH:
+        return
+    entry = {
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "worker_id": WORKER_ID,
+        "dispatch_id": state.dispatch_id,
+        "prompt_id": state.prompt_id,
+        "outcome": outcome,
+        **state.timings.metadata(),
+    }
+    line = json.dumps(entry, separators=(",", ":")) + "\n"
+    try:
+        with _timing_log_lock:
+            if JOB_TIMING_LOG_MAX_BYTES and os.path.exists(JOB_TIMING_LOG_PATH):
+                if os.path.getsize(JOB_TIMING_LOG_PATH) + len(line) > JOB_TIMING_LOG_MAX_BYTES:
+                    os.replace(JOB_TIMING_LOG_PATH, JOB_TIMING_LOG_PATH + ".1")
+            with open(JOB_TIMING_LOG_PATH, "a", encoding="utf-8") as handle:
+                handle.write(line)
+    except OSError as exc:
+        print(f"[worker] Job timing log not written: {exc}")
+
+
+def _finish_job(state: "JobState", outcome: str) -> None:
+    _metric_jobs.inc(outcome=outcome)
+    _metric_job_seconds.observe(time.monotonic() - state.started_at, outcome=outcome)
+    _log_job_timings(state, outcome)
+
+
+class JobCancelled(RuntimeError):
+    """Raised inside a job pipeline once its JobState has been cancelled."""
+
+
+class JobState:
+    """Runtime state of one leased job, owned by the executor task running it."""
+
+    def __init__(self, job: Dict[str, Any]) -> None:
+        self.job = job
+        self.dispatch_id = job["dispatch_id"]
+        self.lease_token = job["lease_token"]
+        self.started_at = time.monotonic()
+        self.timings = JobTimings(self.started_at)
+        self.prompt_id: Optional[str] = None
+        self.cancel_reason = ""
+        self.cancelled = False
+        self.requeued = False
+        self.lease_lost = False
+        self.rendering = False
+        # The ComfyUI instance the executor routed this job to; None means COMFYUI_BASE_URL
+        self.endpoint: Optional[str] = None
+        # Set by the executor when jobs are leased ahead of free GPU slots
+        self.render_slots: Optional[asyncio.Semaphore] = None
+        self.render_deadline: Optional[float] = None
+        # The pipeline's task; cancel() cancels it so whatever it awaits stops at once
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    def cancel(self, reason: str) -> None:
+        if not self.cancel_reason:
+            self.cancel_reason = reason
+        self.cancelled = True
+        task = self.task
+        if task is not None and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+
+    def check_cancelled(self) -> None:
+        if self.cancelled:
+            raise JobCancelled(f"Job cancelled: {self.cancel_reason or 'unknown'}")
+
+
+def _check_cancelled(state: Optional[JobState]) -> None:
+    if state is not None:
+        state.check_cancelled()
+
+
+def _job_endpoint(state: Optional[JobState]) -> str:
+    return (state.endpoint if state is not None else None) or COMFYUI_BASE_URL
+
+
+def _lease_seconds_remaining(job: Dict[str, Any]) -> Optional[float]:
+    expires_at = job.get("lease_expires_at")
+    if not expires_at:
+        return None
+    try:
+        expires = datetime.fromisoformat(str(expires_at).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if expires.tzinfo is None:
+        expires = expires.replace(tzinfo=timezone.utc)
+    return (expires - datetime.now(timezone.utc)).total_seconds()
+
+
+def _presigned_seconds_remaining(url: Optional[str]) -> Optional[float]:
+    """Seconds until a presigned S3 URL stops working; None when it carries no expiry."""
+    if not url:
+        return None
+    query = {key.lower(): value for key, value in parse_qsl(urlsplit(url).query)}
+    try:
+        if "x-amz-date" in query and "x-amz-expires" in query:
+            signed = datetime.strptime(query["x-amz-date"], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+            expires = signed.timestamp() + int(query["x-amz-expires"])
+        elif "expires" in query:
+            expires = float(query["expires"])  # SigV2
+        else:
+            return None
+    except ValueError:
+        return None
+    return expires - time.time()
+
+
+@asynccontextmanager
+async def _render_slot(state: Optional[JobState]) -> AsyncIterator[None]:
+    """Hold one GPU render slot while the prompt runs.
+
+    A prefetched job that waits past its render deadline is handed back to the
+    backend rather than risk rendering against expired presigned URLs.
+    """
+    slots = state.render_slots if state is not None else None
+    if slots is None:
+        if state is not None:
+            state.rendering = True
+        yield
+        return
+    with state.timings.span("render_slot_wait"):
+        if slots.locked() and state.render_deadline is not None:
+            try:
+                await asyncio.wait_for(slots.acquire(), max(0.0, state.render_deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                state.requeued = True
+                await _requeue_job(state.dispatch_id, state.lease_token, "prefetch_timeout")
+                state.cancel("prefetch_timeout")
+                state.check_cancelled()
+        else:
+            await slots.acquire()
+    try:
+        # handed back by requeue_unstarted while we were queued for the GPU
+        state.check_cancelled()
+        state.rendering = True
+        yield
+    finally:
+        slots.release()
+
+
+# Heartbeat responses that mean the backend no longer holds our lease
+_LEASE_LOST_STATUS_CODES = (404, 409, 410)
+
+
+class LeaseKeeper:
+    """Heartbeats one job's lease from a task on the running loop until stopped.
+
+    When the backend reports the lease as gone, the job is cancelled and its
+    ComfyUI prompt is removed so the GPU stops working on an orphaned render.
+    """
+
+    def __init__(self, state: JobState, interval: float = HEARTBEAT_INTERVAL_SECONDS) -> None:
+        self.state = state
+        self.interval = max(1.0, float(interval))
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._lost = False
+
+    def start(self) -> "LeaseKeeper":
+        self._task = asyncio.get_running_loop().create_task(self._run(), name=f"lease-{self.state.dispatch_id}")
+        return self
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is None or task is asyncio.current_task():
+            return
+        if not self._lost:
+            task.cancel()
+        # a lost lease still finishes removing its ComfyUI prompt
+        await asyncio.wait([task])
+
+    async def __aenter__(self) -> "LeaseKeeper":
+        return self.start()
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.stop()
+
+    async def _run(self) -> None:
+        state = self.state
+        while True:
+            await asyncio.sleep(self.interval)
+            if state.cancelled:
+                return
+            try:
+                with state.timings.span("backend_heartbeat"):
+                    await heartbeat(state.dispatch_id, state.lease_token)
+            except Exception as exc:
+                if _is_lease_lost(exc):
+                    _metric_heartbeat_failures.inc(reason="lease_lost")
+                    self._lost = True
+                    await self._on_lease_lost()
+                    return
+                _metric_heartbeat_failures.inc(reason="error")
+                print(f"[worker] Heartbeat failed for job {state.dispatch_id}: {exc}")
+
+    async def _on_lease_lost(self) -> None:
+        await _drop_lost_lease(self.state)
+
+
+def _is_lease_lost(exc: Exception) -> bool:
+    return isinstance(exc, aiohttp.ClientResponseError) and exc.status in _LEASE_LOST_STATUS_CODES
+
+
+async def _drop_lost_lease(state: JobState) -> None:
+    print(f"[worker] Lease lost for job {state.dispatch_id}, cancelling.")
+    state.lease_lost = True
+    state.cancel("lease_lost")
+    if state.prompt_id:
+        await cancel_comfyui_prompt(state.prompt_id, endpoint=state.endpoint)
+
+
+async def process_job(job: Dict[str, Any], state: Optional[JobState] = None) -> None:
+    """Run one leased job end to end; stage spans go to ``state.timings``."""
     dispatch_id = job["dispatch_id"]
     lease_token = job["lease_token"]
     input_url = job.get("input_url")
@@ -850,6 +3426,10 @@ def process_job(job: Dict[str, Any]) -> None:
 
     if not output_url:
         raise RuntimeError("Missing output_url in job payload.")
+    if state is None:
+        state = JobState(job)
+    timings = state.timings
+    endpoint = _job_endpoint(state)
 
     input_path = None
     output_path = None
@@ -860,108 +3440,353 @@ def process_job(job: Dict[str, Any]) -> None:
 
     try:
         if assets and isinstance(assets, list):
-            asset_placeholder_map = download_and_upload_assets(assets, COMFYUI_BASE_URL)
+            with timings.span("asset_fetch"):
+                asset_placeholder_map = await download_and_upload_assets(assets, endpoint, job_timings=timings)
 
         # Always run against self-hosted ComfyUI on this AWS node.
-        input_path = download_input(input_url) if input_url else None
-        workflow = prepare_workflow(input_payload, input_path, asset_placeholder_map)
-
+        _check_cancelled(state)
+        if input_url:
+            with timings.span("input_download"):
+                input_path = await download_input(input_url)
+        with timings.span("prepare_workflow"):
+            if not await _load_workflow_template(input_payload, job.get("workflow_id")):
+                # Hand it back: this worker no longer reports the hash, so the
+                # backend sends the full graph with the next lease.
+                state.requeued = True
+                await _requeue_job(dispatch_id, lease_token, "workflow_template_unavailable")
+                state.cancel("workflow_template_unavailable")
+                state.check_cancelled()
+            workflow = prepare_workflow(input_payload, input_path, asset_placeholder_map)
+
+        _check_cancelled(state)
         extra_data = input_payload.get("extra_data")
-        provider_job_id, outputs, history_entry = run_comfyui(workflow, output_node_id, extra_data)
-        output_file_info = extract_output_file(outputs, output_node_id)
-        output_path = download_comfyui_output(output_file_info)
+        async with _render_slot(state):
+            provider_job_id, outputs, history_entry = await run_comfyui(workflow, output_node_id, extra_data, state)
 
         output_metadata: Dict[str, Any] = {}
-        try:
-            usage_events = extract_partner_usage_events(workflow, history_entry)
-            if usage_events:
-                output_metadata["partner_usage_events"] = usage_events
-        except Exception as exc:
-            print(f"[worker] Partner usage extraction skipped: {exc}")
-
-        upload_output(output_url, output_headers, output_path)
-        complete_job(
-            dispatch_id,
-            lease_token,
-            provider_job_id,
-            output_path,
-            output_metadata if output_metadata else None,
+        with timings.span("extract_outputs"):
+            output_file_info = extract_output_file(outputs, output_node_id)
+            try:
+                usage_events = extract_partner_usage_events(workflow, history_entry)
+                if usage_events:
+                    output_metadata["partner_usage_events"] = usage_events
+            except Exception as exc:
+                print(f"[worker] Partner usage extraction skipped: {exc}")
+
+        _check_cancelled(state)
+        output_size, output_mime_type, output_path = await transfer_comfyui_output(
+            output_file_info, output_url, output_headers,
+            dispatch_id=dispatch_id, lease_token=lease_token, timings=timings, endpoint=endpoint,
         )
+        _metric_transfer_bytes.inc(output_size, direction="upload")
+        # the report itself is timed for the local log only
+        output_metadata["timings"] = timings.metadata()
+        with timings.span("backend_complete"):
+            await complete_job(
+                dispatch_id,
+                lease_token,
+                provider_job_id,
+                output_path,
+                output_metadata,
+                output_size=output_size,
+                output_mime_type=output_mime_type,
+            )
     finally:
         _safe_unlink(input_path)
         _safe_unlink(output_path)
 
 
+class JobExecutor:
+    """Runs up to ``max_concurrency`` job pipelines at once, one task per job on the running loop.
+
+    Handing a job back cancels its task, so a Spot shutdown is never blocked
+    behind a render or transfer whose lease the backend already has back.
+    Each job's lease is kept alive by a LeaseKeeper for as long as its
+    pipeline runs.
+
+    With ``prefetch_depth`` > 0 the executor admits that many extra jobs and
+    gates the render stage on ``max_concurrency`` slots, so the next job's
+    downloads and the previous job's uploads overlap the current render.
+
+    Given a ComfyUIPool, each job is routed to one of its instances on submit
+    and the render slots are split evenly between the instances.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        runner: Callable[[Dict[str, Any], Optional[JobState]], Awaitable[None]] = process_job,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL_SECONDS,
+        prefetch_depth: int = 0,
+        pool: Optional["ComfyUIPool"] = None,
+    ) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.prefetch_depth = max(0, prefetch_depth)
+        self.capacity = self.max_concurrency + self.prefetch_depth
+        self.heartbeat_interval = heartbeat_interval
+        self._pool = pool
+        self._render_slots = _render_slot_map(self.max_concurrency, self.prefetch_depth, pool)
+        self._runner = runner
+        self._active: Dict[int, JobState] = {}
+        # supervisor task per job: heartbeats, failure report and bookkeeping
+        self._tasks: Dict[int, "asyncio.Task[None]"] = {}
+        self._changed = asyncio.Event()
+
+    @property
+    def current_load(self) -> int:
+        return len(self._active)
+
+    def has_capacity(self) -> bool:
+        return self.current_load < self.capacity
+
+    def active_jobs(self) -> List[JobState]:
+        return list(self._active.values())
+
+    def submit(self, job: Dict[str, Any]) -> JobState:
+        if len(self._active) >= self.capacity:
+            raise RuntimeError("Job executor is at capacity.")
+        state = JobState(job)
+        _route_job(state, self._pool, self._render_slots)
+        self._active[state.dispatch_id] = state
+        _metric_active_jobs.set(len(self._active))
+        loop = asyncio.get_running_loop()
+        state.task = loop.create_task(self._runner(state.job, state), name=f"job-{state.dispatch_id}")
+        self._tasks[state.dispatch_id] = loop.create_task(self._run(state), name=f"run-{state.dispatch_id}")
+        return state
+
+    async def wait_for_slot(self, timeout: float) -> bool:
+        """Wait until a slot frees up or ``timeout`` passes. Returns True if one is free."""
+        deadline = time.monotonic() + timeout
+        while not self.has_capacity():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait for in-flight jobs to finish. Returns True if none are left."""
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        return not self._active
+
+    async def requeue_all(self, reason: str) -> None:
+        """Hand every in-flight job back to the backend and cancel its pipeline."""
+        for state in self.active_jobs():
+            if state.requeued:
+                continue
+            state.requeued = True
+            state.cancel(reason)
+            await _requeue_job(state.dispatch_id, state.lease_token, reason)
+            if state.prompt_id:
+                await cancel_comfyui_prompt(state.prompt_id, endpoint=state.endpoint)
+
+    async def requeue_unstarted(self, reason: str) -> int:
+        """Hand back jobs still queued for a render slot; returns how many."""
+        handed_back = 0
+        for state in self.active_jobs():
+            if state.render_slots is None or state.rendering or state.requeued:
+                continue
+            state.requeued = True
+            state.cancel(reason)
+            await _requeue_job(state.dispatch_id, state.lease_token, reason)
+            handed_back += 1
+        return handed_back
+
+    async def _run(self, state: JobState) -> None:
+        task = state.task
+        outcome = "completed"
+        try:
+            async with LeaseKeeper(state, self.heartbeat_interval):
+                await asyncio.wait([task])
+            if task.cancelled():
+                outcome = await self._handle_failure(
+                    state, JobCancelled(f"Job cancelled: {state.cancel_reason or 'unknown'}")
+                )
+            elif task.exception() is not None:
+                outcome = await self._handle_failure(state, task.exception())
+        except asyncio.CancelledError:
+            # the loop is going away under us; take the pipeline down with it
+            task.cancel()
+            outcome = "requeued" if state.requeued else "failed"
+            raise
+        finally:
+            _finish_job(state, outcome)
+            if self._pool is not None:
+                self._pool.release(state.endpoint)
+            self._active.pop(state.dispatch_id, None)
+            self._tasks.pop(state.dispatch_id, None)
+            _metric_active_jobs.set(len(self._active))
+            self._changed.set()
+
+    async def _handle_failure(self, state: JobState, exc: BaseException) -> str:
+        return await _report_failure(state, exc)
+
+
+def _render_slot_map(
+    max_concurrency: int,
+    prefetch_depth: int,
+    pool: Optional["ComfyUIPool"],
+) -> Dict[Optional[str], asyncio.Semaphore]:
+    """Render slots by ComfyUI endpoint (None without a pool); empty when renders aren't gated."""
+    if not prefetch_depth:
+        return {}
+    if pool is None:
+        return {None: asyncio.Semaphore(max_concurrency)}
+    share = max(1, max_concurrency // len(pool))
+    return {endpoint: asyncio.Semaphore(share) for endpoint in pool.endpoints}
+
+
+def _route_job(
+    state: JobState, pool: Optional["ComfyUIPool"], render_slots: Dict[Optional[str], asyncio.Semaphore]
+) -> None:
+    """Pick the job's ComfyUI instance and the render slots it waits on."""
+    if pool is not None:
+        state.endpoint = pool.assign(state.job)
+    if render_slots:
+        state.render_slots = render_slots[state.endpoint]
+        state.render_deadline = _prefetch_deadline(state.job)
+
+
+def _prefetch_deadline(job: Dict[str, Any]) -> float:
+    """When a prefetched job stops waiting for a render slot.
+
+    That is the cap, or half of what is left of its lease or of its presigned
+    ``output_url``, whichever comes first, so the render and upload still fit.
+    """
+    max_wait = float(JOB_PREFETCH_MAX_WAIT_SECONDS)
+    for remaining in (_lease_seconds_remaining(job), _presigned_seconds_remaining(job.get("output_url"))):
+        if remaining is not None:
+            max_wait = min(max_wait, max(0.0, remaining / 2))
+    return time.monotonic() + max_wait
+
+
+async def _report_failure(state: JobState, exc: BaseException) -> str:
+    """Report a failed pipeline and return the job's outcome."""
+    if state.lease_lost:
+        return "lease_lost"
+    if state.requeued:
+        return "requeued"
+    try:
+        if _shutdown_requested and _shutdown_reason in _REQUEUE_REASONS:
+            state.requeued = True
+            await _requeue_job(state.dispatch_id, state.lease_token, _shutdown_reason)
+            return "requeued"
+        await fail_job(state.dispatch_id, state.lease_token, str(exc), metadata={"timings": state.timings.metadata()})
+    except Exception as report_exc:
+        print(f"[worker] Failed to report job {state.dispatch_id}: {report_exc}")
+    return "failed"
+
+
+def _handle_sigterm(*_: Any) -> None:
+    print("[worker] Received SIGTERM, shutting down...")
+    _request_shutdown("sigterm")
+
+
 def main() -> None:
-    global WORKER_ID, WORKER_TOKEN, _shutdown_requested, _shutdown_reason, _current_job
+    asyncio.run(_main())
 
-    # SIGTERM handler for graceful shutdown
-    def _handle_sigterm(signum, frame):
-        global _shutdown_requested, _shutdown_reason
-        _shutdown_requested = True
-        if not _shutdown_reason:
-            _shutdown_reason = "sigterm"
-        print(f"[worker] Received SIGTERM, shutting down...")
 
-    signal.signal(signal.SIGTERM, _handle_sigterm)
+async def _main() -> None:
+    global WORKER_ID, WORKER_TOKEN
+
+    # SIGTERM handler for graceful shutdown
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, _handle_sigterm)
+    except NotImplementedError:
+        signal.signal(signal.SIGTERM, _handle_sigterm)
 
     # Fleet self-registration (ASG workers)
     if FLEET_SECRET and not WORKER_TOKEN:
         print(f"[worker] Fleet registration as {WORKER_ID}...")
-        WORKER_ID, WORKER_TOKEN = _fleet_register()
+        WORKER_ID, WORKER_TOKEN = await _fleet_register()
         print(f"[worker] Registered as {WORKER_ID}")
 
-    print(f"[worker] Starting as {WORKER_ID}")
+    print(
+        f"[worker] Starting as {WORKER_ID} (max concurrency {MAX_CONCURRENCY} + prefetch {JOB_PREFETCH_DEPTH} "
+        f"on {_comfyui_instance_count()} ComfyUI instance(s))"
+    )
+
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = start_metrics_server()
+        print(f"[worker] Serving metrics on {METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    protection = ScaleInProtection(ASG_NAME, WORKER_ID)
+    await _serve(protection)
+
+    protection.set(False)
+    await asyncio.to_thread(protection.flush)
+    protection.close()
+
+    # Deregister if fleet-registered
+    if FLEET_SECRET:
+        await _fleet_deregister(_shutdown_reason)
+
+    await _close_event_streams()
+    await _close_http_pools()
+    _asset_cache.flush()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
+    print(f"[worker] Shutdown complete. Reason: {_shutdown_reason or 'normal'}")
+
+
+async def _serve(protection: ScaleInProtection) -> None:
+    """Poll and run jobs on the running loop until shutdown, then hand back or drain.
 
+    Shutdown lets an in-flight long poll return so the jobs it leased are handed
+    back rather than left to expire on the backend.
+    """
     # Start Spot interruption monitor for ASG instances
-    if ASG_NAME:
-        threading.Thread(target=_termination_monitor, daemon=True).start()
+    monitor = asyncio.create_task(_termination_monitor()) if ASG_NAME else None
 
-    current_load = 0
+    poller = JobPoller()
+    pool = ComfyUIPool(COMFYUI_BASE_URLS or [COMFYUI_BASE_URL])
+    executor = JobExecutor(MAX_CONCURRENCY * len(pool), prefetch_depth=JOB_PREFETCH_DEPTH * len(pool), pool=pool)
     while not _shutdown_requested:
         try:
-            _set_scale_in_protection(False)
-            job = poll(current_load)
-            if not job:
-                time.sleep(POLL_INTERVAL_SECONDS)
+            if not executor.has_capacity():
+                await executor.wait_for_slot(POLL_INTERVAL_SECONDS)
                 continue
 
-            _set_scale_in_protection(True)
-            _current_job = job
-            current_load += 1
-            last_heartbeat = time.time()
+            protection.set(executor.current_load > 0)
+            load, free = await pool.slots(
+                executor.current_load, executor.capacity, [state.prompt_id for state in executor.active_jobs()]
+            )
+            if not free:
+                await _sleep_unless_shutdown(POLL_INTERVAL_SECONDS)
+                continue
+            jobs = await poller.next_jobs(load, executor.capacity, free)
+            if not jobs:
+                continue
 
-            try:
-                while True:
-                    now = time.time()
-                    if now - last_heartbeat >= HEARTBEAT_INTERVAL_SECONDS:
-                        heartbeat(job["dispatch_id"], job["lease_token"])
-                        last_heartbeat = now
-                    process_job(job)
+            protection.set(True)
+            for index, job in enumerate(jobs):
+                if _shutdown_requested or not executor.has_capacity():
+                    await _hand_back_jobs(jobs[index:], _shutdown_reason or "worker_at_capacity")
                     break
-            except Exception as exc:
-                if _shutdown_requested and _shutdown_reason in ("spot_interruption", "spot_rebalance", "asg_termination"):
-                    _requeue_job(job["dispatch_id"], job["lease_token"], _shutdown_reason)
-                else:
-                    fail_job(job["dispatch_id"], job["lease_token"], str(exc))
-            finally:
-                _current_job = None
-                current_load = max(0, current_load - 1)
+                executor.submit(job)
         except Exception:
-            time.sleep(POLL_INTERVAL_SECONDS)
-
-    # Graceful shutdown
-    _set_scale_in_protection(False)
-
-    # If interrupted with an active job, requeue it
-    if _current_job and _shutdown_reason in ("spot_interruption", "spot_rebalance", "asg_termination"):
-        _requeue_job(_current_job["dispatch_id"], _current_job["lease_token"], _shutdown_reason)
-
-    # Deregister if fleet-registered
-    if FLEET_SECRET:
-        _fleet_deregister(_shutdown_reason)
-
-    print(f"[worker] Shutdown complete. Reason: {_shutdown_reason or 'normal'}")
+            await _sleep_unless_shutdown(POLL_INTERVAL_SECONDS)
+    if monitor is not None:
+        monitor.cancel()
+
+    # Graceful shutdown: hand jobs back on instance loss, otherwise let started ones finish
+    if _shutdown_reason in _REQUEUE_REASONS:
+        await executor.requeue_all(_shutdown_reason)
+    else:
+        await executor.requeue_unstarted(_shutdown_reason or "shutdown")
+        if not await executor.drain(SHUTDOWN_GRACE_SECONDS):
+            await executor.requeue_all(_shutdown_reason or "shutdown")
+    # let cancelled pipelines unwind (temp files, timing log)
+    await executor.drain(5)
 
 
 if __name__ == "__main__":
@@ -1,22 +1,30 @@
+import asyncio
 import sys
 import traceback
 
 import comfyui_worker as worker
 
 
-def main() -> None:
-    job = worker.poll(0)
-    if not job:
-        print("No jobs available.")
-        return
-
+async def _main() -> None:
     try:
-        worker.process_job(job)
-        print("Job completed.")
-    except Exception as exc:
-        worker.fail_job(job["dispatch_id"], job["lease_token"], str(exc))
-        traceback.print_exc()
-        raise
+        job = await worker.poll(0)
+        if not job:
+            print("No jobs available.")
+            return
+
+        try:
+            await worker.process_job(job)
+            print("Job completed.")
+        except Exception as exc:
+            await worker.fail_job(job["dispatch_id"], job["lease_token"], str(exc))
+            traceback.print_exc()
+            raise
+    finally:
+        await worker._close_http_pools()
+
+
+def main() -> None:
+    asyncio.run(_main())
 
 
 if __name__ == "__main__":
@@ -1,10 +1,10 @@
-import time
+import asyncio
 import uuid
 
 import comfyui_worker as base_worker
 
 
-def process_job(job: dict) -> None:
+async def process_job(job: dict) -> None:
     dispatch_id = job["dispatch_id"]
     lease_token = job["lease_token"]
     input_url = job.get("input_url")
@@ -18,40 +18,40 @@ def process_job(job: dict) -> None:
 
     input_path = None
     try:
-        input_path = base_worker.download_input(input_url)
-        base_worker.upload_output(output_url, output_headers, input_path)
+        input_path = await base_worker.download_input(input_url)
+        await base_worker.upload_output(output_url, output_headers, input_path)
         provider_job_id = f"stub-{uuid.uuid4()}"
-        base_worker.complete_job(dispatch_id, lease_token, provider_job_id, input_path)
+        await base_worker.complete_job(dispatch_id, lease_token, provider_job_id, input_path)
     finally:
         base_worker._safe_unlink(input_path)
 
 
-def main() -> None:
+async def _main() -> None:
     current_load = 0
     while True:
         try:
-            job = base_worker.poll(current_load)
+            job = await base_worker.poll(current_load)
             if not job:
-                time.sleep(base_worker.POLL_INTERVAL_SECONDS)
+                await asyncio.sleep(base_worker.POLL_INTERVAL_SECONDS)
                 continue
 
             current_load += 1
-            last_heartbeat = time.time()
+            state = base_worker.JobState(job)
 
             try:
-                while True:
-                    now = time.time()
-                    if now - last_heartbeat >= base_worker.HEARTBEAT_INTERVAL_SECONDS:
-                        base_worker.heartbeat(job["dispatch_id"], job["lease_token"])
-                        last_heartbeat = now
-                    process_job(job)
-                    break
+                async with base_worker.LeaseKeeper(state):
+                    await process_job(job)
             except Exception as exc:
-                base_worker.fail_job(job["dispatch_id"], job["lease_token"], str(exc))
+                if not state.lease_lost:
+                    await base_worker.fail_job(job["dispatch_id"], job["lease_token"], str(exc))
             finally:
                 current_load = max(0, current_load - 1)
         except Exception:
-            time.sleep(base_worker.POLL_INTERVAL_SECONDS)
+            await asyncio.sleep(base_worker.POLL_INTERVAL_SECONDS)
+
+
+def main() -> None:
+    asyncio.run(_main())
 
 
 if __name__ == "__main__":
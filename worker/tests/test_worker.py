@@ -1,32 +1,89 @@
+import asyncio
+import base64
+import hashlib
+import json
 import os
+import shutil
+import socket
 import sys
 import tempfile
+import threading
 import unittest
+import urllib.error
+import urllib.request
 from unittest import mock
 
+import aiohttp
+
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 import comfyui_worker as worker
 
 
+class _Body:
+    """aiohttp ``StreamReader`` stand-in; ``fail_after`` drops the connection mid-body."""
+
+    def __init__(self, content, fail_after=None):
+        self._content = content
+        self._fail_after = fail_after
+
+    async def iter_chunked(self, size):
+        end = len(self._content) if self._fail_after is None else self._fail_after
+        for start in range(0, end, size):
+            yield self._content[start:min(start + size, end)]
+        if self._fail_after is not None:
+            raise aiohttp.ClientPayloadError("reset")
+
+
 class DummyResponse:
-    def __init__(self, payload=None, content=b"data"):
+    def __init__(self, payload=None, content=b"data", status=200, headers=None):
         self._payload = payload or {}
         self._content = content
+        self.status = status
+        self.headers = headers or {}
+        self.content = _Body(content)
 
     def raise_for_status(self):
-        return None
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(mock.Mock(), (), status=self.status)
 
-    def json(self):
+    async def json(self, content_type=None):
         return self._payload
 
-    def iter_content(self, chunk_size=1024):
-        yield self._content
+    async def read(self):
+        return self._content
+
+    async def text(self):
+        return self._content.decode()
+
+    def release(self):
+        return None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+
+class UploadResponse(DummyResponse):
+    """PUT response that drains the streamed request body into ``sink`` first."""
+
+    def __init__(self, data, sink):
+        super().__init__()
+        self._data = data
+        self._sink = sink
+
+    async def __aenter__(self):
+        self._sink.append(b"".join([chunk async for chunk in self._data]))
+        return self
 
 
 class WorkerTests(unittest.TestCase):
     def setUp(self):
         worker.COMFYUI_BASE_URL = "http://localhost:8188"
+        worker.COMFYUI_WS_ENABLED = False
+        worker.JOB_TIMING_LOG_PATH = ""
 
     def test_prepare_workflow_replaces_placeholder(self):
         workflow = {"1": {"inputs": {"path": "__INPUT_PATH__"}}}
@@ -52,6 +109,119 @@ class WorkerTests(unittest.TestCase):
         finally:
             os.remove(input_path)
 
+    def test_prepare_workflow_substitutes_in_one_pass_without_mutating_source(self):
+        workflow = {
+            "1": {"inputs": {"image": "__IMG__", "mask": "__IMG___MASK__", "text": "a __IMG__ b"}},
+            "2": {"inputs": {"list": ["x", "__INPUT_PATH__", {"deep": "prefix/__INPUT_PATH__"}]}},
+            "3": {"inputs": {"seed": 5}},
+        }
+        source = json.loads(json.dumps(workflow))
+        payload = {"workflow": workflow, "input_reference_prefix": "prefix/", "input_node_id": "3", "input_field": "video"}
+        placeholder_map = {"__IMG__": 'asset_"quoted"__IMG___MASK__.png', "__IMG___MASK__": "asset_mask.png"}
+
+        result = worker.prepare_workflow(payload, "in.mp4", placeholder_map)
+
+        self.assertEqual(result["1"]["inputs"], {
+            "image": 'asset_"quoted"__IMG___MASK__.png',
+            "mask": "asset_mask.png",
+            "text": 'a asset_"quoted"__IMG___MASK__.png b',
+        })
+        self.assertEqual(result["2"]["inputs"]["list"], ["x", "prefix/in.mp4", {"deep": "prefix/in.mp4"}])
+        self.assertEqual(result["3"]["inputs"], {"seed": 5, "video": "prefix/in.mp4"})
+        self.assertEqual(workflow, source)
+
+    def test_workflow_template_copies_only_changed_paths(self):
+        workflow = {"1": {"inputs": {"a": "__A__"}}, "2": {"inputs": {"b": "plain"}}}
+        template = worker.WorkflowTemplate(workflow, ["__A__", "__B__"])
+
+        self.assertEqual(template.slots, [(("1", "inputs", "a"), "__A__")])
+        rendered = template.render({"__A__": "x"})
+        self.assertEqual(rendered["1"]["inputs"]["a"], "x")
+        self.assertIs(rendered["2"], workflow["2"])
+        self.assertEqual(workflow["1"]["inputs"]["a"], "__A__")
+
+    def test_prepare_workflow_renders_hash_only_payload_from_template_cache(self):
+        raw = {"1": {"inputs": {"text": "__PROMPT__", "image": "__IMG__"}}, "2": {"inputs": {"path": "__INPUT_PATH__"}}}
+        cache = worker._WorkflowTemplateCache(max_entries=2)
+        payload = {"workflow_hash": "abc", "workflow_values": {"__PROMPT__": "a cat"}, "input_reference_prefix": "", "input_node_id": "2", "input_field": "video"}
+        response = {"data": {"workflow_id": 7, "workflow_hash": "abc", "workflow": raw}}
+
+        with mock.patch.object(worker, "_workflow_templates", cache), \
+                mock.patch.object(worker, "_backend_post", return_value=response) as post:
+            asyncio.run(worker._load_workflow_template(payload, 7))
+            first = worker.prepare_workflow(payload, "in.mp4", {"__IMG__": "asset.png"})
+            asyncio.run(worker._load_workflow_template(payload, 7))
+            second = worker.prepare_workflow(payload, "other.mp4", {"__IMG__": "asset.png"})
+
+        post.assert_called_once_with("/api/worker/workflow-template", {"workflow_id": 7}, idempotent=True)
+        self.assertEqual(first["1"]["inputs"], {"text": "a cat", "image": "asset.png"})
+        self.assertEqual(first["2"]["inputs"], {"path": "in.mp4", "video": "in.mp4"})
+        self.assertEqual(second["2"]["inputs"]["path"], "other.mp4")
+        self.assertEqual(raw["1"]["inputs"]["text"], "__PROMPT__")
+        self.assertEqual(cache.hashes(), ["abc"])
+
+    def test_prepare_workflow_uses_full_workflow_while_template_loads(self):
+        cache = worker._WorkflowTemplateCache(max_entries=2)
+        payload = {"workflow": {"1": {"inputs": {"text": "a cat"}}}, "workflow_hash": "abc", "workflow_values": []}
+
+        with mock.patch.object(worker, "_workflow_templates", cache), \
+                mock.patch.object(cache, "fetch_in_background") as background, \
+                mock.patch.object(worker, "_backend_post") as post:
+            asyncio.run(worker._load_workflow_template(payload, 7))
+            result = worker.prepare_workflow(payload, None)
+
+        background.assert_called_once_with(7, "abc")
+        post.assert_not_called()
+        self.assertEqual(result["1"]["inputs"]["text"], "a cat")
+
+    @mock.patch("comfyui_worker.fail_job")
+    @mock.patch("comfyui_worker._requeue_job")
+    def test_hash_only_job_is_requeued_when_template_hash_changed(self, mock_requeue, mock_fail):
+        cache = worker._WorkflowTemplateCache(max_entries=2)
+        payload = {"workflow_hash": "old", "workflow_values": {}, "output_node_id": "9"}
+        response = {"data": {"workflow_id": 7, "workflow_hash": "new", "workflow": {"1": {"inputs": {}}}}}
+
+        async def scenario():
+            executor = worker.JobExecutor(1, runner=worker.process_job)
+            executor.submit({"dispatch_id": 5, "lease_token": "t", "workflow_id": 7,
+                             "output_url": "https://s3/out", "input_payload": payload})
+            self.assertTrue(await executor.drain(5))
+
+        with mock.patch.object(worker, "_workflow_templates", cache), \
+                mock.patch.object(worker, "_backend_post", return_value=response), \
+                mock.patch("comfyui_worker.run_comfyui") as mock_run:
+            asyncio.run(scenario())
+
+        mock_requeue.assert_called_once_with(5, "t", "workflow_template_unavailable")
+        mock_fail.assert_not_called()
+        mock_run.assert_not_called()
+        # the next poll no longer reports "old", so the backend resends the full workflow
+        self.assertEqual(cache.hashes(), ["new"])
+
+    def test_poll_advertises_cached_workflow_hashes(self):
+        cache = worker._WorkflowTemplateCache(max_entries=1)
+        cache.put("old", {"1": {}})
+        cache.put("new", {"1": {}})
+
+        with mock.patch.object(worker, "_workflow_templates", cache), \
+                mock.patch.object(worker, "_backend_post", return_value={"data": {"job": None}}) as post:
+            asyncio.run(worker._poll_backend(0))
+
+        self.assertEqual(post.call_args[0][1]["workflow_hashes"], ["new"])
+
+    def test_register_and_poll_report_gpu_slots_plus_prefetch(self):
+        registered = DummyResponse(payload={"data": {"worker_id": "w-1", "token": "tok"}})
+        with mock.patch.multiple(worker, FLEET_SLUG="gpu", MAX_CONCURRENCY=1, JOB_PREFETCH_DEPTH=1, COMFYUI_BASE_URLS=[]), \
+                mock.patch("comfyui_worker._detect_capacity_type", return_value=None), \
+                mock.patch("comfyui_worker._detect_instance_type", return_value=None), \
+                mock.patch.object(worker._backend_http, "post", return_value=registered) as register, \
+                mock.patch.object(worker, "_backend_post", return_value={"data": {"job": None}}) as post:
+            self.assertEqual(asyncio.run(worker._fleet_register()), ("w-1", "tok"))
+            asyncio.run(worker._poll_backend(0))
+
+        self.assertEqual(register.call_args.kwargs["json"]["max_concurrency"], 2)
+        self.assertEqual(post.call_args[0][1]["max_concurrency"], 2)
+
     def test_extract_output_file_with_node_id(self):
         outputs = {
             "5": {
@@ -72,32 +242,342 @@ class WorkerTests(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             worker.extract_output_file({}, None)
 
-    @mock.patch("comfyui_worker.requests.get")
-    def test_download_input_writes_file(self, mock_get):
-        mock_get.return_value = DummyResponse(content=b"hello")
-        path = worker.download_input("https://example.com/input.mp4")
+    @mock.patch.object(worker._s3_http, "send")
+    def test_download_input_writes_file(self, mock_send):
+        mock_send.return_value = DummyResponse(content=b"hello")
+        path = asyncio.run(worker.download_input("https://example.com/input.mp4"))
 
         with open(path, "rb") as handle:
             self.assertEqual(handle.read(), b"hello")
 
         os.remove(path)
 
-    @mock.patch("comfyui_worker.requests.put")
+    def _ranged_server(self, content, reset_at=None):
+        """Fake S3 GET honouring Range; the first request covering ``reset_at`` dies mid-body."""
+        requested = []
+
+        async def send(method, url, idempotent=False, headers=None, timeout=None):
+            start, end = headers["Range"].removeprefix("bytes=").split("-")
+            start, end = int(start), min(int(end), len(content) - 1)
+            requested.append((start, end))
+            reset = reset_at is not None and start <= reset_at <= end and len(
+                [r for r in requested if r[0] <= reset_at <= r[1]]
+            ) == 1
+            resp = DummyResponse(content=content[start:end + 1], status=206, headers={
+                "Content-Range": f"bytes {start}-{end}/{len(content)}",
+                "ETag": '"v1"',
+            })
+            if reset:
+                resp.content = _Body(resp._content, fail_after=reset_at - start)
+            return resp
+
+        return send, requested
+
+    def test_download_input_fetches_ranges_in_parallel_and_resumes(self):
+        content = bytes(range(10)) * 3
+        send, requested = self._ranged_server(content, reset_at=14)
+        with mock.patch.object(worker._s3_http, "send", side_effect=send), \
+                mock.patch.object(worker, "INPUT_DOWNLOAD_SEGMENT_BYTES", 8), \
+                mock.patch.object(worker, "HTTP_RETRY_BACKOFF_SECONDS", 0):
+            path = asyncio.run(worker.download_input(
+                "https://s3/in.mp4?sig=1", hashlib.sha256(content).hexdigest()
+            ))
+        self.addCleanup(os.remove, path)
+
+        with open(path, "rb") as handle:
+            self.assertEqual(handle.read(), content)
+        self.assertEqual(sorted(requested), [(0, 7), (8, 15), (14, 15), (16, 23), (24, 29)])
+
+    def test_download_input_rejects_content_hash_mismatch(self):
+        send, _ = self._ranged_server(b"tampered")
+        before = set(os.listdir(tempfile.gettempdir()))
+        with mock.patch.object(worker._s3_http, "send", side_effect=send):
+            with self.assertRaises(RuntimeError):
+                asyncio.run(worker.download_input("https://s3/in.png", "sha256:" + hashlib.sha256(b"original").hexdigest()))
+        self.assertEqual(set(os.listdir(tempfile.gettempdir())) - before, set())
+
+    @mock.patch.object(worker._s3_http, "put")
     def test_upload_output_uses_put(self, mock_put):
         mock_put.return_value = DummyResponse()
         with open("temp-output.bin", "wb") as handle:
             handle.write(b"data")
 
         try:
-            worker.upload_output("https://example.com/upload", {}, "temp-output.bin")
+            asyncio.run(worker.upload_output("https://example.com/upload", {}, "temp-output.bin"))
             mock_put.assert_called_once()
         finally:
             os.remove("temp-output.bin")
 
-    @mock.patch("comfyui_worker.time.sleep", return_value=None)
-    @mock.patch("comfyui_worker.requests.get")
-    @mock.patch("comfyui_worker.requests.post")
-    def test_run_comfyui_success(self, mock_post, mock_get, _sleep):
+    def _asset_cache(self, max_bytes=1024):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        return cache_dir, worker._AssetCache(cache_dir, max_bytes)
+
+    def _fake_download(self, content=b"asset"):
+        def download(url, content_hash=None):
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as handle:
+                handle.write(content)
+                return handle.name
+        return download
+
+    @mock.patch("comfyui_worker._comfyui_has_input", return_value=True)
+    @mock.patch("comfyui_worker.upload_to_comfyui", return_value="asset_abc.png")
+    def test_asset_cache_survives_restart_and_dedupes_placeholders(self, mock_upload, _has_input):
+        cache_dir, cache = self._asset_cache()
+        assets = [
+            {"placeholder": "__A__", "download_url": "https://s3/a.png?sig=1", "content_hash": "abc"},
+            {"placeholder": "__B__", "download_url": "https://s3/a.png?sig=2", "content_hash": "abc"},
+        ]
+        with mock.patch.object(worker, "_asset_cache", cache), \
+                mock.patch("comfyui_worker.download_input", side_effect=self._fake_download()) as mock_download:
+            result = asyncio.run(worker.download_and_upload_assets(assets, "http://comfy"))
+        self.assertEqual(result, {"__A__": "asset_abc.png", "__B__": "asset_abc.png"})
+        self.assertEqual(mock_download.call_count, 1)
+        self.assertEqual(mock_upload.call_args.args[2], "asset_abc.png")
+
+        restarted = worker._AssetCache(cache_dir, 1024)
+        with mock.patch.object(worker, "_asset_cache", restarted), \
+                mock.patch("comfyui_worker.download_input") as mock_download:
+            result = asyncio.run(worker.download_and_upload_assets(assets[:1], "http://comfy"))
+        self.assertEqual(result, {"__A__": "asset_abc.png"})
+        mock_download.assert_not_called()
+        self.assertEqual(mock_upload.call_count, 1)
+
+    @mock.patch("comfyui_worker._comfyui_has_input", return_value=True)
+    def test_asset_cache_hits_update_last_used_in_memory_until_flushed(self, _has_input):
+        cache_dir, cache = self._asset_cache()
+        cache.store("abc", "http://comfy", "asset_abc.png")
+        with mock.patch.object(cache, "_save", wraps=cache._save) as save:
+            for _ in range(3):
+                self.assertEqual(asyncio.run(cache.lookup("abc", "http://comfy")), "asset_abc.png")
+            save.assert_not_called()
+            cache.flush()
+            cache.flush()
+        save.assert_called_once()
+        used = worker._AssetCache(cache_dir, 1024)._load()["abc"]["last_used"]
+        self.assertEqual(used, cache._load()["abc"]["last_used"])
+
+    def test_asset_cache_drops_key_locks_once_released(self):
+        _, cache = self._asset_cache()
+        entered = []
+
+        async def contend():
+            async with cache.key_lock("abc"):
+                entered.append(True)
+
+        async def scenario():
+            async with cache.key_lock("abc"):
+                waiter = asyncio.create_task(contend())
+                await asyncio.sleep(0.05)
+                self.assertEqual(entered, [])
+            await asyncio.wait_for(waiter, 5)
+
+        asyncio.run(scenario())
+        self.assertEqual(entered, [True])
+        self.assertEqual(cache._key_locks, {})
+
+    @mock.patch("comfyui_worker._comfyui_has_input", return_value=False)
+    @mock.patch("comfyui_worker.upload_to_comfyui", return_value="asset_abc.png")
+    def test_asset_cache_reuploads_blob_when_comfyui_lost_file(self, mock_upload, _has_input):
+        _, cache = self._asset_cache()
+        asset = [{"placeholder": "__A__", "download_url": "https://s3/a.png", "content_hash": "abc"}]
+        with mock.patch.object(worker, "_asset_cache", cache), \
+                mock.patch("comfyui_worker.download_input", side_effect=self._fake_download()) as mock_download:
+            asyncio.run(worker.download_and_upload_assets(asset, "http://comfy"))
+            cache._verified.clear()
+            asyncio.run(worker.download_and_upload_assets(asset, "http://comfy"))
+        self.assertEqual(mock_download.call_count, 1)
+        self.assertEqual(mock_upload.call_count, 2)
+
+    @mock.patch("comfyui_worker.upload_to_comfyui")
+    def test_download_and_upload_assets_fetches_in_parallel(self, mock_upload):
+        barrier = asyncio.Barrier(3)
+
+        async def download(url, content_hash=None):
+            await asyncio.wait_for(barrier.wait(), 5)  # only passes when all three downloads run at once
+            return self._fake_download()(url)
+
+        mock_upload.side_effect = lambda path, endpoint, *args: f"up-{os.path.basename(path)}"
+        assets = [
+            {"placeholder": f"__P{index}__", "download_url": f"https://s3/{index}.png", "is_primary_input": True}
+            for index in range(3)
+        ]
+        timings = []
+        with mock.patch("comfyui_worker.download_input", side_effect=download):
+            result = asyncio.run(worker.download_and_upload_assets(assets, "http://comfy", timings))
+
+        self.assertEqual(list(result), ["__P0__", "__P1__", "__P2__"])
+        self.assertEqual([entry["placeholder"] for entry in timings], list(result))
+        self.assertTrue(all(entry["source"] == "download" for entry in timings))
+
+    def test_asset_cache_evicts_least_recently_used_blobs(self):
+        _, cache = self._asset_cache(max_bytes=8)
+        for content_hash in ("old", "new"):
+            path = self._fake_download(b"12345")("")
+            cache.store(content_hash, "http://comfy", f"{content_hash}.png", path)
+        self.assertIsNone(cache.blob_path("old"))
+        self.assertIsNotNone(cache.blob_path("new"))
+
+    @mock.patch.object(worker._s3_http, "put")
+    @mock.patch.object(worker._comfyui_http, "send")
+    def test_transfer_comfyui_output_streams_without_temp_file(self, mock_send, mock_put):
+        mock_send.return_value = DummyResponse(content=b"video-bytes", headers={"Content-Length": "11"})
+        sent = []
+        mock_put.side_effect = lambda url, data=None, headers=None: UploadResponse(data, sent)
+
+        with mock.patch("comfyui_worker.tempfile.NamedTemporaryFile") as mock_tmp:
+            size, mime_type, path = asyncio.run(worker.transfer_comfyui_output(
+                {"filename": "out.mp4"}, "https://s3/put", {"Content-Type": ["video/mp4"]}
+            ))
+        mock_tmp.assert_not_called()
+        self.assertEqual((size, mime_type, path), (11, "video/mp4", None))
+        self.assertEqual(sent, [b"video-bytes"])
+        self.assertEqual(mock_put.call_args.kwargs["headers"], {"Content-Type": "video/mp4", "Content-Length": "11"})
+
+    @mock.patch.object(worker._s3_http, "put")
+    @mock.patch.object(worker._comfyui_http, "send")
+    def test_transfer_comfyui_output_rejects_truncated_stream(self, mock_send, mock_put):
+        mock_send.return_value = DummyResponse(content=b"video", headers={"Content-Length": "11"})
+        mock_put.side_effect = lambda url, data=None, headers=None: UploadResponse(data, [])
+
+        with self.assertRaisesRegex(RuntimeError, "sent 5 of 11 bytes"):
+            asyncio.run(worker.transfer_comfyui_output({"filename": "out.mp4"}, "https://s3/put", {}))
+
+    @mock.patch.object(worker._s3_http, "put")
+    @mock.patch.object(worker._comfyui_http, "send")
+    def test_transfer_comfyui_output_spools_when_length_unknown(self, mock_send, mock_put):
+        mock_send.return_value = DummyResponse(content=b"png-bytes")
+        mock_put.return_value = DummyResponse()
+        size, mime_type, path = asyncio.run(worker.transfer_comfyui_output({"filename": "out.png"}, "https://s3/put", {}))
+        try:
+            self.assertEqual((size, mime_type), (9, "image/png"))
+            with open(path, "rb") as handle:
+                self.assertEqual(handle.read(), b"png-bytes")
+            mock_put.assert_called_once()
+        finally:
+            os.remove(path)
+
+    def _colocated_root(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        patcher = mock.patch.object(worker, "COMFYUI_ROOT", root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return root
+
+    @mock.patch.object(worker._comfyui_http, "post")
+    def test_upload_to_comfyui_links_into_input_dir_when_colocated(self, mock_post):
+        root = self._colocated_root()
+        source = self._fake_download(b"ref")("")
+        self.addCleanup(os.remove, source)
+
+        name = asyncio.run(worker.upload_to_comfyui(source, "http://comfy", "asset_x.png"))
+
+        self.assertEqual(name, "asset_x.png")
+        with open(os.path.join(root, "input", "asset_x.png"), "rb") as handle:
+            self.assertEqual(handle.read(), b"ref")
+        self.assertTrue(asyncio.run(worker._comfyui_has_input("http://comfy", "asset_x.png")))
+        mock_post.assert_not_called()
+
+    @mock.patch("comfyui_worker.upload_output")
+    @mock.patch.object(worker._comfyui_http, "send")
+    def test_transfer_comfyui_output_reads_output_dir_when_colocated(self, mock_send, mock_upload):
+        root = self._colocated_root()
+        os.makedirs(os.path.join(root, "output", "sub"))
+        with open(os.path.join(root, "output", "sub", "out.mp4"), "wb") as handle:
+            handle.write(b"rendered")
+
+        size, mime_type, path = asyncio.run(worker.transfer_comfyui_output(
+            {"filename": "out.mp4", "subfolder": "sub", "type": "output"}, "https://s3/put", {}
+        ))
+
+        self.assertEqual((size, mime_type, path), (8, "video/mp4", None))
+        self.assertTrue(mock_upload.call_args.args[2].endswith(os.path.join("sub", "out.mp4")))
+        mock_send.assert_not_called()
+        with self.assertRaises(RuntimeError):
+            asyncio.run(worker.transfer_comfyui_output({"filename": "../../etc/passwd"}, "https://s3/put", {}))
+
+    @mock.patch.object(worker, "HTTP_RETRY_BACKOFF_SECONDS", 0)
+    @mock.patch("comfyui_worker._backend_post")
+    @mock.patch.object(worker._s3_http, "put")
+    def test_upload_output_multipart_retries_parts_and_completes(self, mock_put, mock_post):
+        content = b"abcdefghij"
+        mock_post.side_effect = lambda path, payload: {"data": {
+            "upload_id": "u1",
+            "part_size": 4,
+            "part_urls": [{"part_number": n, "url": f"https://s3/part/{n}"} for n in (3, 1, 2)],
+        }} if path == "/api/worker/output-multipart" else {}
+        attempts = {}
+
+        def put(url, data=None, headers=None):
+            attempts[url] = attempts.get(url, 0) + 1
+            self.assertEqual(headers["Content-MD5"], base64.b64encode(hashlib.md5(data).digest()).decode())
+            if url.endswith("/2") and attempts[url] == 1:
+                return DummyResponse(status=503)
+            return DummyResponse(headers={"ETag": f'"{data.decode()}"'})
+
+        async def read_range(start, length):
+            return content[start:start + length]
+
+        mock_put.side_effect = put
+
+        with mock.patch.object(worker, "OUTPUT_MULTIPART_THRESHOLD_BYTES", 8):
+            sent = asyncio.run(worker.upload_output_multipart(7, "lease", len(content), "video/mp4", read_range))
+
+        self.assertTrue(sent)
+        self.assertEqual(attempts["https://s3/part/2"], 2)
+        complete = mock_post.call_args_list[-1]
+        self.assertEqual(complete.args[0], "/api/worker/output-multipart/complete")
+        self.assertEqual(complete.args[1]["parts"], [
+            {"part_number": 1, "etag": '"abcd"'},
+            {"part_number": 2, "etag": '"efgh"'},
+            {"part_number": 3, "etag": '"ij"'},
+        ])
+
+    @mock.patch.object(worker, "HTTP_RETRY_BACKOFF_SECONDS", 0)
+    @mock.patch("comfyui_worker._backend_post")
+    @mock.patch.object(worker._s3_http, "put")
+    def test_upload_output_multipart_aborts_on_part_failure(self, mock_put, mock_post):
+        mock_post.return_value = {"data": {
+            "upload_id": "u1",
+            "part_size": 4,
+            "part_urls": [{"part_number": 1, "url": "https://s3/part/1"}, {"part_number": 2, "url": "https://s3/part/2"}],
+        }}
+        mock_put.side_effect = aiohttp.ClientConnectionError("reset")
+
+        async def read_range(start, length):
+            return b"x" * length
+
+        with self.assertRaises(aiohttp.ClientConnectionError):
+            asyncio.run(worker.upload_output_multipart(7, "lease", 6, None, read_range))
+
+        self.assertEqual(mock_post.call_args.args[0], "/api/worker/output-multipart/abort")
+        self.assertGreaterEqual(mock_put.call_count, worker.OUTPUT_MULTIPART_PART_RETRIES + 1)
+
+    @mock.patch("comfyui_worker.upload_output")
+    @mock.patch("comfyui_worker.upload_output_multipart", return_value=True)
+    @mock.patch.object(worker._comfyui_http, "send")
+    def test_transfer_comfyui_output_uses_ranged_multipart_for_large_outputs(self, mock_send, mock_multipart, mock_upload):
+        mock_send.return_value = DummyResponse(content=b"0123456789", headers={"Content-Length": "10", "Accept-Ranges": "bytes"})
+
+        with mock.patch.object(worker, "OUTPUT_MULTIPART_THRESHOLD_BYTES", 8):
+            result = asyncio.run(worker.transfer_comfyui_output(
+                {"filename": "out.mp4"}, "https://s3/put", {}, dispatch_id=7, lease_token="lease"
+            ))
+
+        self.assertEqual(result, (10, "video/mp4", None))
+        self.assertEqual(mock_multipart.call_args.args[:4], (7, "lease", 10, "video/mp4"))
+        mock_upload.assert_not_called()
+
+    @mock.patch("comfyui_worker._backend_post")
+    def test_complete_job_accepts_streamed_size(self, mock_post):
+        asyncio.run(worker.complete_job(1, "t", "p", None, output_size=42, output_mime_type="image/png"))
+        output = mock_post.call_args.args[1]["output"]
+        self.assertEqual(output, {"size": 42, "mime_type": "image/png"})
+
+    @mock.patch.object(worker._comfyui_http, "get")
+    @mock.patch.object(worker._comfyui_http, "post")
+    def test_run_comfyui_success(self, mock_post, mock_get):
         mock_post.return_value = DummyResponse(payload={"prompt_id": "123"})
         mock_get.return_value = DummyResponse(payload={
             "123": {
@@ -107,22 +587,727 @@ class WorkerTests(unittest.TestCase):
             }
         })
 
-        prompt_id, outputs, record = worker.run_comfyui({"node": {}}, None)
+        prompt_id, outputs, record = asyncio.run(worker.run_comfyui({"node": {}}, None))
         self.assertEqual(prompt_id, "123")
         self.assertIn("node", outputs)
         self.assertIn("outputs", record)
 
-    @mock.patch("comfyui_worker.time.sleep", return_value=None)
-    @mock.patch("comfyui_worker.requests.get")
-    @mock.patch("comfyui_worker.requests.post")
-    def test_run_comfyui_error(self, mock_post, mock_get, _sleep):
+    @mock.patch.object(worker._comfyui_http, "get")
+    @mock.patch.object(worker._comfyui_http, "post")
+    def test_run_comfyui_error(self, mock_post, mock_get):
         mock_post.return_value = DummyResponse(payload={"prompt_id": "err"})
         mock_get.return_value = DummyResponse(payload={
             "err": {"status": {"status_str": "error", "message": "fail"}}
         })
 
         with self.assertRaises(RuntimeError):
-            worker.run_comfyui({"node": {}}, None)
+            asyncio.run(worker.run_comfyui({"node": {}}, None))
+
+    def test_http_pools_reuse_session_per_upstream(self):
+        pool = worker._HttpPool("test", timeout=5, retries=2, status_forcelist=(503,))
+        session = mock.Mock(closed=False)
+        session.request = mock.AsyncMock()
+        refused = aiohttp.ClientConnectorError(mock.Mock(), OSError(111, "refused"))
+
+        async def status(method, responses, idempotent=False):
+            session.request.reset_mock()
+            session.request.side_effect = responses
+            async with pool.request(method, "https://example.com", idempotent=idempotent) as resp:
+                return resp.status, session.request.call_count
+
+        async def scenario():
+            # a 503 after a committed POST must not re-send it unless the call opts in
+            self.assertEqual(await status("POST", [DummyResponse(status=503)]), (503, 1))
+            self.assertEqual(await status("POST", [DummyResponse(status=503), DummyResponse()], idempotent=True), (200, 2))
+            self.assertEqual(await status("GET", [DummyResponse(status=503), DummyResponse()]), (200, 2))
+            # nothing reached the server, so even a POST goes again
+            self.assertEqual(await status("POST", [refused, DummyResponse()]), (200, 2))
+            with self.assertRaises(aiohttp.ClientConnectorError):
+                await status("GET", [refused] * 3)
+
+        with mock.patch.object(pool, "_build_session", return_value=session) as build:
+            asyncio.run(scenario())
+        build.assert_called_once()
+        self.assertEqual(session.request.call_args.kwargs["timeout"].sock_read, 5)
+
+    def test_imds_client_reuses_token_and_caches_static_metadata(self):
+        http = mock.Mock()
+        http.put.side_effect = [DummyResponse(content=b"tok-1"), DummyResponse(content=b"tok-2")]
+        http.get.side_effect = [
+            DummyResponse(content=b"g5.xlarge"),
+            DummyResponse(status=404, content=b""),
+            DummyResponse(status=401, content=b""),
+            DummyResponse(content=b"InService"),
+        ]
+        imds = worker._ImdsClient(http, token_ttl=60)
+
+        async def scenario():
+            self.assertEqual(await imds.get_static("meta-data/instance-type"), "g5.xlarge")
+            self.assertEqual(await imds.get_static("meta-data/instance-type"), "g5.xlarge")
+            self.assertIsNone(await imds.get("meta-data/spot/instance-action"))
+            self.assertEqual(http.put.call_count, 1)
+
+            self.assertEqual(await imds.get("meta-data/autoscaling/target-lifecycle-state"), "InService")
+
+        asyncio.run(scenario())
+        self.assertEqual(http.put.call_count, 2)
+        self.assertEqual(http.get.call_args.kwargs["headers"], {"X-aws-ec2-metadata-token": "tok-2"})
+
+    @mock.patch("comfyui_worker._sleep_unless_shutdown")
+    def test_termination_monitor_makes_one_check_per_tick(self, mock_sleep):
+        calls = []
+
+        def check(name, fire_on):
+            async def run():
+                calls.append(name)
+                return len(calls) == fire_on
+            return run
+
+        with mock.patch.object(worker, "_instance_lifecycle", return_value="on-demand"):
+            self.assertEqual([c[0] for c in asyncio.run(worker._termination_checks())], ["asg_termination"])
+
+        checks = [("spot_interruption", check("spot", 0), "spot"), ("asg_termination", check("asg", 4), "asg")]
+        with mock.patch.object(worker, "_termination_checks", return_value=checks), \
+                mock.patch.object(worker, "_shutdown_requested", False), \
+                mock.patch.object(worker, "_shutdown_reason", ""):
+            asyncio.run(worker._termination_monitor(interval=0))
+            self.assertEqual(worker._shutdown_reason, "asg_termination")
+        self.assertEqual(calls, ["spot", "asg", "spot", "asg"])
+        self.assertEqual(mock_sleep.call_count, 3)
+
+    def _wait_until(self, predicate, timeout=2.0):
+        deadline = worker.time.monotonic() + timeout
+        while not predicate():
+            if worker.time.monotonic() > deadline:
+                self.fail("condition not reached")
+            worker.time.sleep(0.005)
+
+    def test_scale_in_protection_only_calls_aws_on_settled_changes(self):
+        client = mock.Mock()
+        factory = mock.Mock(return_value=client)
+        protection = worker.ScaleInProtection("asg", "i-1", settle_seconds=0.2, client_factory=factory)
+        self.addCleanup(protection.close)
+
+        protection.set(True)
+        self._wait_until(lambda: protection.applied is True)
+        for _ in range(5):
+            protection.set(True)
+        protection.set(False)
+        protection.set(True)  # next job leased before the settle delay ran out
+        worker.time.sleep(0.3)
+        self.assertEqual(client.set_instance_protection.call_count, 1)
+
+        protection.set(False)
+        self._wait_until(lambda: protection.applied is False)
+        self.assertEqual(
+            [c.kwargs["ProtectedFromScaleIn"] for c in client.set_instance_protection.call_args_list], [True, False]
+        )
+        factory.assert_called_once()
+
+    def test_scale_in_protection_retries_failures_and_flushes(self):
+        client = mock.Mock()
+        client.set_instance_protection.side_effect = [RuntimeError("throttled"), None, None]
+        protection = worker.ScaleInProtection("asg", "i-1", settle_seconds=60, client_factory=lambda: client)
+        protection._retry_delay = 0.01
+        self.addCleanup(protection.close)
+
+        protection.set(True)
+        self._wait_until(lambda: protection.applied is True)
+        self.assertEqual(client.set_instance_protection.call_count, 2)
+
+        protection.set(False)
+        self.assertTrue(protection.flush())
+        self.assertIs(protection.applied, False)
+
+        disabled = worker.ScaleInProtection("", "i-1", client_factory=mock.Mock())
+        disabled.set(True)
+        self.assertTrue(disabled.flush())
+        disabled._client_factory.assert_not_called()
+
+    def test_job_poller_long_polls_back_to_back(self):
+        sleeps = []
+        with mock.patch("comfyui_worker._poll_backend") as mock_poll:
+            mock_poll.side_effect = [
+                {"job": None, "long_poll": True, "wait_seconds": 20},
+                {"job": {"dispatch_id": 1}},
+            ]
+            poller = worker.JobPoller(long_wait=20, sleep=self._recording_sleep(sleeps))
+
+            self.assertEqual(asyncio.run(poller.next_jobs(0, 1)), [])
+            self.assertEqual(asyncio.run(poller.next_jobs(0, 1)), [{"dispatch_id": 1}])
+        self.assertEqual(sleeps, [])
+        self.assertEqual([c.args[2] for c in mock_poll.call_args_list], [20, 20])
+
+    def _recording_sleep(self, sleeps):
+        async def sleep(seconds):
+            sleeps.append(seconds)
+        return sleep
+
+    @mock.patch("comfyui_worker._poll_backend")
+    def test_job_poller_falls_back_to_jittered_backoff(self, mock_poll):
+        sleeps = []
+        mock_poll.side_effect = [{"job": None}, {"job": None}, RuntimeError("502"), {"job": None}, {"job": {"id": 1}}, {}]
+        poller = worker.JobPoller(long_wait=20, min_delay=1, max_delay=4, sleep=self._recording_sleep(sleeps))
+
+        for _ in range(6):
+            asyncio.run(poller.next_jobs(0, 1))
+
+        self.assertEqual(mock_poll.call_args_list[0].args[2], 20)
+        self.assertTrue(all(c.args[2] == 0 for c in mock_poll.call_args_list[1:]))
+        bounds = [(0.5, 1), (1, 2), (2, 4), (2, 4), (0.5, 1)]
+        self.assertEqual(len(sleeps), len(bounds))
+        for slept, (low, high) in zip(sleeps, bounds):
+            self.assertTrue(low <= slept <= high, (slept, low, high))
+
+    @mock.patch.object(worker._backend_http, "post")
+    def test_job_poller_requests_batch_and_reads_jobs_list(self, mock_post):
+        jobs = [{"dispatch_id": 1, "lease_token": "a"}, {"dispatch_id": 2, "lease_token": "b"}]
+        mock_post.side_effect = [
+            DummyResponse(payload={"data": {"job": jobs[0], "jobs": jobs}}),
+            DummyResponse(payload={"data": {"job": jobs[1]}}),
+        ]
+        poller = worker.JobPoller(long_wait=0, sleep=mock.AsyncMock())
+
+        self.assertEqual(asyncio.run(poller.next_jobs(1, 4, max_jobs=3)), jobs)
+        self.assertEqual(mock_post.call_args.kwargs["json"]["max_jobs"], 3)
+        self.assertEqual(asyncio.run(poller.next_jobs(3, 4, max_jobs=1)), [jobs[1]])
+        self.assertNotIn("max_jobs", mock_post.call_args.kwargs["json"])
+
+    def test_sleep_unless_shutdown_wakes_on_shutdown_request(self):
+        async def scenario():
+            sleeper = asyncio.create_task(worker._sleep_unless_shutdown(30))
+            await asyncio.sleep(0)
+            threading.Thread(target=worker._request_shutdown, args=("sigterm",)).start()
+            await asyncio.wait_for(sleeper, 5)
+
+        with mock.patch.object(worker, "_shutdown_requested", False), \
+                mock.patch.object(worker, "_shutdown_reason", ""):
+            asyncio.run(scenario())
+        self.assertEqual(worker._shutdown_listeners, [])
+
+    @mock.patch("comfyui_worker._requeue_job")
+    def test_requeue_unstarted_hands_back_jobs_waiting_for_gpu(self, mock_requeue):
+        async def scenario():
+            release = asyncio.Event()
+            rendering = asyncio.Event()
+
+            async def runner(job, state):
+                async with worker._render_slot(state):
+                    rendering.set()
+                    await release.wait()
+
+            executor = worker.JobExecutor(1, runner=runner, heartbeat_interval=60, prefetch_depth=1)
+            executor.submit({"dispatch_id": 1, "lease_token": "a"})
+            await asyncio.wait_for(rendering.wait(), 2)
+            waiting = executor.submit({"dispatch_id": 2, "lease_token": "b"})
+            await asyncio.sleep(0)
+
+            self.assertEqual(await executor.requeue_unstarted("sigterm"), 1)
+            mock_requeue.assert_called_once_with(2, "b", "sigterm")
+            release.set()
+            self.assertTrue(await executor.drain(5))
+            self.assertTrue(waiting.task.cancelled())
+
+        with mock.patch("comfyui_worker.heartbeat"):
+            asyncio.run(scenario())
+        mock_requeue.assert_called_once()
+
+    @mock.patch.object(worker._backend_http, "post")
+    def test_poll_extends_timeout_for_long_poll(self, mock_post):
+        mock_post.return_value = DummyResponse(payload={"data": {"job": None, "long_poll": True}})
+        self.assertIsNone(asyncio.run(worker.poll(0, wait_seconds=20)))
+        self.assertEqual(mock_post.call_args.kwargs["json"]["wait_seconds"], 20)
+        self.assertEqual(mock_post.call_args.kwargs["timeout"], worker.BACKEND_HTTP_TIMEOUT_SECONDS + 20)
+
+    @mock.patch.object(worker._backend_http, "post")
+    def test_backend_post_uses_pool_default_timeout(self, mock_post):
+        mock_post.return_value = DummyResponse(payload={"data": {"job": None}})
+        self.assertIsNone(asyncio.run(worker.poll(0)))
+        mock_post.assert_called_once()
+        self.assertNotIn("timeout", mock_post.call_args.kwargs)
+
+    def test_job_executor_runs_jobs_concurrently_up_to_limit(self):
+        started = []
+
+        async def scenario():
+            release = asyncio.Event()
+
+            async def runner(job, state):
+                started.append(job["dispatch_id"])
+                await release.wait()
+
+            executor = worker.JobExecutor(2, runner=runner)
+            executor.submit({"dispatch_id": 1, "lease_token": "a"})
+            executor.submit({"dispatch_id": 2, "lease_token": "b"})
+            self.assertEqual(executor.current_load, 2)
+            self.assertFalse(executor.has_capacity())
+            with self.assertRaises(RuntimeError):
+                executor.submit({"dispatch_id": 3, "lease_token": "c"})
+
+            await asyncio.sleep(0)
+            release.set()
+            self.assertTrue(await executor.drain(5))
+            self.assertEqual(executor.current_load, 0)
+
+        asyncio.run(scenario())
+        self.assertEqual(sorted(started), [1, 2])
+
+    def test_job_executor_routes_jobs_across_pool_instances(self):
+        endpoints = {}
+
+        async def runner(job, state):
+            endpoints[job["dispatch_id"]] = state.endpoint
+
+        async def scenario():
+            executor = worker.JobExecutor(2, runner=runner, prefetch_depth=2, pool=pool)
+            first = executor.submit({"dispatch_id": 1, "lease_token": "a"})
+            second = executor.submit({"dispatch_id": 2, "lease_token": "b"})
+            self.assertIsNot(first.render_slots, second.render_slots)
+            self.assertTrue(await executor.drain(5))
+
+        pool = worker.ComfyUIPool(["http://gpu0", "http://gpu1"], admission_enabled=False)
+        asyncio.run(scenario())
+        self.assertEqual(sorted(endpoints.values()), ["http://gpu0", "http://gpu1"])
+        self.assertEqual([instance.assigned for instance in pool.instances], [0, 0])
+
+    @mock.patch("comfyui_worker.fail_job")
+    def test_job_executor_reports_failures(self, mock_fail):
+        async def runner(job, state):
+            raise RuntimeError("boom")
+
+        async def scenario():
+            executor = worker.JobExecutor(1, runner=runner)
+            executor.submit({"dispatch_id": 7, "lease_token": "tok"})
+            self.assertTrue(await executor.drain(5))
+
+        asyncio.run(scenario())
+        mock_fail.assert_called_once_with(7, "tok", "boom", metadata=mock.ANY)
+        timings = mock_fail.call_args.kwargs["metadata"]["timings"]
+        self.assertIn("total_ms", timings)
+        self.assertIsInstance(timings["stages"], dict)
+
+    @mock.patch("comfyui_worker.complete_job")
+    @mock.patch("comfyui_worker.transfer_comfyui_output", return_value=(4, "image/png", None))
+    @mock.patch("comfyui_worker.run_comfyui")
+    def test_process_job_reports_stage_timings(self, mock_run, mock_transfer, mock_complete):
+        mock_run.return_value = ("prompt-1", {"9": {"images": [{"filename": "a.png"}]}}, {})
+        job = {
+            "dispatch_id": 3,
+            "lease_token": "tok",
+            "output_url": "https://s3/out",
+            "input_payload": {"workflow": {"1": {"inputs": {}}}, "output_node_id": "9"},
+        }
+
+        asyncio.run(worker.process_job(job))
+
+        metadata = mock_complete.call_args.args[4]
+        self.assertIn("prepare_workflow", metadata["timings"]["stages"])
+        self.assertIn("extract_outputs", metadata["timings"]["stages"])
+        self.assertIsNotNone(mock_transfer.call_args.kwargs["timings"])
+
+    def test_metrics_render_prometheus_text_and_openmetrics(self):
+        registry = worker._MetricsRegistry({"fleet_slug": "gpu-default", "fleet_stage": "staging"})
+        polls = registry.counter("demo_polls_total", "Polls.", ("result",))
+        latency = registry.histogram("demo_seconds", "Latency.", (0.1, 1.0))
+        polls.inc(result="empty")
+        polls.inc(2, result='a"b')
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+
+        text = registry.render()
+        self.assertIn("# TYPE demo_polls_total counter", text)
+        self.assertIn('demo_polls_total{fleet_slug="gpu-default",fleet_stage="staging",result="empty"} 1', text)
+        self.assertIn('result="a\\"b"} 2', text)
+        self.assertIn('demo_seconds_bucket{fleet_slug="gpu-default",fleet_stage="staging",le="0.1"} 1', text)
+        self.assertIn('demo_seconds_bucket{fleet_slug="gpu-default",fleet_stage="staging",le="1"} 2', text)
+        self.assertIn('le="+Inf"} 3', text)
+        self.assertIn('demo_seconds_sum{fleet_slug="gpu-default",fleet_stage="staging"} 5.55', text)
+
+        openmetrics = registry.render(openmetrics=True)
+        self.assertIn("# TYPE demo_polls counter", openmetrics)
+        self.assertTrue(openmetrics.endswith("# EOF\n"))
+
+    def test_metrics_endpoint_reports_polls_and_backend_status_codes(self):
+        session = mock.Mock(closed=False)
+        session.request = mock.AsyncMock(side_effect=[
+            DummyResponse(payload={"data": {"job": None}}),
+            aiohttp.ClientConnectionError("refused"),
+        ])
+        server = worker.start_metrics_server(port=0, host="127.0.0.1")
+        try:
+            with mock.patch.multiple(worker._backend_http, _session=None, _build_session=mock.Mock(return_value=session)):
+                asyncio.run(worker._poll_backend(0))
+                with self.assertRaises(aiohttp.ClientConnectionError):
+                    asyncio.run(worker._poll_backend(0))
+            port = server.server_address[1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as resp:
+                text = resp.read().decode()
+            with self.assertRaises(urllib.error.HTTPError) as missing:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/other", timeout=5)
+            missing.exception.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(missing.exception.code, 404)
+        self.assertRegex(text, r'comfyui_worker_polls_total\{[^}]*result="empty"\} \d+')
+        self.assertRegex(text, r'comfyui_worker_polls_total\{[^}]*result="error"\} \d+')
+        self.assertRegex(text, r'comfyui_worker_backend_responses_total\{[^}]*path="/api/worker/poll",code="200"\}')
+        self.assertRegex(text, r'comfyui_worker_backend_responses_total\{[^}]*path="/api/worker/poll",code="error"\}')
+        self.assertIn('comfyui_worker_poll_duration_seconds_count{fleet_slug=', text)
+
+    def test_job_timings_sum_stages_and_order_spans(self):
+        timings = worker.JobTimings(started=100.0)
+        timings.record("output_upload", 100.5, 100.75)
+        timings.record("comfyui_execution", 100.1, 100.4)
+        timings.record("output_upload", 100.8, 100.9)
+
+        metadata = timings.metadata()
+
+        self.assertEqual(metadata["stages"], {"comfyui_execution": 300.0, "output_upload": 350.0})
+        self.assertEqual([span["stage"] for span in metadata["spans"]],
+                         ["comfyui_execution", "output_upload", "output_upload"])
+        self.assertEqual(metadata["spans"][0], {"stage": "comfyui_execution", "start_ms": 100.0, "duration_ms": 300.0})
+
+    def test_comfyui_phases_split_queue_wait_from_execution(self):
+        timings = worker.JobTimings(started=0.0)
+        record = {"status": {"messages": [
+            ["execution_start", {"prompt_id": "p", "timestamp": 1_000_002_000}],
+            ["execution_cached", {"prompt_id": "p", "timestamp": 1_000_002_001}],
+            ["execution_success", {"prompt_id": "p", "timestamp": 1_000_007_000}],
+        ]}}
+
+        worker._record_comfyui_phases(timings, record, submitted=10.0, submitted_wall=1_000_000.0, finished=18.0)
+
+        self.assertEqual(timings.metadata()["stages"], {
+            "comfyui_queue_wait": 2000.0,
+            "comfyui_execution": 5000.0,
+            "comfyui_result_fetch": 1000.0,
+        })
+
+        untimed = worker.JobTimings(started=0.0)
+        worker._record_comfyui_phases(untimed, {"status": {}}, submitted=1.0, submitted_wall=5.0, finished=4.0)
+        self.assertEqual(untimed.metadata()["stages"], {"comfyui_execution": 3000.0})
+
+    @mock.patch("comfyui_worker.fail_job")
+    def test_job_executor_writes_timing_log(self, mock_fail):
+        async def runner(job, state):
+            with state.timings.span("prepare_workflow"):
+                if job["dispatch_id"] == 2:
+                    raise RuntimeError("boom")
+
+        async def scenario():
+            executor = worker.JobExecutor(2, runner=runner)
+            executor.submit({"dispatch_id": 1, "lease_token": "a"})
+            executor.submit({"dispatch_id": 2, "lease_token": "b"})
+            self.assertTrue(await executor.drain(5))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            worker.JOB_TIMING_LOG_PATH = os.path.join(tmpdir, "timings.jsonl")
+            asyncio.run(scenario())
+
+            with open(worker.JOB_TIMING_LOG_PATH, encoding="utf-8") as handle:
+                entries = [json.loads(line) for line in handle]
+
+        outcomes = {entry["dispatch_id"]: entry["outcome"] for entry in entries}
+        self.assertEqual(outcomes, {1: "completed", 2: "failed"})
+        self.assertTrue(all("prepare_workflow" in entry["stages"] for entry in entries))
+
+    @mock.patch("comfyui_worker.fail_job")
+    @mock.patch("comfyui_worker._requeue_job")
+    def test_job_executor_requeue_all_cancels_in_flight_jobs(self, mock_requeue, mock_fail):
+        async def scenario():
+            started = asyncio.Event()
+
+            async def runner(job, state):
+                started.set()
+                await asyncio.Event().wait()  # only cancellation ends this job
+
+            executor = worker.JobExecutor(2, runner=runner)
+            state = executor.submit({"dispatch_id": 11, "lease_token": "x"})
+            await asyncio.wait_for(started.wait(), 5)
+            await executor.requeue_all("spot_interruption")
+            self.assertTrue(await executor.drain(5))
+            self.assertTrue(state.task.cancelled())
+
+        asyncio.run(scenario())
+        mock_requeue.assert_called_once_with(11, "x", "spot_interruption")
+        mock_fail.assert_not_called()
+
+    def test_job_executor_prefetch_overlaps_io_but_serializes_renders(self):
+        rendering = []
+        peak = []
+
+        async def scenario():
+            prepared = asyncio.Barrier(2)
+
+            async def runner(job, state):
+                await asyncio.wait_for(prepared.wait(), 5)  # both jobs are in their download stage at once
+                async with worker._render_slot(state):
+                    rendering.append(job["dispatch_id"])
+                    peak.append(len(rendering))
+                    await asyncio.sleep(0.05)
+                    rendering.remove(job["dispatch_id"])
+
+            executor = worker.JobExecutor(1, runner=runner, prefetch_depth=1)
+            self.assertEqual(executor.capacity, 2)
+            executor.submit({"dispatch_id": 1, "lease_token": "a"})
+            executor.submit({"dispatch_id": 2, "lease_token": "b"})
+            self.assertTrue(await executor.drain(5))
+
+        asyncio.run(scenario())
+        self.assertEqual(max(peak), 1)
+        self.assertEqual(len(peak), 2)
+
+    @mock.patch("comfyui_worker.fail_job")
+    @mock.patch("comfyui_worker._requeue_job")
+    def test_render_slot_requeues_prefetched_job_past_deadline(self, mock_requeue, mock_fail):
+        state = worker.JobState({"dispatch_id": 5, "lease_token": "t"})
+        state.render_slots = asyncio.Semaphore(0)
+        state.render_deadline = 0
+
+        async def render():
+            async with worker._render_slot(state):
+                self.fail("render slot should not be granted")
+
+        with self.assertRaises(worker.JobCancelled):
+            asyncio.run(render())
+        self.assertTrue(state.requeued)
+        mock_requeue.assert_called_once_with(5, "t", "prefetch_timeout")
+
+    def test_lease_seconds_remaining_parses_backend_timestamp(self):
+        remaining = worker._lease_seconds_remaining({"lease_expires_at": "2000-01-01T00:00:00+00:00"})
+        self.assertLess(remaining, 0)
+        self.assertIsNone(worker._lease_seconds_remaining({}))
+
+    def test_prefetch_deadline_fits_inside_presigned_output_url(self):
+        signed = worker.time.strftime("%Y%m%dT%H%M%SZ", worker.time.gmtime(worker.time.time() - 700))
+        url = f"https://s3/out.mp4?X-Amz-Date={signed}&X-Amz-Expires=900&X-Amz-Signature=x"
+        self.assertAlmostEqual(worker._presigned_seconds_remaining(url), 200, delta=5)
+        self.assertIsNone(worker._presigned_seconds_remaining("https://s3/out.mp4"))
+
+        with mock.patch.object(worker, "JOB_PREFETCH_MAX_WAIT_SECONDS", 300):
+            wait = worker._prefetch_deadline({"output_url": url}) - worker.time.monotonic()
+            self.assertAlmostEqual(wait, 100, delta=5)
+            wait = worker._prefetch_deadline({"output_url": "https://s3/out.mp4?Expires=1"}) - worker.time.monotonic()
+            self.assertLessEqual(wait, 0)
+
+    @mock.patch("comfyui_worker.cancel_comfyui_prompt")
+    @mock.patch("comfyui_worker.heartbeat")
+    def test_lease_keeper_heartbeats_in_background(self, mock_heartbeat, mock_cancel):
+        state = worker.JobState({"dispatch_id": 3, "lease_token": "t"})
+
+        async def scenario():
+            beats = asyncio.Event()
+            mock_heartbeat.side_effect = lambda *args: beats.set() or {}
+            keeper = worker.LeaseKeeper(state)
+            keeper.interval = 0.01
+            async with keeper:
+                await asyncio.wait_for(beats.wait(), 5)
+
+        asyncio.run(scenario())
+        mock_heartbeat.assert_called_with(3, "t")
+        self.assertFalse(state.cancelled)
+        mock_cancel.assert_not_called()
+
+    @mock.patch("comfyui_worker.cancel_comfyui_prompt")
+    @mock.patch("comfyui_worker.heartbeat")
+    def test_lease_keeper_cancels_prompt_when_lease_lost(self, mock_heartbeat, mock_cancel):
+        mock_heartbeat.side_effect = aiohttp.ClientResponseError(mock.Mock(), (), status=404)
+        state = worker.JobState({"dispatch_id": 4, "lease_token": "t"})
+        state.prompt_id = "p-4"
+
+        async def scenario():
+            state.task = asyncio.create_task(asyncio.Event().wait())
+            keeper = worker.LeaseKeeper(state)
+            keeper.interval = 0.01
+            async with keeper:
+                await asyncio.wait([state.task], timeout=5)
+            self.assertTrue(state.task.cancelled())
+
+        asyncio.run(scenario())
+        self.assertTrue(state.lease_lost)
+        self.assertTrue(state.cancelled)
+        mock_cancel.assert_called_once_with("p-4", endpoint=None)
+        with self.assertRaises(worker.JobCancelled):
+            state.check_cancelled()
+
+    def _comfyui_state(self, queue_state, vram_free=8 * 1024 ** 3):
+        def get(url, **_):
+            if url.endswith("/queue"):
+                return DummyResponse(payload=queue_state)
+            return DummyResponse(payload={"devices": [{"vram_total": 16 * 1024 ** 3, "vram_free": vram_free}]})
+        return get
+
+    @mock.patch("comfyui_worker.cancel_comfyui_prompt")
+    def test_admission_counts_ownerless_prompts_and_reaps_own_orphans(self, mock_cancel):
+        queue_state = {
+            "queue_running": [[1, "mine-running", {}, {"client_id": worker.WORKER_ID}, []]],
+            "queue_pending": [
+                [2, "other", {}, {"client_id": "someone-else"}, []],
+                [3, "orphan", {}, {"client_id": worker.WORKER_ID}, []],
+            ],
+        }
+        admission = worker.ComfyUIAdmission(enabled=True)
+        with mock.patch.object(worker._comfyui_http, "get", side_effect=self._comfyui_state(queue_state)):
+            self.assertEqual(asyncio.run(admission.slots(1, 4, ["mine-running", None])), (2, 2))
+            mock_cancel.assert_not_called()
+            self.assertEqual(asyncio.run(admission.slots(1, 3, ["mine-running"])), (3, 0))
+            self.assertEqual(admission.hold_reason, "comfyui_busy")
+        mock_cancel.assert_called_once_with("orphan", endpoint=None)
+
+        with mock.patch.object(worker._comfyui_http, "get", side_effect=self._comfyui_state({})):
+            self.assertEqual(asyncio.run(admission.slots(0, 3, [])), (0, 3))
+        self.assertEqual(admission.hold_reason, "")
+
+    def test_admission_holds_off_on_low_vram_or_unreachable_comfyui(self):
+        admission = worker.ComfyUIAdmission(enabled=True, min_free_vram_mb=1024)
+        with mock.patch.object(worker._comfyui_http, "get", side_effect=self._comfyui_state({}, vram_free=512 * 1024 ** 2)):
+            self.assertEqual(asyncio.run(admission.slots(0, 2, [])), (0, 0))
+        self.assertEqual(admission.hold_reason, "low_vram")
+
+        with mock.patch.object(worker._comfyui_http, "get", side_effect=aiohttp.ClientConnectionError("refused")):
+            self.assertEqual(asyncio.run(admission.slots(0, 2, [])), (0, 0))
+        self.assertEqual(admission.hold_reason, "comfyui_unreachable")
+
+        self.assertEqual(asyncio.run(worker.ComfyUIAdmission(enabled=False).slots(1, 2, [])), (1, 1))
+
+    def test_pool_routes_to_least_loaded_warm_instance_and_sums_slots(self):
+        pool = worker.ComfyUIPool(["http://gpu0", "http://gpu1", "http://gpu0"], admission_enabled=True)
+        self.assertEqual(pool.endpoints, ["http://gpu0", "http://gpu1"])
+        job_a = {"dispatch_id": 1, "workflow_id": "wf-a"}
+        job_b = {"dispatch_id": 2, "workflow_id": "wf-b"}
+        self.assertEqual(pool.assign(job_a), "http://gpu0")
+        self.assertEqual(pool.assign(job_b), "http://gpu1")
+        pool.release("http://gpu0")
+        pool.release("http://gpu1")
+        # both idle: each job goes back to where its workflow is loaded
+        self.assertEqual(pool.assign(job_b), "http://gpu1")
+        self.assertEqual(pool.assign(job_a), "http://gpu0")
+        pool.release("http://gpu0")
+        pool.release("http://gpu1")
+
+        job_c = {"dispatch_id": 3, "input_payload": {"assets": [{"content_hash": "h1"}]}}
+        with mock.patch.object(worker._asset_cache, "has_upload", side_effect=lambda _hash, endpoint: endpoint == "http://gpu1"):
+            self.assertEqual(pool.assign(job_c), "http://gpu1")
+        pool.release("http://gpu1")
+
+        busy = self._comfyui_state({"queue_pending": [[1, "other", {}, {"client_id": "someone-else"}, []]]})
+        low_vram = self._comfyui_state({}, vram_free=0)
+
+        def get(url, **kwargs):
+            return (busy if url.startswith("http://gpu0") else low_vram)(url, **kwargs)
+
+        pool = worker.ComfyUIPool(["http://gpu0", "http://gpu1"], admission_enabled=True, min_free_vram_mb=1024)
+        with mock.patch.object(worker._comfyui_http, "get", side_effect=get):
+            self.assertEqual(asyncio.run(pool.slots(0, 4, [])), (1, 1))
+        # gpu1 is held for low VRAM, so gpu0 takes the job despite its foreign prompt
+        self.assertEqual(pool.assign(job_a), "http://gpu0")
+
+    @mock.patch.object(worker._comfyui_http, "post")
+    @mock.patch.object(worker._comfyui_http, "get")
+    def test_cancel_comfyui_prompt_interrupts_running_prompt(self, mock_get, mock_post):
+        mock_get.return_value = DummyResponse(payload={"queue_running": [[0, "p-1", {}]], "queue_pending": []})
+        mock_post.return_value = DummyResponse()
+        asyncio.run(worker.cancel_comfyui_prompt("p-1"))
+        self.assertTrue(mock_post.call_args.args[0].endswith("/interrupt"))
+
+        mock_get.return_value = DummyResponse(payload={"queue_running": [], "queue_pending": [[1, "p-2", {}]]})
+        asyncio.run(worker.cancel_comfyui_prompt("p-2"))
+        self.assertTrue(mock_post.call_args.args[0].endswith("/queue"))
+        self.assertEqual(mock_post.call_args.kwargs["json"], {"delete": ["p-2"]})
+
+    def test_event_stream_routes_terminal_events_and_drops_silent_socket(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+
+        def serve():
+            conn, _ = server.accept()
+            reader = conn.makefile("rb")
+            key = ""
+            while True:
+                line = reader.readline().decode().strip()
+                if not line:
+                    break
+                if line.lower().startswith("sec-websocket-key:"):
+                    key = line.split(":", 1)[1].strip()
+            accept = base64.b64encode(hashlib.sha1((key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+            conn.sendall(
+                "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n".encode()
+            )
+            for message in (
+                {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": 2}}}},
+                {"type": "executing", "data": {"node": "3", "prompt_id": "p1"}},
+                {"type": "executing", "data": {"node": None, "prompt_id": "p1"}},
+            ):
+                body = json.dumps(message).encode()
+                conn.sendall(bytes([0x81, len(body)]) + body)
+            try:
+                while conn.recv(1024):  # swallow pings without ever answering them
+                    pass
+            except OSError:
+                pass
+            conn.close()
+
+        async def scenario():
+            stream = worker._ComfyUIEventStream(f"http://127.0.0.1:{port}", "worker-test")
+            try:
+                connects = await asyncio.gather(stream.ensure_connected(), stream.ensure_connected())
+                self.assertEqual(connects, [True, True])
+                event = await stream.wait_for("p1", timeout=5)
+                self.assertEqual(event["data"]["prompt_id"], "p1")
+                self.assertEqual(stream.queue_remaining, 2)
+                with self.assertRaises(ConnectionError):
+                    await stream.wait_for("p2", timeout=5)
+                self.assertFalse(stream.connected)
+            finally:
+                await stream.close()
+                await worker._close_http_pools()
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        try:
+            with mock.patch.object(worker, "_WS_HEARTBEAT_SECONDS", 0.2):
+                asyncio.run(scenario())
+        finally:
+            server.close()
+
+    @mock.patch.object(worker._comfyui_http, "get")
+    @mock.patch.object(worker._comfyui_http, "post")
+    def test_run_comfyui_uses_event_stream_and_fetches_history_once(self, mock_post, mock_get):
+        mock_post.return_value = DummyResponse(payload={"prompt_id": "abc"})
+        mock_get.return_value = DummyResponse(payload={
+            "abc": {"outputs": {"9": {"images": [{"filename": "o.png"}]}}}
+        })
+        stream = mock.AsyncMock()
+        stream.wait_for.return_value = {"type": "executing", "data": {"node": None, "prompt_id": "abc"}}
+
+        with mock.patch("comfyui_worker._comfyui_event_stream", return_value=stream):
+            prompt_id, outputs, _ = asyncio.run(worker.run_comfyui({"node": {}}, None))
+
+        self.assertEqual(prompt_id, "abc")
+        self.assertIn("9", outputs)
+        self.assertEqual(mock_get.call_count, 1)
+        stream.wait_for.assert_called_once()
+
+    @mock.patch.object(worker._comfyui_http, "get")
+    @mock.patch.object(worker._comfyui_http, "post")
+    def test_run_comfyui_raises_on_execution_error_event(self, mock_post, mock_get):
+        mock_post.return_value = DummyResponse(payload={"prompt_id": "bad"})
+        mock_get.return_value = DummyResponse(payload={})
+        stream = mock.AsyncMock()
+        stream.wait_for.return_value = {
+            "type": "execution_error",
+            "data": {"prompt_id": "bad", "exception_message": "CUDA out of memory"},
+        }
+
+        with mock.patch("comfyui_worker._comfyui_event_stream", return_value=stream):
+            with self.assertRaisesRegex(RuntimeError, "CUDA out of memory"):
+                asyncio.run(worker.run_comfyui({"node": {}}, None))
 
     def test_extract_partner_usage_events_from_structured_usage(self):
         workflow = {
@@ -188,10 +1373,69 @@ class WorkerTests(unittest.TestCase):
         self.assertEqual(event["credits"], 3.5)
         self.assertEqual(event["cost_usd_reported"], 0.0245)
 
+    def test_extract_partner_usage_events_merges_usage_node_and_text_in_order(self):
+        workflow = {"4": {"class_type": "KlingVideo", "inputs": {"settings": {"Model-Name": "kling-v2"}}}}
+        history = {
+            "outputs": {
+                "4": {
+                    "result": {"meta": {"Prompt Tokens": "1,200"}, "usage_data": {"credits": "x"}},
+                    "Credits Used": 7,
+                    "ui": {"text": ["filename ignored", "Total tokens: 1500; cost $0.25"]},
+                    "images": [{"filename": "credits 99", "type": "output"}],
+                }
+            }
+        }
+
+        event = worker.extract_partner_usage_events(workflow, history)[0]
+
+        self.assertEqual(event["input_tokens"], 1200)
+        self.assertEqual(event["credits"], 7.0)
+        self.assertEqual(event["total_tokens"], 1500)
+        self.assertEqual(event["cost_usd_reported"], 0.25)
+        self.assertIsNone(event["output_tokens"])
+        self.assertEqual(event["model"], "kling-v2")
+        self.assertEqual(event["provider"], "kling")
+        self.assertEqual(event["usage_json"], {"Prompt Tokens": "1,200"})
+
     def test_extract_partner_usage_events_skips_empty_outputs(self):
         events = worker.extract_partner_usage_events({"1": {"class_type": "SaveImage"}}, {"outputs": {"1": {}}})
         self.assertEqual(events, [])
 
+    def test_benchmark_suite_runs_against_stand_in_servers(self):
+        from benchmarks import bench_worker
+
+        report = bench_worker.run_benchmarks(iterations=1, memory_iterations=1, transfer_bytes=2 * 1024 * 1024)
+
+        self.assertEqual(set(report["benchmarks"]), set(bench_worker.BENCHMARKS))
+        for name, result in report["benchmarks"].items():
+            self.assertNotIn("skipped", result, name)
+            self.assertGreater(result["p50_ms"], 0, name)
+        self.assertEqual(bench_worker.compare(report, report), {})
+        faster_baseline = json.loads(json.dumps(report))
+        faster_baseline["benchmarks"]["sanitize_json"]["p50_ms"] /= 10
+        self.assertEqual(list(bench_worker.compare(report, faster_baseline)), ["sanitize_json"])
+
+    def test_load_test_runs_jobs_through_simulated_comfyui(self):
+        from benchmarks import load_test
+
+        for websocket, instances in ((True, 1), (False, 1), (True, 2)):
+            with self.subTest(websocket=websocket, instances=instances):
+                report = load_test.run_load_test(
+                    jobs=8, websocket=websocket, execution="fixed:0.02",
+                    output_mib="fixed:1", input_mib=1, error_rate=0.25, seed=3, timeout=60, instances=instances,
+                )
+
+                self.assertFalse(report["timed_out"])
+                self.assertEqual(report["completed"] + report["failed"], 8)
+                self.assertEqual(report["failed"], report["comfyui"]["errors"])
+                self.assertEqual(report["unexpected_failures"], 0)
+                # the shared asset is uploaded at most once to each instance
+                self.assertLessEqual(report["comfyui"]["uploads"], instances)
+                self.assertEqual(len(report["comfyui"]["prompts_per_instance"]), instances)
+                self.assertGreater(report["latency_ms"]["p50"], 0)
+                self.assertIn("comfyui_execution", report["stage_p50_ms"])
+        self.assertFalse(worker._shutdown_requested)
+
 
 if __name__ == "__main__":
     unittest.main()